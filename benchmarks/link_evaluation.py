@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+"""Compare the timing of chained link expressions with and without following the links by halo id.
+
+Syntax: link_evaluation.py [num_halos]
+
+A throw-away sqlite database is generated in the current directory, holding a timestep with num_halos halos
+(default 10000) and the same number of black holes, each black hole being assigned to the halo with the same
+number. Chained link expressions like those in test_live_calculation_link_syntax are then evaluated for the whole
+timestep, firstly loading the halos at every level and the target of every link (as before Link followed links by
+halo id), then as normal.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import contextlib
+import os
+import sys
+import time
+
+import tangos
+import tangos.live_calculation as live_calculation
+from tangos import core
+from tangos.core import extraction_patterns
+import tangos.testing.simulation_generator
+from tangos import log
+
+
+EXPRESSIONS = [("BH.host.BH.hole_mass", "BH.host.Mvir"),
+               ("link(BH).hole_mass",),
+               ("BH.host.BH.host.Mvir",)]
+
+
+def build_timestep(num_halos):
+    # objects are added in bulk, since the per-object queries of the simulation generator are too slow at this scale
+    generator = tangos.testing.simulation_generator.TestSimulationGenerator()
+    timestep = generator.add_timestep()
+    session = generator.session
+    Mvir = core.dictionary.get_or_create_dictionary_item(session, "Mvir")
+    hole_mass = core.dictionary.get_or_create_dictionary_item(session, "hole_mass")
+
+    halos = [core.halo.Halo(timestep, n, n, 1000, 0, 0, 0) for n in range(1, num_halos+1)]
+    bhs = [core.halo.Halo(timestep, n, n, 0, 0, 0, 1) for n in range(1, num_halos+1)]
+    session.add_all(halos+bhs)
+    session.add_all([core.halo_data.HaloProperty(h, Mvir, float(h.halo_number)) for h in halos])
+    session.add_all([core.halo_data.HaloProperty(bh, hole_mass, float(bh.halo_number*100)) for bh in bhs])
+    session.add_all([core.halo_data.HaloLink(h, bh, generator._BH_dict) for h, bh in zip(halos, bhs)])
+    session.add_all([core.halo_data.HaloLink(bh, h, generator._host_dict) for h, bh in zip(halos, bhs)])
+    session.commit()
+
+
+@contextlib.contextmanager
+def loading_every_level():
+    original_follows_links_by_id = live_calculation.Link._follows_links_by_id
+    original_postprocess = extraction_patterns.HaloLinkTargetIdGetter.postprocess_data_objects
+
+    live_calculation.Link._follows_links_by_id = lambda self: False
+    extraction_patterns.HaloLinkTargetIdGetter.postprocess_data_objects = \
+        lambda self, outputs: [o.halo_to.id for o in outputs]
+    try:
+        yield
+    finally:
+        live_calculation.Link._follows_links_by_id = original_follows_links_by_id
+        extraction_patterns.HaloLinkTargetIdGetter.postprocess_data_objects = original_postprocess
+
+
+def time_expressions(timestep, expressions, repeats=3):
+    best = None
+    for _ in range(repeats):
+        start = time.time()
+        timestep.calculate_all(*expressions)
+        elapsed = time.time()-start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run_benchmarks(num_halos):
+    timestep = tangos.get_timestep("sim/ts1")
+    print("%d halos and black holes; seconds to evaluate for the whole timestep" % num_halos)
+    print("%-45s %12s %12s %8s" % ("", "all levels", "by id", "speedup"))
+    for expressions in EXPRESSIONS:
+        with loading_every_level():
+            loaded = time_expressions(timestep, expressions)
+        by_id = time_expressions(timestep, expressions)
+        print("%-45s %12.3f %12.3f %7.1fx" % (", ".join(expressions), loaded, by_id, loaded/by_id))
+
+
+if __name__=="__main__":
+    num_halos = int(sys.argv[1]) if len(sys.argv)>1 else 10000
+    db_name = "link_evaluation_benchmark.db"
+    if os.path.exists(db_name):
+        os.remove(db_name)
+    tangos.core.init_db("sqlite:///"+db_name)
+    try:
+        with log.LogCapturer():
+            build_timestep(num_halos)
+        run_benchmarks(num_halos)
+    finally:
+        os.remove(db_name)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+"""Compare the timing of the multi-hop engines (see MultiHopStrategy) on a synthetic deep merger tree.
+
+Syntax: multihop_engines.py [num_timesteps] [halos_per_timestep]
+
+A throw-away sqlite database is generated in the current directory. Every halo is linked to its counterpart in the
+previous and next timesteps, and a fraction of its mass is transferred to a neighbouring halo, so that the major
+progenitor branch has to be chosen from several candidates at every step.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import sys
+import time
+
+import tangos
+import tangos.relation_finding as halo_finding
+import tangos.testing.simulation_generator
+from tangos import log
+from six.moves import range
+
+
+def build_tree(num_timesteps, halos_per_timestep):
+    # the generator's default particle numbers fall to zero by the tenth halo, which would make link weights
+    # undefined; instead, give every halo a positive number of particles, largest first
+    NDM = [100*(halos_per_timestep-n) for n in range(halos_per_timestep)]
+    generator = tangos.testing.simulation_generator.TestSimulationGenerator()
+    generator.add_timestep()
+    generator.add_objects_to_timestep(halos_per_timestep, NDM=NDM)
+    for i in range(1, num_timesteps):
+        generator.add_timestep()
+        generator.add_objects_to_timestep(halos_per_timestep, NDM=NDM)
+        generator.link_last_halos_using_mapping({n: n for n in range(1, halos_per_timestep+1)}, adjust_masses=False)
+        for n in range(1, halos_per_timestep):
+            generator.add_mass_transfer(n+1, n, 0.05)
+
+
+def time_strategy(strategy_class, halos, engine, repeats=3, **kwargs):
+    best = None
+    for _ in range(repeats):
+        start = time.time()
+        for halo in halos:
+            strategy_class(halo, engine=engine, **kwargs).all()
+        elapsed = time.time()-start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run_benchmarks(num_timesteps, halos_per_timestep):
+    halos = tangos.get_simulation("sim").timesteps[-1].halos.all()[:5]
+    benchmarks = [("major progenitors", halo_finding.MultiHopMajorProgenitorsStrategy, {}),
+                  ("all routes, backwards", halo_finding.MultiHopStrategy,
+                   dict(directed='backwards', combine_routes=False, nhops_max=num_timesteps,
+                        min_onehop_weight=0.5)),
+                  ("all progenitors", halo_finding.MultiHopAllProgenitorsStrategy, {})]
+
+    print("%d timesteps, %d halos per timestep; seconds to query %d halos" % (num_timesteps, halos_per_timestep,
+                                                                              len(halos)))
+    print("%-25s %12s %12s %12s" % ("", "temp_tables", "sql", "link_graph"))
+    for name, strategy_class, kwargs in benchmarks:
+        timings = [time_strategy(strategy_class, halos, engine, **kwargs)
+                   for engine in ('temp_tables', 'sql', 'link_graph')]
+        print("%-25s %12.3f %12.3f %12.3f" % ((name,)+tuple(timings)))
+
+
+if __name__=="__main__":
+    num_timesteps = int(sys.argv[1]) if len(sys.argv)>1 else 100
+    halos_per_timestep = int(sys.argv[2]) if len(sys.argv)>2 else 10
+    db_name = "multihop_engines_benchmark.db"
+    if os.path.exists(db_name):
+        os.remove(db_name)
+    tangos.core.init_db("sqlite:///"+db_name)
+    try:
+        with log.LogCapturer():
+            build_tree(num_timesteps, halos_per_timestep)
+        run_benchmarks(num_timesteps, halos_per_timestep)
+    finally:
+        os.remove(db_name)
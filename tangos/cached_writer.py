@@ -1,5 +1,11 @@
 from __future__ import absolute_import
+import time
+
+import sqlalchemy
+
 from . import core
+from .core import blob_store
+from .log import logger
 
 def create_property(halo, name, prop, session):
 
@@ -21,16 +27,124 @@ def _insert_list_unlocked(property_list):
         p[0], p[1], p[2], session) for p in property_list if p[2] is not None]
 
     session.add_all(property_object_list)
+    session.flush()
+
+    # the new objects are expired by the commit, so everything needed from them must be read first
+    core.columnar.add_rows_to_existing_columns(session, [(px.halo_id, px.name_id, px.data_float, px.data_int)
+                                                         for px in property_object_list
+                                                         if isinstance(px, core.halo_data.HaloProperty)])
+    session.commit()
+    return len(property_object_list)
+
+
+class _PropertyRowValues(object):
+    """Stand-in for a HaloProperty, allowing the data attribute mappers to encode values for a bulk insert"""
+    def __init__(self, name, blob_store_name):
+        self._name = name
+        self.blob_store_name = blob_store_name
+        self.data_float = None
+        self.data_int = None
+        self.data_array = None
+
+    @property
+    def array_compression(self):
+        from . import properties
+        return properties.array_compression(self._name)
+
+
+def _resolve_dictionary_ids(session, names):
+    """Map each of the given names to a dictionary id, using a single query for all existing items"""
+    names = list(set(names))
+    name_to_id = dict(zip(names, core.dictionary.get_dict_ids(names, None, session=session)))
+    missing = [name for name, id in name_to_id.items() if id is None]
+    if len(missing)>0:
+        core.dictionary.get_or_create_dictionary_items(session, missing)
+        # the newly-created items are now in the cache
+        name_to_id.update(zip(missing, core.dictionary.get_dict_ids(missing, session=session)))
+    return name_to_id
+
+
+def _halo_id(halo):
+    """Return the id of the halo, which may be specified as an ORM object or an id.
+
+    For persistent objects the id is taken from the identity key, since the objects are usually expired (having
+    been through a commit) and reading halo.id would then cost a query."""
+    if isinstance(halo, core.halo.Halo):
+        identity = sqlalchemy.inspect(halo).identity
+        return identity[0] if identity is not None else halo.id
+    return halo
+
 
+def _simulation_basenames(session, halo_ids):
+    """Map each of the given halo ids to the basename of its simulation, using a single query.
+
+    Halos may reach the bulk path as bare ids (e.g. from a dedicated writer process), so the basename can't be
+    read from the ORM objects."""
+    from . import temporary_halolist
+    with temporary_halolist.temporary_halolist_table(session, set(halo_ids)) as table:
+        return dict(temporary_halolist.halo_query(table).join(core.timestep.TimeStep).
+                    join(core.simulation.Simulation).
+                    with_entities(core.halo.Halo.id, core.simulation.Simulation.basename).all())
+
+
+def _insert_list_bulk_unlocked(property_list):
+    session = core.get_default_session()
+    property_list = [(_halo_id(halo), name, value) for halo, name, value in property_list if value is not None]
+    name_to_id = _resolve_dictionary_ids(session, [p[1] for p in property_list])
+    creator_id = core.creator.get_creator_id()
+
+    if blob_store.enabled():
+        basename_of_halo = _simulation_basenames(session, [p[0] for p in property_list
+                                                           if not isinstance(p[2], core.halo.Halo)])
+    else:
+        basename_of_halo = {}
+
+    property_rows = []
+    link_rows = []
+    for halo_id, name, value in property_list:
+        if isinstance(value, core.halo.Halo):
+            link_rows.append({'halo_from_id': halo_id, 'halo_to_id': _halo_id(value),
+                              'relation_id': name_to_id[name], 'weight': 1.0, 'creator_id': creator_id})
+        else:
+            row_values = _PropertyRowValues(name, basename_of_halo.get(halo_id))
+            core.data_attribute_mapper.set_data_of_unknown_type(row_values, value)
+            property_rows.append({'halo_id': halo_id, 'name_id': name_to_id[name],
+                                  'data_float': row_values.data_float, 'data_int': row_values.data_int,
+                                  'data_array': row_values.data_array, 'creator_id': creator_id})
+
+    if len(property_rows)>0:
+        session.execute(core.halo_data.HaloProperty.__table__.insert(), property_rows)
+    if len(link_rows)>0:
+        session.execute(core.halo_data.HaloLink.__table__.insert(), link_rows)
+    core.columnar.add_rows_to_existing_columns(session, [(row['halo_id'], row['name_id'], row['data_float'],
+                                                          row['data_int']) for row in property_rows])
     session.commit()
+    return len(property_rows)+len(link_rows)
+
+
+def insert_list(property_list, bulk=None):
+    """Insert a list of (halo, property_name, value) tuples into the database.
 
-def insert_list(property_list):
+    If value is a Halo, a link is created; otherwise a property is created.
+
+    :arg bulk: if True, bypass the ORM and insert all rows using one statement per table. This is substantially
+               faster for large lists. If None (default), config.default_bulk_insert determines the behaviour.
+    """
     from tangos import parallel_tasks as pt
+    from . import config
+
+    if bulk is None:
+        bulk = config.default_bulk_insert
+    insert_function = _insert_list_bulk_unlocked if bulk else _insert_list_unlocked
 
     if pt.backend!=None:
         with pt.ExclusiveLock("insert_list"):
-            _insert_list_unlocked(property_list)
+            start = time.time()
+            num_rows = insert_function(property_list)
     else:
-        _insert_list_unlocked(property_list)
-
+        start = time.time()
+        num_rows = insert_function(property_list)
 
+    elapsed = time.time()-start
+    logger.info("Inserted %d rows in %.2fs (%.0f rows/s, %s path)", num_rows, elapsed,
+                num_rows/max(elapsed, 1e-6), "bulk" if bulk else "ORM")
@@ -43,8 +43,29 @@ property_modules = map(str.strip, property_modules)
 
 file_ignore_pattern = []
 
+default_array_compression = 'zlib'
+# codec used when storing array properties: 'zlib' or 'none'. Uncompressed arrays are read back without copying (and
+# are eligible for the sidecar blob store below), at the cost of a larger database. Individual property classes can
+# override this by setting their array_compression attribute.
+
+blob_store_path = os.environ.get("TANGOS_BLOB_STORE", None)
+# folder in which to keep sidecar files for large uncompressed array properties (see core/blob_store.py). If None,
+# all array properties are stored directly in the database.
+
+blob_store_threshold = 100000
+# the minimum size in bytes of an uncompressed array before it is moved into the sidecar blob store
+
 max_traverse_depth = 3
 
+default_bulk_insert = False
+# if True, properties are written to the database with bulk statements rather than through the ORM (see
+# cached_writer.insert_list). Can also be enabled for individual runs with tangos write --bulk-insert.
+
+dedicated_writer_batch_size = 5000 # number of properties the writer process buffers before committing
+dedicated_writer_max_delay = 60.0 # seconds the writer process waits before committing a smaller buffer
+dedicated_writer_chunk_size = 500 # maximum number of properties committed before the writer process checks for messages
+# policy for tangos write --dedicated-writer, where workers send results to the server process for writing
+
 # merger tree thinning criteria (applied at query time, not at time of writing links)
 mergertree_min_fractional_weight = 0.02 # as a fraction of the weight of the strongest link from each halo
 mergertree_min_fractional_NDM = 0.01 # as a fraction of the most massive halo at each timestep - set to zero for no thinning
@@ -52,9 +73,29 @@ mergertree_max_nhalos = 30 # maximum number of halos per step - discard the leas
 mergertree_timeout = 15.0 # seconds before abandoning the construction of a merger tree in the web interface
 mergertree_max_hops = 500 # maximum number of timesteps to scan
 
+prefetch_min_available_memory_fraction = 0.2
+# tangos write --prefetch only loads the next timestep in the background if, after allowing for it to take as much
+# memory as the process already uses, at least this fraction of the node's memory would remain available
+
+fork_prefetch_arrays = ['pos', 'vel', 'mass']
+# tangos write --load-mode fork reads these arrays in the parent process before forking, unless --prefetch-arrays is
+# given, so that the workers share one copy. Arrays first read after forking are read separately by every worker.
+
 # relation finding paremeters for multi hop queries
 num_multihops_max_default = 100     # the maximum number of links to follow when searching for related halos
+num_history_steps_max_default = 1000     # the maximum number of progenitors or descendants to follow when calculating properties along a branch
 max_relative_time_difference = 1e-4     # the maximum fractional difference in time between two contemporaneous timesteps when searching for related halos
+default_multihop_engine = 'sql'  # 'sql' or 'link_graph'; the latter takes directed hops in memory (see relation_finding.link_graph)
+
+temporary_halolist_max_inline = 20
+# lists of up to this many halo ids are written into queries directly, rather than via a temporary table (see
+# temporary_halolist.py)
+
+result_cache_max_bytes = 0
+# memory budget for caching the results of calculate_all and calculate_for_progenitors/descendants; 0 disables the
+# cache unless result_cache_path is set (see live_calculation/result_cache.py)
+result_cache_path = os.environ.get("TANGOS_RESULT_CACHE", None)
+# folder in which to store cached results on disk so that they can be shared between processes, or None
 
 # On some network file systems, concurrency using sqlite is dodgy to say the least. After committing a transaction
 # on one node, and before attempting to open a new transaction on another node, it seems empirically helpful to
@@ -1,5 +1,7 @@
 from __future__ import absolute_import
-from sqlalchemy import Index, create_engine
+import os
+
+from sqlalchemy import Index, create_engine, event, exc
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, clear_mappers
 from .. import config
@@ -8,6 +10,7 @@ _verbose = False
 _internal_session=None
 _engine=None
 Session=None
+_inherited_sessions=[]
 
 def get_default_session():
     """Get the default ORM session to be used when no other is specified.
@@ -33,6 +36,28 @@ def get_default_engine():
         init_db()
     return _engine
 
+def use_new_session_after_fork():
+    """Give a forked child process its own default session and database connections.
+
+    Connections inherited from the parent are never closed or rolled back by the child, since that would act on the
+    parent's socket; the pool discards them unused (see _install_fork_safety). The inherited default session is
+    kept alive for the same reason. Objects loaded before the fork must be re-queried in the new session."""
+    _inherited_sessions.append(get_default_session())
+    set_default_session(Session())
+
+def _install_fork_safety(engine):
+    # Follows the recipe in the SQLAlchemy documentation for using a pool across os.fork()
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        connection_record.info['pid'] = os.getpid()
+
+    @event.listens_for(engine, "checkout")
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        if connection_record.info['pid'] != os.getpid():
+            connection_record.connection = connection_proxy.connection = None
+            raise exc.DisconnectionError("Connection belongs to pid %d; discarding it in pid %d"
+                                         % (connection_record.info['pid'], os.getpid()))
+
 
 
 clear_mappers()  # remove existing maps
@@ -47,6 +72,8 @@ from .tracking import TrackData, update_tracker_halos
 from .timestep import TimeStep
 from .halo import Halo
 from .halo_data import HaloProperty, HaloLink
+from .columnar import PropertyColumn
+from .branches import HaloBranch, BranchBuild
 
 Index("halo_index", HaloProperty.__table__.c.halo_id)
 Index("name_halo_index", HaloProperty.__table__.c.name_id,
@@ -57,6 +84,9 @@ Index("halo_finder_index", Halo.__table__.c.finder_id)
 Index("haloproperties_creator_index", HaloProperty.__table__.c.creator_id)
 Index("halolink_index", HaloLink.__table__.c.halo_from_id)
 Index("named_halolink_index", HaloLink.__table__.c.relation_id, HaloLink.__table__.c.halo_from_id)
+Index("propertycolumn_index", PropertyColumn.__table__.c.timestep_id, PropertyColumn.__table__.c.name_id)
+Index("halobranch_index", HaloBranch.__table__.c.kind, HaloBranch.__table__.c.branch_id,
+      HaloBranch.__table__.c.position)
 
 
 
@@ -122,6 +152,7 @@ def init_db(db_uri=None, timeout=30, verbose=None):
 
     _engine = create_engine(db_uri, echo=verbose or _verbose,
                             isolation_level='READ UNCOMMITTED', connect_args={'timeout': timeout})
+    _install_fork_safety(_engine)
 
     #with _engine.connect() as connection:
         # the following auto-adaptation of the table names is required for backwards compatibility
@@ -131,9 +162,11 @@ def init_db(db_uri=None, timeout=30, verbose=None):
     _internal_session=Session()
     Base.metadata.create_all(_engine)
     creator.set_creator(None)
+    dictionary.invalidate_dictionary_cache()
 
 
-from .dictionary import _get_dict_cache_for_session, get_dict_id, get_or_create_dictionary_item
+from .dictionary import _get_dict_cache_for_session, get_dict_id, get_dict_ids, get_or_create_dictionary_item, \
+    get_or_create_dictionary_items
 
 
 
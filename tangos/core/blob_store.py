@@ -0,0 +1,142 @@
+"""Append-only sidecar files holding the payloads of large array properties.
+
+When config.blob_store_path is set, uncompressed numpy arrays larger than config.blob_store_threshold bytes are
+appended to a per-simulation file in that folder, and the database row stores only a short reference (see
+data_attribute_mapper). Reading the property returns a read-only view of a memory map of the file, so that the
+payload is only paged in when it is actually accessed. Each process maps each file only once.
+
+Files are named <simulation>.<generation>.blobs. New payloads are appended to the latest generation; the
+``tangos compact-blobs`` tool copies live payloads into a new generation and removes the old files. Appending and
+compaction both hold an exclusive lock on <simulation>.lock, so that nothing is appended to a file while it is
+being compacted.
+"""
+
+from __future__ import absolute_import
+import contextlib
+import mmap
+import os
+import re
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+_ALIGNMENT = 16
+
+_maps = {}
+_maps_pid = None
+
+def enabled():
+    from .. import config
+    return config.blob_store_path is not None
+
+def _full_path(filename):
+    from .. import config
+    if config.blob_store_path is None:
+        raise IOError("Property %r is stored in the sidecar blob store, but config.blob_store_path is not set"%filename)
+    return os.path.join(config.blob_store_path, filename)
+
+def _file_prefix(simulation_name):
+    return re.sub(r'[^A-Za-z0-9_\-]', '_', simulation_name)
+
+def _generation(filename):
+    return int(filename.split(".")[-2])
+
+def files_for_simulation(simulation_name):
+    """Return the names of all blob files for the given simulation, oldest generation first"""
+    from .. import config
+    if not os.path.isdir(config.blob_store_path):
+        return []
+    pattern = re.compile(re.escape(_file_prefix(simulation_name)) + r"\.[0-9]+\.blobs$")
+    filenames = [f for f in os.listdir(config.blob_store_path) if pattern.match(f)]
+    return sorted(filenames, key=_generation)
+
+def current_filename(simulation_name):
+    """Return the name of the blob file to which new payloads for the given simulation are appended"""
+    existing = files_for_simulation(simulation_name)
+    if len(existing)==0:
+        return _file_prefix(simulation_name)+".0.blobs"
+    return existing[-1]
+
+def next_generation_filename(simulation_name):
+    """Return the name of a new, empty blob file for the given simulation"""
+    existing = files_for_simulation(simulation_name)
+    generation = _generation(existing[-1])+1 if len(existing)>0 else 0
+    return _file_prefix(simulation_name)+".%d.blobs"%generation
+
+@contextlib.contextmanager
+def simulation_lock(simulation_name):
+    """Context manager holding an exclusive lock on the blob files of the given simulation"""
+    path = _full_path(_file_prefix(simulation_name)+".lock")
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+def append_to_simulation(simulation_name, raw):
+    """Append the raw bytes to the current blob file of the simulation, returning the filename and offset"""
+    with simulation_lock(simulation_name):
+        filename = current_filename(simulation_name)
+        return filename, append(filename, raw)
+
+def append(filename, raw):
+    """Append the raw bytes to the named file, returning the offset at which they were written.
+
+    The caller must hold the simulation_lock for the simulation to which the file belongs."""
+    path = _full_path(filename)
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'ab') as f:
+        f.seek(0, os.SEEK_END)
+        offset = f.tell()
+        padding = (-offset) % _ALIGNMENT
+        f.write(b"\0"*padding)
+        f.write(raw)
+    return offset+padding
+
+def read_raw(filename, offset, length):
+    with open(_full_path(filename), 'rb') as f:
+        f.seek(offset)
+        return f.read(length)
+
+def _get_map(filename, required_length):
+    """Return a read-only memory map of the named file covering at least required_length bytes.
+
+    Maps are kept for the lifetime of the process (or until the file is removed), so that reading many arrays does
+    not use up file descriptors. Since files are only ever appended to, a map is only replaced if the file has grown
+    beyond it; existing views keep the old map alive for as long as they need it."""
+    global _maps_pid
+    if _maps_pid != os.getpid():
+        # maps inherited from a parent process are still valid, but are not ours to manage
+        _maps.clear()
+        _maps_pid = os.getpid()
+
+    path = _full_path(filename)
+    existing = _maps.get(path)
+    if existing is None or len(existing) < required_length:
+        with open(path, 'rb') as f:
+            existing = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        _maps[path] = existing
+    return existing
+
+def open_array(filename, offset, dtype, shape):
+    """Return a read-only array backed by a memory map, for a payload previously written with append"""
+    count = int(np.prod(shape))
+    if count==0:
+        return np.zeros(shape, dtype=dtype)
+    dtype = np.dtype(dtype)
+    file_map = _get_map(filename, offset + count*dtype.itemsize)
+    return np.frombuffer(file_map, dtype=dtype, count=count, offset=offset).reshape(shape)
+
+def remove(filename):
+    _maps.pop(_full_path(filename), None)
+    os.remove(_full_path(filename))
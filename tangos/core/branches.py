@@ -0,0 +1,161 @@
+"""Materialised progenitor and descendant branches.
+
+Following the major progenitor (or descendant) of each halo, step by step, traces out a chain; the chains from all
+the halos in a simulation form a forest. A HaloBranch row records, for one halo and one kind of chain, the branch
+the halo sits on, its position along that branch and the halo reached by one further hop. The whole chain starting
+from any halo can then be read back with a handful of indexed queries (one per branch crossed, which is almost
+always one), rather than one query per hop.
+
+Several kinds of chain are stored, corresponding to the different rules for choosing the next hop:
+
+ - MAJOR_PROGENITOR follows MultiHopMajorProgenitorsStrategy: the earlier halo closest in time, then with the
+   highest weight, then with the lowest halo number, ignoring links with no reverse link of weight above 0.1;
+ - MAJOR_DESCENDANT follows MultiHopMajorDescendantsStrategy: the later halo closest in time, then with the
+   highest weight, then with the lowest halo number;
+ - STRONGEST_PROGENITOR and STRONGEST_DESCENDANT follow MultiSourceAllMajorProgenitorsStrategy and
+   MultiSourceAllMajorDescendantsStrategy (and hence the earliest() and latest() live-calculation functions):
+   the earlier or later halo with the highest weight.
+
+Branches are built by the ``tangos build-branches`` tool (see relation_finding.branches), updated by
+``tangos link`` and ignored whenever halos have been added to the simulation, or links added between its timesteps,
+since they were last built.
+"""
+
+from __future__ import absolute_import
+from sqlalchemy import Column, Integer, Float, ForeignKey, func
+from sqlalchemy.orm import relationship, backref, aliased
+
+from . import Base
+from .halo import Halo
+from .halo_data import HaloLink
+from .simulation import Simulation
+from .timestep import TimeStep
+
+MAJOR_PROGENITOR = 0
+MAJOR_DESCENDANT = 1
+STRONGEST_PROGENITOR = 2
+STRONGEST_DESCENDANT = 3
+
+ALL_KINDS = (MAJOR_PROGENITOR, MAJOR_DESCENDANT, STRONGEST_PROGENITOR, STRONGEST_DESCENDANT)
+
+
+class HaloBranch(Base):
+    __tablename__ = 'halobranches'
+
+    halo_id = Column(Integer, ForeignKey('halos.id'), primary_key=True)
+    halo = relationship(Halo, backref=backref('branches', cascade='all', lazy='dynamic'))
+    kind = Column(Integer, primary_key=True)
+
+    branch_id = Column(Integer)  # the id of the halo at which the branch starts
+    position = Column(Integer)   # the number of hops from the start of the branch
+    next_id = Column(Integer)    # the halo reached by one further hop (possibly on another branch), or None
+    next_weight = Column(Float)  # the weight of that hop
+
+    def __repr__(self):
+        return "<HaloBranch halo_id=%d kind=%d branch_id=%d position=%d>" % (self.halo_id, self.kind, self.branch_id,
+                                                                            self.position)
+
+
+class BranchBuild(Base):
+    __tablename__ = 'branchbuilds'
+
+    simulation_id = Column(Integer, ForeignKey('simulations.id'), primary_key=True)
+    simulation = relationship(Simulation, backref=backref('branch_builds', cascade='all', lazy='dynamic'))
+
+    # state of the simulation when the branches were built (see database_state), used to detect staleness
+    max_link_id = Column(Integer)
+    max_halo_id = Column(Integer)
+
+    def __init__(self, simulation_id):
+        self.simulation_id = simulation_id
+
+
+def _halos_query(session, simulation_id, *entities):
+    return session.query(*entities).join(TimeStep, Halo.timestep_id == TimeStep.id).\
+        filter(TimeStep.simulation_id == simulation_id)
+
+def _links_between_timesteps_query(session, simulation_id, *entities):
+    # links within a timestep (e.g. between halos and their black holes) are never followed by a branch
+    halo_from = aliased(Halo)
+    halo_to = aliased(Halo)
+    return session.query(*entities).select_from(HaloLink).join(halo_from, HaloLink.halo_from_id == halo_from.id).\
+        join(halo_to, HaloLink.halo_to_id == halo_to.id).\
+        join(TimeStep, halo_from.timestep_id == TimeStep.id).\
+        filter(TimeStep.simulation_id == simulation_id, halo_from.timestep_id != halo_to.timestep_id)
+
+
+def database_state(session, simulation_id):
+    """Return a token that changes whenever halos are added to the simulation, or links are added from its halos
+    to halos in other timesteps"""
+    return (_links_between_timesteps_query(session, simulation_id, func.max(HaloLink.id)).scalar(),
+            _halos_query(session, simulation_id, func.max(Halo.id)).scalar())
+
+
+def unchanged_since(session, simulation_id, state):
+    """Return True if database_state(session, simulation_id) would still return state.
+
+    Only rows with higher ids than those recorded in state need to be checked, so this is much quicker than
+    calling database_state again."""
+    max_link_id, max_halo_id = state
+    new_links = _links_between_timesteps_query(session, simulation_id, HaloLink.id)
+    if max_link_id is not None:
+        new_links = new_links.filter(HaloLink.id > max_link_id)
+    new_halos = _halos_query(session, simulation_id, Halo.id)
+    if max_halo_id is not None:
+        new_halos = new_halos.filter(Halo.id > max_halo_id)
+    return new_links.first() is None and new_halos.first() is None
+
+
+def branches_are_current(session, simulation_ids):
+    """Return True if branches have been built for all the given simulations and are up to date"""
+    simulation_ids = set(simulation_ids)
+    builds = session.query(BranchBuild).filter(BranchBuild.simulation_id.in_(simulation_ids)).all()
+    if len(builds) != len(simulation_ids):
+        return False
+    return all(unchanged_since(session, b.simulation_id, (b.max_link_id, b.max_halo_id)) for b in builds)
+
+
+def follow_branches(session, kind, halo_ids, nhops_max):
+    """Return the chain starting from each of the given halos, following the given kind of branch.
+
+    Each chain is a list of (halo_id, weight) pairs for the halos reached by successive hops (not including the
+    starting halo), where weight is the weight of the individual hop. Chains are truncated at nhops_max hops.
+    The caller is responsible for checking that the branches are current."""
+    from .. import temporary_halolist
+    chains = [[] for _ in halo_ids]
+    current = {i: h for i, h in enumerate(halo_ids)}
+
+    while len(current) > 0:
+        with temporary_halolist.temporary_halolist_table(session, set(current.values())) as table:
+            starts = {b.halo_id: b for b in
+                      session.query(HaloBranch).select_from(table).
+                          join(HaloBranch, HaloBranch.halo_id == table.c.halo_id).
+                          filter(HaloBranch.kind == kind).all()}
+
+        # branch ids are the ids of the halos at which the branches start, so can be held in a halolist
+        with temporary_halolist.temporary_halolist_table(session, set(b.branch_id for b in starts.values())) as table:
+            members = session.query(HaloBranch.branch_id, HaloBranch.position, HaloBranch.next_id,
+                                    HaloBranch.next_weight).select_from(table).\
+                join(HaloBranch, HaloBranch.branch_id == table.c.halo_id).\
+                filter(HaloBranch.kind == kind).all()
+        next_by_position = {(m[0], m[1]): (m[2], m[3]) for m in members}
+
+        continuing = {}
+        for i, halo_id in current.items():
+            start = starts.get(halo_id)
+            if start is None:
+                continue
+            position = start.position
+            while len(chains[i]) < nhops_max:
+                next_id, next_weight = next_by_position[(start.branch_id, position)]
+                if next_id is None:
+                    break
+                chains[i].append((next_id, next_weight))
+                position += 1
+                if (start.branch_id, position) not in next_by_position:
+                    # the next halo is on another branch
+                    continuing[i] = next_id
+                    break
+        current = continuing
+
+    return chains
@@ -0,0 +1,220 @@
+"""Packed per-timestep copies of scalar halo properties.
+
+A PropertyColumn holds the values of one named property for every object in a timestep as a single contiguous
+array. TimeStep.calculate_all can then answer requests that only involve stored scalars without hydrating an ORM
+object for every halo and property.
+
+Columns are an optional acceleration structure. They are created by the ``tangos build-columns`` tool, extended
+by cached_writer.insert_list and refreshed by the importers whenever new rows are written for a (timestep, name)
+pair that already has a column, and silently ignored whenever the row store has changed since they were built.
+"""
+
+from __future__ import absolute_import
+import numpy as np
+from sqlalchemy import Column, Integer, String, ForeignKey, LargeBinary, func
+from sqlalchemy.orm import relationship, backref
+
+from . import Base
+from .timestep import TimeStep
+
+
+class PropertyColumn(Base):
+    __tablename__ = 'propertycolumns'
+
+    id = Column(Integer, primary_key=True)
+    timestep_id = Column(Integer, ForeignKey('timesteps.id'))
+    timestep = relationship(TimeStep, backref=backref('property_columns', cascade='all', lazy='dynamic'))
+    name_id = Column(Integer, ForeignKey('dictionary.id'))
+
+    dtype = Column(String)
+    halo_ids = Column(LargeBinary)
+    values = Column(LargeBinary)
+
+    # state of the row store when the column was built, used to detect staleness
+    num_rows = Column(Integer)
+    max_property_id = Column(Integer)
+
+    def __init__(self, timestep_id, name_id):
+        self.timestep_id = timestep_id
+        self.name_id = name_id
+
+    def __repr__(self):
+        return "<PropertyColumn timestep_id=%d name_id=%d rows=%d>" % (self.timestep_id, self.name_id,
+                                                                       self.num_rows)
+
+    def as_arrays(self):
+        """Return the halo ids (sorted) and corresponding values as numpy arrays"""
+        return np.frombuffer(self.halo_ids, dtype=np.int64), np.frombuffer(self.values, dtype=self.dtype)
+
+
+def _row_store_query(session, timestep_id, name_id, *columns):
+    from .halo import Halo
+    from .halo_data import HaloProperty
+    return session.query(*columns).select_from(HaloProperty).\
+        join(Halo, HaloProperty.halo_id == Halo.id).\
+        filter(Halo.timestep_id == timestep_id, HaloProperty.name_id == name_id)
+
+
+def _row_store_state(session, timestep_id, name_id):
+    from .halo_data import HaloProperty
+    num_rows, max_id = _row_store_query(session, timestep_id, name_id,
+                                        func.count(HaloProperty.id), func.max(HaloProperty.id)).one()
+    return num_rows, max_id
+
+
+def _pack_rows(rows):
+    """Convert (id, halo_id, data_float, data_int) rows into sorted halo ids and values.
+
+    Returns None if the rows cannot be represented as a column, i.e. some rows are non-scalar or there is more
+    than one row for a halo."""
+    if len(rows) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+
+    _, halo_ids, floats, ints = zip(*rows)
+    has_float = np.array([f is not None for f in floats])
+    has_int = np.array([i is not None for i in ints])
+
+    if not np.all(has_float | has_int):
+        return None
+
+    halo_ids = np.array(halo_ids, dtype=np.int64)
+    if len(np.unique(halo_ids)) != len(halo_ids):
+        return None
+
+    if np.any(has_float):
+        values = np.array([f if f is not None else i for f, i in zip(floats, ints)], dtype=np.float64)
+    else:
+        values = np.array(ints, dtype=np.int64)
+
+    order = np.argsort(halo_ids)
+    return halo_ids[order], values[order]
+
+
+def build_column(session, timestep_id, name_id):
+    """Build (or rebuild) the packed column for the given timestep and property name.
+
+    The caller is responsible for committing the session. If the stored values cannot be packed (because they
+    include arrays, or multiple values for one halo), any existing column is removed and None is returned."""
+    from .halo_data import HaloProperty
+
+    existing = session.query(PropertyColumn).filter_by(timestep_id=timestep_id, name_id=name_id).first()
+
+    rows = _row_store_query(session, timestep_id, name_id, HaloProperty.id, HaloProperty.halo_id,
+                            HaloProperty.data_float, HaloProperty.data_int).all()
+    packed = _pack_rows(rows)
+
+    if packed is None:
+        if existing is not None:
+            session.delete(existing)
+        return None
+
+    halo_ids, values = packed
+    column = existing or session.merge(PropertyColumn(timestep_id, name_id))
+    column.dtype = values.dtype.str
+    column.halo_ids = halo_ids.tobytes()
+    column.values = values.tobytes()
+    column.num_rows = len(rows)
+    column.max_property_id = max(r[0] for r in rows) if len(rows) > 0 else None
+    return column
+
+
+def refresh_existing_columns(session, timestep_and_name_ids):
+    """Rebuild any existing columns for the given iterable of (timestep_id, name_id) pairs, then commit.
+
+    Pairs without an existing column are ignored, so that columns are only maintained where they have been
+    explicitly requested."""
+    pairs = set(timestep_and_name_ids)
+    if len(pairs) == 0:
+        return
+    timestep_ids = set(p[0] for p in pairs)
+    existing = session.query(PropertyColumn.timestep_id, PropertyColumn.name_id).\
+        filter(PropertyColumn.timestep_id.in_(timestep_ids)).all()
+    to_refresh = pairs.intersection(tuple(e) for e in existing)
+    for timestep_id, name_id in to_refresh:
+        build_column(session, timestep_id, name_id)
+    if len(to_refresh) > 0:
+        session.commit()
+
+
+_HALO_ID_BATCH_SIZE = 500
+
+def _timestep_ids_for_halos(session, halo_ids):
+    from .halo import Halo
+    halo_ids = list(halo_ids)
+    result = {}
+    for i in range(0, len(halo_ids), _HALO_ID_BATCH_SIZE):
+        result.update(session.query(Halo.id, Halo.timestep_id).
+                      filter(Halo.id.in_(halo_ids[i:i+_HALO_ID_BATCH_SIZE])).all())
+    return result
+
+def add_rows_to_existing_columns(session, rows):
+    """Add newly-written rows, given as (halo_id, name_id, data_float, data_int) tuples, to any existing columns.
+
+    Only the new rows are merged into each column, so that writing a timestep in many batches does not rebuild the
+    column each time. Call this after the rows have been flushed but before committing; the caller must commit.
+    If no columns exist for the names written, this costs a single query."""
+    rows = list(rows)
+    name_ids = set(r[1] for r in rows)
+    if len(name_ids) == 0:
+        return
+    existing = set(tuple(e) for e in session.query(PropertyColumn.timestep_id, PropertyColumn.name_id).
+                   filter(PropertyColumn.name_id.in_(name_ids)).all())
+    if len(existing) == 0:
+        return
+
+    names_with_columns = set(e[1] for e in existing)
+    rows = [r for r in rows if r[1] in names_with_columns]
+    timestep_for_halo = _timestep_ids_for_halos(session, set(r[0] for r in rows))
+
+    rows_for_column = {}
+    for halo_id, name_id, data_float, data_int in rows:
+        pair = (timestep_for_halo[halo_id], name_id)
+        if pair in existing:
+            rows_for_column.setdefault(pair, []).append((None, halo_id, data_float, data_int))
+
+    for (timestep_id, name_id), new_rows in rows_for_column.items():
+        _add_rows_to_column(session, timestep_id, name_id, new_rows)
+
+def _add_rows_to_column(session, timestep_id, name_id, new_rows):
+    column = session.query(PropertyColumn).filter_by(timestep_id=timestep_id, name_id=name_id).first()
+    num_rows, max_id = _row_store_state(session, timestep_id, name_id)
+    if column.num_rows + len(new_rows) != num_rows:
+        # the column was already out of date before these rows were written
+        build_column(session, timestep_id, name_id)
+        return
+
+    packed = _pack_rows(new_rows)
+    if packed is None:
+        session.delete(column)
+        return
+
+    old_halo_ids, old_values = column.as_arrays()
+    halo_ids = np.concatenate((old_halo_ids, packed[0]))
+    values = np.concatenate((old_values, packed[1]))
+    if len(np.unique(halo_ids)) != len(halo_ids):
+        session.delete(column)
+        return
+
+    order = np.argsort(halo_ids)
+    column.dtype = values.dtype.str
+    column.halo_ids = halo_ids[order].tobytes()
+    column.values = values[order].tobytes()
+    column.num_rows = num_rows
+    column.max_property_id = max_id
+
+
+def invalidate_column(session, timestep_id, name_id):
+    """Remove any column for the given timestep and name (e.g. because a value has been updated in place)"""
+    session.query(PropertyColumn).filter_by(timestep_id=timestep_id, name_id=name_id).\
+        delete(synchronize_session=False)
+
+
+def get_column_arrays(session, timestep_id, name_id):
+    """Return the sorted halo ids and values for the given timestep and name, or None if no up-to-date column
+    is available"""
+    column = session.query(PropertyColumn).filter_by(timestep_id=timestep_id, name_id=name_id).first()
+    if column is None:
+        return None
+    if (column.num_rows, column.max_property_id) != _row_store_state(session, timestep_id, name_id):
+        return None
+    return column.as_arrays()
@@ -10,6 +10,7 @@ import datetime
 import six
 import sys
 import functools
+import struct
 from six.moves import cPickle as pickle
 
 pickle_loads = pickle.loads
@@ -19,6 +20,21 @@ if int(sys.version[0])==3:
 
 _THRESHOLD_FOR_COMPRESSION = 1000
 
+# Numpy-native ("NX") blob layout: b"NX", then a header packed as _NATIVE_HEADER_FORMAT (version, codec, ndim,
+# length of dtype string), the dtype string, ndim little-endian int64s giving the shape, padding up to a
+# multiple of _NATIVE_ALIGNMENT bytes, and finally the C-ordered raw buffer (possibly compressed).
+_NATIVE_PREFIX = b"NX"
+_NATIVE_VERSION = 1
+_NATIVE_HEADER_FORMAT = "<BBBB"
+_NATIVE_ALIGNMENT = 16
+_NATIVE_CODECS = {'none': 0, 'zlib': 1}
+
+# Sidecar blob reference ("BX") layout: b"BX", the same header, dtype string and shape as the NX format, then
+# the offset and length of the payload packed as _BLOB_REFERENCE_FORMAT along with the length of the filename,
+# and finally the filename of the payload within the blob store (see blob_store.py).
+_BLOB_PREFIX = b"BX"
+_BLOB_REFERENCE_FORMAT = "<qqH"
+
 def get_data_of_unknown_type(obj):
     """Starting from the ORM object, extract data which may be stored in a variety of attributes depending on its type"""
     mapper = DataAttributeMapper(db_object=obj)
@@ -166,9 +182,38 @@ class ArrayAttributeMapper(DataAttributeMapper):
     def _unpack_old_format(self, packed):
         return np.frombuffer(packed)
 
+    def _unpack_native(self, packed):
+        """Decode a numpy-native blob.
+
+        The returned array is a read-only view onto the stored (or decompressed) bytes, so that no copy is made;
+        callers that need to modify it should take a copy first."""
+        codec, dtype, shape, offset = _unpack_native_header(packed)
+        offset = _native_data_offset(offset)
+
+        if codec == _NATIVE_CODECS['zlib']:
+            buffer = zlib.decompress(memoryview(packed)[offset:])
+            offset = 0
+        elif codec == _NATIVE_CODECS['none']:
+            buffer = packed
+        else:
+            raise ValueError("Unknown codec %d in numpy-native array storage" % codec)
+
+        count = int(np.prod(shape))
+        return np.frombuffer(buffer, dtype=dtype, count=count, offset=offset).reshape(shape)
+
+    def _unpack_blob_reference(self, packed):
+        from . import blob_store
+        _, dtype, shape, _ = _unpack_native_header(packed)
+        _, filename, offset, _ = get_blob_reference(packed)
+        return blob_store.open_array(filename, offset, dtype, shape)
+
     def unpack(self, packed):
         if len(packed)==0:
             return None
+        elif packed.startswith(_NATIVE_PREFIX):
+            return self._unpack_native(packed)
+        elif packed.startswith(_BLOB_PREFIX):
+            return self._unpack_blob_reference(packed)
         elif packed.startswith(b"ZX"):
             return self._unpack_compressed(packed)
         elif packed.startswith(b"PX"):
@@ -176,14 +221,117 @@ class ArrayAttributeMapper(DataAttributeMapper):
         else:
             return self._unpack_old_format(packed)
 
-    def pack(self, data):
+    @staticmethod
+    def can_pack_native(data):
+        """Return True if data can be stored in the numpy-native format without loss of information.
+
+        Subclasses of ndarray (which may carry extra information such as units), object arrays and structured
+        arrays are pickled instead."""
+        return type(data) is np.ndarray and not data.dtype.hasobject and data.dtype.fields is None \
+            and data.dtype.subdtype is None
+
+    def pack(self, data, compression=None, blob_store_name=None):
+        """Pack the data into a binary blob.
+
+        :arg compression: 'none' or 'zlib'. If None, the default from config.default_array_compression is used.
+                          Compression is only applied to blobs longer than _THRESHOLD_FOR_COMPRESSION bytes.
+        :arg blob_store_name: the name under which large uncompressed arrays may be stored in the sidecar blob
+                              store, or None to always store the data inline
+        """
+        from .. import config
+        if compression is None:
+            compression = config.default_array_compression
+
+        if not self.can_pack_native(data):
+            return self._pack_pickle(data, compression)
+        elif self._should_use_blob_store(data, compression, blob_store_name):
+            return self._pack_blob_reference(data, blob_store_name)
+        else:
+            return self._pack_native(data, compression)
+
+    @staticmethod
+    def _should_use_blob_store(data, compression, blob_store_name):
+        from .. import config
+        from . import blob_store
+        return blob_store_name is not None and compression=='none' and blob_store.enabled() \
+            and data.nbytes >= config.blob_store_threshold
+
+    def _pack_pickle(self, data, compression):
         dumped_st = pickle.dumps(data)
-        if len(dumped_st) > _THRESHOLD_FOR_COMPRESSION:
+        if compression=='zlib' and len(dumped_st) > _THRESHOLD_FOR_COMPRESSION:
             dumped_st = b"ZX" + zlib.compress(dumped_st)
         else:
             dumped_st = b"PX" + dumped_st
         return dumped_st
 
+    def _pack_native(self, data, compression):
+        raw = data.tobytes(order='C')
+        if compression=='zlib' and len(raw) > _THRESHOLD_FOR_COMPRESSION:
+            codec = 'zlib'
+            raw = zlib.compress(raw)
+        else:
+            codec = 'none'
+
+        header = _pack_native_header(_NATIVE_PREFIX, codec, data)
+        padding = b"\0" * (_native_data_offset(len(header)) - len(header))
+        return header + padding + raw
+
+    def _pack_blob_reference(self, data, blob_store_name):
+        from . import blob_store
+        raw = data.tobytes(order='C')
+        filename, offset = blob_store.append_to_simulation(blob_store_name, raw)
+        return make_blob_reference(_pack_native_header(_BLOB_PREFIX, 'none', data), filename, offset, len(raw))
+
+    def set(self, db_object, data):
+        from . import blob_store
+        if hasattr(db_object, self._attribute_name):
+            compression = getattr(db_object, 'array_compression', None)
+            blob_store_name = getattr(db_object, 'blob_store_name', None) if blob_store.enabled() else None
+            setattr(db_object, self._attribute_name, self.pack(data, compression, blob_store_name))
+        else:
+            raise TypeError("%r object does not have a slot for %r"%(type(db_object),self._attribute_name))
+
+        self._clear_other_attributes(db_object)
+
+
+def _native_data_offset(header_length):
+    return _NATIVE_ALIGNMENT * ((header_length + _NATIVE_ALIGNMENT - 1) // _NATIVE_ALIGNMENT)
+
+def _pack_native_header(prefix, codec, data):
+    dtype_str = data.dtype.str.encode('ascii')
+    return prefix + struct.pack(_NATIVE_HEADER_FORMAT, _NATIVE_VERSION, _NATIVE_CODECS[codec],
+                                data.ndim, len(dtype_str)) \
+           + dtype_str + struct.pack("<%dq" % data.ndim, *data.shape)
+
+def _unpack_native_header(packed):
+    """Parse the header of an NX or BX blob, returning the codec, dtype, shape and the offset of the end of the
+    header"""
+    version, codec, ndim, dtype_len = struct.unpack_from(_NATIVE_HEADER_FORMAT, packed, len(_NATIVE_PREFIX))
+    if version != _NATIVE_VERSION:
+        raise ValueError("Unknown version %d of numpy-native array storage" % version)
+
+    offset = len(_NATIVE_PREFIX) + struct.calcsize(_NATIVE_HEADER_FORMAT)
+    dtype = np.dtype(bytes(packed[offset:offset+dtype_len]).decode('ascii'))
+    offset += dtype_len
+    shape = struct.unpack_from("<%dq" % ndim, packed, offset)
+    return codec, dtype, shape, offset + 8 * ndim
+
+def get_blob_reference(packed):
+    """If the packed data refers to the sidecar blob store, return (header, filename, offset, length);
+    otherwise return None"""
+    if packed is None or not packed.startswith(_BLOB_PREFIX):
+        return None
+    _, _, _, end_of_header = _unpack_native_header(packed)
+    offset, length, filename_len = struct.unpack_from(_BLOB_REFERENCE_FORMAT, packed, end_of_header)
+    start_of_filename = end_of_header + struct.calcsize(_BLOB_REFERENCE_FORMAT)
+    filename = bytes(packed[start_of_filename:start_of_filename+filename_len]).decode('utf-8')
+    return bytes(packed[:end_of_header]), filename, offset, length
+
+def make_blob_reference(header, filename, offset, length):
+    """Create a reference to a payload in the sidecar blob store, given a header as returned by get_blob_reference"""
+    filename = filename.encode('utf-8')
+    return header + struct.pack(_BLOB_REFERENCE_FORMAT, offset, length, len(filename)) + filename
+
 
 # Following must be defined last to act as a fall-through:
 class NullAttributeMapper(DataAttributeMapper):
@@ -4,7 +4,7 @@ from sqlalchemy import Column, Integer, String
 
 from . import Base, get_default_session
 
-_dict_id = {}  # maps dictionary text -> database ID
+_dict_id = {}  # maps database URL, dictionary text -> database ID
 _dict_obj = {} # maps session, dictionary text -> database object
 
 
@@ -31,42 +31,42 @@ def get_dict_id(text, default=raise_exception, session=None, allow_query=True):
     no dictionary object exists for the specified text, unless a default is provided
     in which case the default value is returned instead."""
 
+    return get_dict_ids([text], default, session, allow_query)[0]
+
+def get_dict_ids(texts, default=raise_exception, session=None, allow_query=True):
+    """Get the DictionaryItem ids for a list of texts, using the cache where possible and otherwise a single
+    query for all the missing items. See get_dict_id for the meaning of the other arguments."""
+
     from . import Session
 
     if session is None:
-        session = Session()
-        _dict_id = _get_dict_cache_for_session(get_default_session())
-        close_session=True
+        dict_cache = _get_dict_cache_for_session(get_default_session())
     else:
-        _dict_id = _get_dict_cache_for_session(session)
-        close_session=False
-
-    try:
-        return _dict_id[text]
-    except KeyError:
-
-        if allow_query:
-            try:
-                obj = session.query(DictionaryItem).filter_by(text=text).first()
-            except:
-                if default is raise_exception:
-                    raise
-                else:
-                    return default
-            finally:
-                if close_session:
-                    session.close()
-        else:
-            obj = None
+        dict_cache = _get_dict_cache_for_session(session)
 
-        if obj is None:
+    missing = set(t for t in texts if t not in dict_cache)
+
+    if len(missing)>0 and allow_query:
+        query_session = Session() if session is None else session
+        try:
+            dict_cache.update(query_session.query(DictionaryItem.text, DictionaryItem.id).
+                              filter(DictionaryItem.text.in_(missing)).all())
+        except:
             if default is raise_exception:
                 raise
-            else:
-                return default
-
-        _dict_id[text] = obj.id
-        return obj.id
+        finally:
+            if session is None:
+                query_session.close()
+
+    results = []
+    for text in texts:
+        if text in dict_cache:
+            results.append(dict_cache[text])
+        elif default is raise_exception:
+            raise KeyError(text)
+        else:
+            results.append(default)
+    return results
 
 def get_or_create_dictionary_item(session, name):
     """This tries to get the DictionaryItem corresponding to name from
@@ -75,46 +75,81 @@ def get_or_create_dictionary_item(session, name):
     locked under the specified session* to prevent duplicate items
     being created"""
 
+    return get_or_create_dictionary_items(session, [name])[0]
+
+def get_or_create_dictionary_items(session, names):
+    """As get_or_create_dictionary_item, but for a list of names. Existing items are retrieved with a single query,
+    and any new items are created together in a single commit."""
+
     if session not in _dict_obj:
         _dict_obj[session] = {}
+    session_objs = _dict_obj[session]
+    dict_cache = _get_dict_cache_for_session(session)
 
-    # try to get it from the cache
-    obj = _dict_obj[session].get(name, None)
-
-    if obj is not None:
-        return obj
+    # try to get them from the db
+    missing = set(name for name in names if name not in session_objs)
+    if len(missing)>0:
+        for obj in session.query(DictionaryItem).filter(DictionaryItem.text.in_(missing)):
+            session_objs[obj.text] = obj
+            dict_cache[obj.text] = obj.id
+        missing.difference_update(session_objs.keys())
 
-    # try to get it from the db
-    obj = session.query(DictionaryItem).filter_by(text=name).first()
+    if len(missing)>0:
+        # try to create them
+        try:
+            for name in missing:
+                session_objs[name] = session.merge(DictionaryItem(name))
+            session.flush()
+            new_ids = {name: session_objs[name].id for name in missing}
+            session.commit()
+            # only now that the items are committed can other sessions see them
+            dict_cache.update(new_ids)
+        except sqlalchemy.exc.IntegrityError:
+            # another process created at least one of them; fall back to getting or creating them one by one
+            session.rollback()
+            for name in missing:
+                session_objs.pop(name, None)
+            for name in missing:
+                session_objs[name] = _get_or_create_single_dictionary_item(session, name)
+                dict_cache[name] = session_objs[name].id
 
+    return [session_objs[name] for name in names]
 
+def _get_or_create_single_dictionary_item(session, name):
+    obj = session.query(DictionaryItem).filter_by(text=name).first()
     if obj is None:
-        # try to create it
         try:
-            obj = DictionaryItem(name)
-            obj = session.merge(obj)
+            obj = session.merge(DictionaryItem(name))
             session.commit()
         except sqlalchemy.exc.IntegrityError:
             session.rollback()
             obj = session.query(DictionaryItem).filter_by(text=name).first()
             if obj is None:
                 raise # can't get it from the DB, can't create it from the DB... who knows...
-
-    _dict_obj[session][name] = obj
     return obj
 
 def _get_dict_cache_for_session(session):
-    session_dict = _dict_id.get(session, None)
-    if session_dict is None:
-        session_dict = {}
-        for dict_item in session.query(DictionaryItem):
-            session_dict[dict_item.text] = dict_item.id
+    """Return the cache mapping text to id for the database underlying the given session.
+
+    The cache is shared between all sessions bound to the same database, so that short-lived sessions do not each
+    reload the dictionary table."""
+    key = str(session.get_bind().engine.url)
+    dict_cache = _dict_id.get(key, None)
+    if dict_cache is None:
+        dict_cache = {}
+        for text, id in session.query(DictionaryItem.text, DictionaryItem.id):
+            dict_cache[text] = id
+
+        _dict_id[key] = dict_cache
 
-        _dict_id[session] = session_dict
+    return dict_cache
 
-    return session_dict
+def invalidate_dictionary_cache():
+    """Discard all cached dictionary items, e.g. because the database has been replaced"""
+    _dict_id.clear()
+    _dict_obj.clear()
 
 def get_lexicon(session):
     """Get a list of all strings known in the dictionary table"""
     dict_cache = _get_dict_cache_for_session(session)
-    return dict_cache.keys()
\ No newline at end of file
+    return dict_cache.keys()
@@ -18,6 +18,9 @@ class HaloPropertyGetter(object):
 
     This base class is used to retrieve the actual HaloProperty objects.
     """
+    _cache_attribute = 'all_properties'
+    _cache_key_attribute = 'name_id'
+
     def use_fixed_cache(self, halo):
         return 'all_properties' not in sqlalchemy.inspect(halo).unloaded
 
@@ -52,13 +55,40 @@ class HaloPropertyGetter(object):
         :type halo: Halo
         :type property_id: int"""
 
-        return_vals = []
+        return self.postprocess_data_objects(self._objects_from_cache(halo, property_id))
+
+    def get_from_cache_for_many(self, halos, property_id):
+        """Get the specified property from the existing in-memory cache of each of the given halos
+
+        Returns a list with one entry per halo; the entry is as returned by get_from_cache, or None if the cache
+        of that halo does not contain the property.
+
+        :type halos: list of Halo
+        :type property_id: int"""
+        results = []
+        for halo in halos:
+            objects = self._cache_index(halo).get(property_id, None)
+            results.append(self.postprocess_data_objects(objects) if objects is not None else None)
+        return results
+
+    def _objects_from_cache(self, halo, property_id):
+        return self._cache_index(halo).get(property_id, [])
 
-        for x in halo.all_properties:
-            if x.name_id == property_id:
-                return_vals.append(x)
+    def _cache_index(self, halo):
+        """Return a dictionary mapping each id to the list of objects with that id in the in-memory cache.
 
-        return self.postprocess_data_objects(return_vals)
+        The index is built once and stored on the halo, then rebuilt only if the cached collection changes."""
+        collection = getattr(halo, self._cache_attribute)
+        indices = halo.__dict__.setdefault('_extraction_pattern_indices', {})
+        cached = indices.get(self._cache_attribute, None)
+        if cached is not None and cached[0] is collection and cached[1]==len(collection):
+            return cached[2]
+
+        index = {}
+        for x in collection:
+            index.setdefault(getattr(x, self._cache_key_attribute), []).append(x)
+        indices[self._cache_attribute] = (collection, len(collection), index)
+        return index
 
 
     def get_from_session(self, halo, property_id, session):
@@ -91,11 +121,7 @@ class HaloPropertyGetter(object):
         :type halo: Halo
         :type property_id: int"""
 
-        for x in halo.all_properties:
-            if x.name_id == property_id:
-                return True
-
-        return False
+        return property_id in self._cache_index(halo)
 
     def postprocess_data_objects(self, objects):
         """Post-process the ORM data objects to pull out the data in the form required"""
@@ -105,9 +131,12 @@ class HaloPropertyGetter(object):
 
 class HaloPropertyValueGetter(HaloPropertyGetter):
     """As HaloPropertyGetter, but return the data value (including automatic reassembly of the data if appropriate)"""
+    _reassembles = True
+
     def __init__(self):
         self._options = []
         self._providing_class = None
+        self._providing_class_inferred = False
         self._mapper = None
 
     def postprocess_data_objects(self, outputs):
@@ -119,12 +148,14 @@ class HaloPropertyValueGetter(HaloPropertyGetter):
             self._mapper = data_attribute_mapper.DataAttributeMapper(property_object)
 
     def _infer_property_class(self, property_object):
-        if self._providing_class is None:
+        if not self._providing_class_inferred:
             # Optimisation: figure out a providing class for the first output and assume it's ok for all of them
+            # (including when there is no providing class)
             try:
                 self._providing_class = property_object.name.providing_class(property_object.halo.handler_class)
             except NameError:
                 pass
+            self._providing_class_inferred = True
 
     def _postprocess_one_result(self, property_object):
         self._infer_property_class(property_object)
@@ -136,6 +167,32 @@ class HaloPropertyValueGetter(HaloPropertyGetter):
             self._setup_data_mapper(property_object)
             return self._mapper.get(property_object)
 
+    def get_from_cache_for_many(self, halos, property_id):
+        """As HaloPropertyGetter.get_from_cache_for_many, but if the providing class is able to reassemble many
+        properties at once (see TimeChunkedProperty.reassemble_many), do so"""
+        objects = [self._cache_index(halo).get(property_id, None) for halo in halos]
+        all_objects = [o for halo_objects in objects if halo_objects is not None for o in halo_objects]
+        if len(all_objects)<2:
+            return super(HaloPropertyValueGetter, self).get_from_cache_for_many(halos, property_id)
+
+        self._infer_property_class(all_objects[0])
+        if not (self._reassembles and hasattr(self._providing_class, 'has_reassemble_many')
+                and self._providing_class.has_reassemble_many()):
+            return super(HaloPropertyValueGetter, self).get_from_cache_for_many(halos, property_id)
+
+        objects_by_simulation = {}
+        for o in all_objects:
+            objects_by_simulation.setdefault(o.halo.timestep.simulation, []).append(o)
+
+        results = {}
+        for simulation, simulation_objects in objects_by_simulation.items():
+            instance = self._providing_class(simulation)
+            for o, result in zip(simulation_objects, instance.reassemble_many(simulation_objects, *self._options)):
+                results[id(o)] = result
+
+        return [[results[id(o)] for o in halo_objects] if halo_objects is not None else None
+                for halo_objects in objects]
+
 
 
 class HaloPropertyValueWithReassemblyOptionsGetter(HaloPropertyValueGetter):
@@ -146,6 +203,8 @@ class HaloPropertyValueWithReassemblyOptionsGetter(HaloPropertyValueGetter):
 
 class HaloPropertyRawValueGetter(HaloPropertyValueGetter):
     """As HaloPropertyValueGetter, but never invoke an automatic reassembly; always retrieve the raw data"""
+    _reassembles = False
+
     def _postprocess_one_result(self, property_object):
         self._setup_data_mapper(property_object)
         return self._mapper.get(property_object)
@@ -154,14 +213,8 @@ class HaloPropertyRawValueGetter(HaloPropertyValueGetter):
 
 class HaloLinkGetter(HaloPropertyGetter):
     """As HaloPropertyGetter, but retrieve HaloLinks instead of HaloProperties"""
-    def get_from_cache(self, halo, property_id):
-        return_vals = []
-
-        for x in halo.all_links:
-            if x.relation_id == property_id:
-                return_vals.append(x)
-
-        return self.postprocess_data_objects(return_vals)
+    _cache_attribute = 'all_links'
+    _cache_key_attribute = 'relation_id'
 
     def get_from_session(self, halo, property_id, session):
         from . import halo_data
@@ -169,13 +222,6 @@ class HaloLinkGetter(HaloPropertyGetter):
             halo_data.HaloLink.id)
         return self.postprocess_data_objects(query_links.all())
 
-    def cache_contains(self, halo, property_id):
-        for x in halo.all_links:
-            if x.relation_id == property_id:
-                return True
-
-        return False
-
     def keys_from_cache(self, halo):
         """Return a list of keys from an existing in-memory cache"""
         return [x.relation.text for x in halo.all_links]
@@ -193,3 +239,8 @@ class HaloLinkTargetGetter(HaloLinkGetter):
     def postprocess_data_objects(self, outputs):
         return [o.halo_to for o in outputs]
 
+class HaloLinkTargetIdGetter(HaloLinkGetter):
+    """As HaloLinkTargetGetter, but retrieve only the ids of the targets, so that the target halos are not loaded"""
+    def postprocess_data_objects(self, outputs):
+        return [o.halo_to_id for o in outputs]
+
@@ -8,6 +8,7 @@ from sqlalchemy.ext.declarative import declared_attr
 from . import extraction_patterns
 from . import Base
 from . import creator
+from . import columnar
 from .dictionary import get_dict_id, get_or_create_dictionary_item
 from .timestep import TimeStep
 import six
@@ -228,12 +229,16 @@ class Halo(Base):
     def _setitem_property(self, key, obj):
         from . import Session
         from .halo_data import HaloProperty
+        from ..live_calculation import result_cache
 
         session = Session.object_session(self)
         key = get_or_create_dictionary_item(session, key)
         X = self.properties.filter_by(name_id=key.id).first()
         if X is not None:
             X.data = obj
+            # an in-place update is not detectable from the row count, so drop any packed copy
+            columnar.invalidate_column(session, self.timestep_id, key.id)
+            result_cache.invalidate()
         else:
             X = session.merge(HaloProperty(self, key, obj))
         X.creator_id = creator.get_creator_id()
@@ -307,7 +312,7 @@ class Halo(Base):
 
         *kwargs*:
 
-        :param nmax: The maximum number of descendants to consider (default 1000)
+        :param nmax: The maximum number of descendants to consider (default config.num_history_steps_max_default)
         :param strategy: The class to use to find the descendants (default relation_finding.MultiHopMajorDescendantsStrategy)
         """
         from .. import live_calculation
@@ -315,8 +320,10 @@ class Halo(Base):
         from .. import temporary_halolist as thl
         from . import Session
         from .. import query as db_query
+        from ..live_calculation import result_cache
+        from .. import config
 
-        nmax = kwargs.get('nmax',1000)
+        nmax = kwargs.get('nmax',config.num_history_steps_max_default)
         strategy = kwargs.get('strategy', relation_finding.MultiHopMajorDescendantsStrategy)
         strategy_kwargs = kwargs.get('strategy_kwargs', {})
 
@@ -325,18 +332,23 @@ class Halo(Base):
         else:
             property_description = live_calculation.parser.parse_property_names(*plist)
 
-        # must be performed in its own session as we intentionally load in a lot of
-        # objects with incomplete lazy-loaded properties
-        session = Session()
-        try:
-            with strategy(db_query.get_halo(self.id, session), nhops_max=nmax,
-                          include_startpoint=True, **strategy_kwargs).temp_table() as tt:
-                raw_query = thl.halo_query(tt)
-                query = property_description.supplement_halo_query(raw_query)
-                results = query.all()
-                return property_description.values_sanitized(results, Session.object_session(self))
-        finally:
-            session.close()
+        def calculate():
+            # must be performed in its own session as we intentionally load in a lot of
+            # objects with incomplete lazy-loaded properties
+            session = Session()
+            try:
+                with strategy(db_query.get_halo(self.id, session), nhops_max=nmax,
+                              include_startpoint=True, **strategy_kwargs).temp_table() as tt:
+                    raw_query = thl.halo_query(tt)
+                    query = property_description.supplement_halo_query(raw_query)
+                    results = query.all()
+                    return property_description.values_sanitized(results, Session.object_session(self))
+            finally:
+                session.close()
+
+        target = ('halo', self.id, strategy.__module__ + "." + strategy.__name__, nmax) + \
+                 tuple(x for item in sorted(strategy_kwargs.items()) for x in item)
+        return result_cache.cached_values(Session.object_session(self), property_description, target, calculate)
 
     def calculate_for_progenitors(self, *plist, **kwargs):
         """Run the specified calculations on the progenitors of this halo
@@ -83,4 +83,19 @@ class HaloProperty(Base):
     def data(self, data):
         data_attribute_mapper.set_data_of_unknown_type(self, data)
 
+    @property
+    def array_compression(self):
+        """The codec with which array data for this property is stored (see properties.array_compression)"""
+        from ... import properties
+        if self.name is None:
+            return None
+        return properties.array_compression(self.name.text)
+
+    @property
+    def blob_store_name(self):
+        """The name of the sidecar blob store in which large arrays for this property may be stored"""
+        if self.halo is None or self.halo.timestep is None:
+            return None
+        return self.halo.timestep.simulation.basename
+
 
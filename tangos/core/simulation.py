@@ -1,4 +1,5 @@
 from __future__ import absolute_import
+import collections
 import datetime
 
 import numpy as np
@@ -9,6 +10,7 @@ from . import data_attribute_mapper
 from . import Base
 from . import creator
 from .. import input_handlers, config
+from ..util.fork_pool import fork_pool
 from .dictionary import DictionaryItem, get_dict_id, get_or_create_dictionary_item
 import six
 
@@ -84,6 +86,40 @@ class Simulation(Base):
         propobj.data = data
         session.commit()
 
+    def calculate_all_timesteps(self, *plist, **kwargs):
+        """Run calculate_all on every timestep of this simulation, dividing the timesteps between processes.
+
+        Returns an ordered dictionary mapping each TimeStep (in order of time) to the output of calculate_all for that
+        timestep. Other than those described below, keyword arguments are passed to calculate_all.
+
+        When called from within a parallel session (see parallel_tasks.launch), every process must make the same
+        call; the timesteps are shared out between them and all of them receive the full results. Otherwise, the
+        timesteps are shared out between a local pool of worker processes, each with its own database connection.
+        Note that results are copied between processes, so should not include database objects (e.g. halos reached
+        by links) unless they are used only after returning to the original process.
+
+        :param processes: the number of processes in the local pool. If None (default) or 1, or if the database
+                          cannot be shared between processes, the timesteps are processed in turn by this process.
+        """
+        from .. import parallel_tasks
+
+        processes = kwargs.pop('processes', None)
+        timesteps = self.timesteps
+        arguments = [(ts.id, plist, kwargs) for ts in timesteps]
+
+        if parallel_tasks.parallel_backend_loaded() and parallel_tasks.backend is not None:
+            from ..parallel_tasks import gather
+            results = dict(_calculate_all_for_timestep(a) for a in parallel_tasks.distributed(arguments))
+            results = gather.gather_dict(results)
+        elif processes is not None and processes>1 and not _database_is_in_memory():
+            # fork, so that workers start with the same database configuration and property modules as this process
+            with fork_pool(processes, _initialise_calculate_all_worker) as pool:
+                results = dict(pool.imap_unordered(_calculate_all_for_timestep, arguments))
+        else:
+            results = {ts.id: ts.calculate_all(*plist, **kwargs) for ts in timesteps}
+
+        return collections.OrderedDict((ts, results[ts.id]) for ts in timesteps)
+
     @property
     def path(self):
         return self.basename
@@ -93,6 +129,28 @@ class Simulation(Base):
         return self.basename.replace("/","%")
 
 
+def _database_is_in_memory():
+    from . import get_default_engine
+    url = get_default_engine().url
+    return url.drivername.startswith('sqlite') and url.database in (None, '', ':memory:')
+
+def _initialise_calculate_all_worker():
+    from . import use_new_session_after_fork
+    # connections inherited from the parent process must be left for the parent to use
+    use_new_session_after_fork()
+
+def _calculate_all_for_timestep(arguments):
+    from . import Session
+    from .timestep import TimeStep
+    timestep_id, plist, kwargs = arguments
+    session = Session()
+    try:
+        timestep = session.query(TimeStep).filter_by(id=timestep_id).first()
+        return timestep_id, timestep.calculate_all(*plist, **kwargs)
+    finally:
+        session.close()
+
+
 class SimulationProperty(Base):
     __tablename__ = 'simulationproperties'
 
@@ -1,6 +1,7 @@
 from __future__ import absolute_import
 import weakref
 import os, os.path
+import numpy as np
 import sqlalchemy
 from sqlalchemy import Column, Integer, String, ForeignKey, Float, Boolean, and_
 from sqlalchemy.orm import relationship, backref, aliased
@@ -120,11 +121,78 @@ class TimeStep(Base):
                             types are included.
 
         :param limit: maximum number of objects to use. If None (default), all are included.
+
+        :param chunked: if True, evaluate the calculation on chunks of objects in turn (see calculate_all_iter) and
+                        concatenate the results, so that peak memory usage does not scale with the size of the
+                        timestep. Default False.
+
+        :param chunk_size: the number of objects in each chunk, if chunked is True (default 10000)
         """
 
-        from .. import live_calculation
+        from ..live_calculation import result_cache
+        from . import Session
+
+        property_description, object_typecode, limit = self._calculate_all_arguments(plist, kwargs)
+        chunk_size = kwargs.get('chunk_size', 10000) if kwargs.get('chunked', False) else None
+
+        return result_cache.cached_values(Session.object_session(self), property_description,
+                                          ('timestep', self.id, object_typecode, limit),
+                                          lambda: self._calculate_all_uncached(property_description,
+                                                                               object_typecode, limit, chunk_size))
+
+    def calculate_all_iter(self, *plist, **kwargs):
+        """Gather the specified properties from the child objects, one chunk of objects at a time.
+
+        This is a generator which, for successive chunks of objects in order of database id, yields the output that
+        calculate_all would give for the objects in that chunk. Only one chunk of objects is loaded from the
+        database at once, so that arbitrarily large timesteps can be processed in bounded memory.
+
+        :param chunk_size: the maximum number of objects in each chunk (default 10000)
+
+        Other parameters are as for calculate_all.
+        """
+        property_description, object_typecode, limit = self._calculate_all_arguments(plist, kwargs)
+        return self._calculate_all_chunks(property_description, object_typecode, limit,
+                                          kwargs.get('chunk_size', 10000))
+
+    def calculate_all_for_progenitors(self, *plist, **kwargs):
+        """Run the specified calculations on every object in this timestep and its major progenitors.
+
+        All the histories are found and evaluated together (see live_calculation.histories), which is much faster
+        than calling Halo.calculate_for_progenitors for each object in turn.
+
+        :param object_type: as for calculate_all
+        :param nmax: the maximum number of progenitors to consider for each object
+                     (default config.num_history_steps_max_default)
+        :returns: offsets, values such that values[c][offsets[i]:offsets[i+1]] is the c-th column of the
+                  output of calculate_for_progenitors for the i-th object, in order of database id
+        """
+        from ..live_calculation import histories
+        from . import Session
+        return histories.calculate_for_progenitors(self._object_ids(kwargs), *plist,
+                                                   load_into_session=Session.object_session(self), **kwargs)
+
+    def calculate_all_for_descendants(self, *plist, **kwargs):
+        """Run the specified calculations on every object in this timestep and its major descendants.
+
+        See calculate_all_for_progenitors for the parameters and return value."""
+        from ..live_calculation import histories
+        from . import Session
+        return histories.calculate_for_descendants(self._object_ids(kwargs), *plist,
+                                                   load_into_session=Session.object_session(self), **kwargs)
+
+    def _object_ids(self, kwargs):
         from . import Session
         from .halo import Halo
+        query = Session.object_session(self).query(Halo.id).filter_by(timestep_id=self.id)
+        object_typetag = kwargs.pop('object_type', kwargs.pop('object_typetag', None))
+        if object_typetag:
+            query = query.filter_by(object_typecode=Halo.object_typecode_from_tag(object_typetag))
+        return [id for id, in query.order_by(Halo.id)]
+
+    def _calculate_all_arguments(self, plist, kwargs):
+        from .. import live_calculation
+        from .halo import Halo
 
         object_typecode = None
         object_typetag = kwargs.get('object_type', kwargs.get('object_typetag',None))
@@ -137,6 +205,24 @@ class TimeStep(Base):
         else:
             property_description = live_calculation.parser.parse_property_names(*plist)
 
+        return property_description, object_typecode, limit
+
+    def _calculate_all_uncached(self, property_description, object_typecode, limit, chunk_size=None):
+        from . import Session
+        from .halo import Halo
+
+        if not limit:
+            column_results = property_description.values_sanitized_from_column_store(self, object_typecode)
+            if column_results is not None:
+                return column_results
+            sql_results = property_description.values_sanitized_from_scalar_sql(self, object_typecode)
+            if sql_results is not None:
+                return sql_results
+
+        if chunk_size is not None:
+            chunks = self._calculate_all_chunks(property_description, object_typecode, limit, chunk_size)
+            return _concatenate_chunks(list(chunks), property_description.n_columns())
+
         # must be performed in its own session as we intentionally load in a lot of
         # objects with incomplete lazy-loaded properties
         session = Session()
@@ -153,6 +239,44 @@ class TimeStep(Base):
             session.close()
         return calculation_results
 
+    def _calculate_all_chunks(self, property_description, object_typecode, limit, chunk_size):
+        from . import Session
+        from .halo import Halo
+
+        last_id = None
+        num_done = 0
+        while not limit or num_done<limit:
+            this_chunk_size = min(chunk_size, limit-num_done) if limit else chunk_size
+
+            # each chunk has its own session, so that the objects from previous chunks can be freed
+            session = Session()
+            try:
+                id_query = session.query(Halo.id).filter_by(timestep_id=self.id)
+                if object_typecode is not None:
+                    id_query = id_query.filter_by(object_typecode=object_typecode)
+                if last_id is not None:
+                    id_query = id_query.filter(Halo.id>last_id)
+                ids = [id for id, in id_query.order_by(Halo.id).limit(this_chunk_size)]
+                if len(ids)==0:
+                    return
+
+                raw_query = session.query(Halo).filter_by(timestep_id=self.id).\
+                    filter(Halo.id>=ids[0], Halo.id<=ids[-1]).order_by(Halo.id)
+                if object_typecode is not None:
+                    raw_query = raw_query.filter_by(object_typecode=object_typecode)
+                query = property_description.supplement_halo_query(raw_query)
+                calculation_results = property_description.values_sanitized(query.all(),
+                                                                            Session.object_session(self))
+            finally:
+                session.close()
+
+            yield calculation_results
+
+            last_id = ids[-1]
+            num_done+=len(ids)
+            if len(ids)<this_chunk_size:
+                return
+
     def gather_property(self, *args, **kwargs):
         """The old alias for calculate_all, retained for compatibility"""
         return self.calculate_all(*args, **kwargs)
@@ -236,3 +360,21 @@ class TimeStep(Base):
         return q.first()
 
 
+def _concatenate_chunks(chunks, n_columns):
+    """Join the outputs of calculate_all_iter into the output calculate_all would have given"""
+    from .. import live_calculation
+    results = []
+    for column in range(n_columns):
+        arrays = [chunk[column] for chunk in chunks if len(chunk[column])>0]
+        if len(arrays)==0:
+            results.append(np.array([], dtype=object))
+        elif all(a.dtype!=object and a.dtype==arrays[0].dtype and a.shape[1:]==arrays[0].shape[1:] for a in arrays):
+            results.append(np.concatenate(arrays))
+        else:
+            # arrays of different lengths, or mixed types; reconstruct as for Calculation.values_sanitized
+            items = [x for a in arrays for x in a]
+            combined = np.empty(len(items), dtype=object)
+            for i, x in enumerate(items):
+                combined[i] = x
+            results.append(live_calculation.Calculation._make_numpy_array(combined))
+    return results
@@ -123,6 +123,14 @@ class HandlerBase(object):
             _loaded_timesteps[ts_hash] = data
             return data
 
+    def prefetch_timestep(self, ts_extension, mode=None, arrays=()):
+        """Loads the data for a timestep ahead of it being needed, e.g. from a background thread.
+
+        Returns an object which must be kept alive for as long as the data should remain cached; meanwhile
+        load_timestep will return the cached copy. Subclasses may do further work, such as building the halo
+        catalogue and reading the named arrays."""
+        return self.load_timestep(ts_extension, mode=mode)
+
     def load_region(self, ts_extension, region_specification, mode=None):
         """Returns an object that connects to the data for a timestep on disk, filtered using the
         specified region specification. Acceptable region specifications are output handler dependent.
@@ -83,6 +83,20 @@ class PynbodyInputHandler(finding.PatternBasedFileDiscovery, HandlerBase):
         else:
             raise NotImplementedError("Load mode %r is not implemented"%mode)
 
+    def prefetch_timestep(self, ts_extension, mode=None, arrays=()):
+        f = self.load_timestep(ts_extension, mode)
+        if mode is not None and mode!='partial':
+            return f
+        # the halo catalogue is needed to load objects in either mode
+        h = self._construct_halo_cat(ts_extension, 'halo')
+        if mode is None:
+            for array in arrays:
+                try:
+                    f[array]
+                except KeyError:
+                    logger.warning("Unable to prefetch array %r for %r", array, ts_extension)
+        return f, h
+
     def load_region(self, ts_extension, region_specification, mode=None):
         if mode is None:
             timestep = self.load_timestep(ts_extension, mode)
@@ -62,18 +62,17 @@ class Calculation(object):
         """Returns the name of this calculation, formatted such that parser.parse_property_name(name) generates a copy."""
         return None
 
+    _required_property_patterns = (extraction_patterns.HaloLinkGetter(), extraction_patterns.HaloPropertyGetter())
+
     def _has_required_properties(self, halo):
-        property_is_present = []
-        for p_id in self._essential_dict_ids():
-            this_property_ok = False
-            for extraction_pattern in (extraction_patterns.HaloLinkGetter(),
-                                       extraction_patterns.HaloPropertyGetter()):
-                if not extraction_pattern.use_fixed_cache(halo):
-                    this_property_ok = True
-                elif extraction_pattern.cache_contains(halo, p_id):
-                    this_property_ok = True
-            property_is_present.append(this_property_ok)
-        return all(property_is_present)
+        essential_ids = self._essential_dict_ids()
+        if len(essential_ids)==0:
+            return True
+        for extraction_pattern in self._required_property_patterns:
+            if not extraction_pattern.use_fixed_cache(halo):
+                return True
+        link_index, property_index = [p._cache_index(halo) for p in self._required_property_patterns]
+        return all(p_id in link_index or p_id in property_index for p_id in essential_ids)
 
     def retrieves_dict_ids(self):
         """Returns the dictionary IDs of the named properties to be retrieved for each halo to
@@ -98,26 +97,20 @@ class Calculation(object):
 
     def _generate_dict_ids_and_levels(self):
         if not hasattr(self, "_r_dict_ids_cached"):
-            session = core.Session()
+            retrieves = self.retrieves()
             try:
-                self._r_dict_ids_cached = set()
-                self._r_dict_ids_essential_cached = set()
-                retrieves = self.retrieves()
-                try:
-                    self._n_join_levels = max([r.count('.') for r in retrieves])+1
-                except ValueError:
-                    self._n_join_levels = 0
-                for r in retrieves:
-                    r_split = r.split(".")
-                    for w in r_split:
-                        w_dict_id = tangos.core.dictionary.get_dict_id(w, -1, session=session)
-                        if w_dict_id!=-1:
-                            self._r_dict_ids_cached.add(w_dict_id)
-                    r_dict_id = tangos.core.dictionary.get_dict_id(r_split[0], -1, session=session)
-                    if r_dict_id!=-1:
-                        self._r_dict_ids_essential_cached.add(r_dict_id)
-            finally:
-                session.close()
+                self._n_join_levels = max([r.count('.') for r in retrieves])+1
+            except ValueError:
+                self._n_join_levels = 0
+
+            # resolve all the names at once, so that at most one query is needed
+            r_splits = [r.split(".") for r in retrieves]
+            all_words = list(set(w for r_split in r_splits for w in r_split))
+            dict_ids = dict(zip(all_words, tangos.core.dictionary.get_dict_ids(all_words, -1)))
+
+            self._r_dict_ids_cached = set(i for i in dict_ids.values() if i!=-1)
+            self._r_dict_ids_essential_cached = set(dict_ids[r_split[0]] for r_split in r_splits
+                                                    if dict_ids[r_split[0]]!=-1)
 
     def values_and_description(self, halos):
         """Return the values of this calculation, as well as a PropertyCalculation object describing the
@@ -269,6 +262,51 @@ class Calculation(object):
         """Return a placeholder value for this calculation"""
         raise NotImplementedError
 
+    def values_sanitized_from_column_store(self, timestep, object_typecode=None):
+        """Return sanitized values for all objects in the timestep using packed property columns, or None if
+        the calculation cannot be answered from the column store.
+
+        See core.columnar for more information. The return value, when not None, is equivalent to calling
+        values_sanitized on all objects in the timestep (optionally restricted to the given object_typecode)."""
+        columns = self._column_store_arrays(timestep)
+        if columns is None or len(columns)==0:
+            return None
+
+        common_ids = columns[0][0]
+        for halo_ids, _ in columns[1:]:
+            common_ids = np.intersect1d(common_ids, halo_ids, assume_unique=True)
+
+        if object_typecode is not None:
+            session = core.Session.object_session(timestep)
+            typed_ids = session.query(tangos.core.halo.Halo.id).\
+                filter_by(timestep_id=timestep.id, object_typecode=object_typecode).all()
+            common_ids = np.intersect1d(common_ids, np.array([x[0] for x in typed_ids], dtype=np.int64))
+
+        return [values[np.searchsorted(halo_ids, common_ids)] for halo_ids, values in columns]
+
+    def _column_store_arrays(self, timestep):
+        """Return a list of (halo_ids, values) arrays from the column store, one per output column, or None if
+        the column store cannot be used for this calculation"""
+        return None
+
+    def values_sanitized_from_scalar_sql(self, timestep, object_typecode=None):
+        """Return sanitized values for all objects in the timestep using a single pivoting SQL query, or None if
+        the calculation involves anything other than stored scalars and simple arithmetic.
+
+        See sql_compiler for more information. The return value, when not None, is equivalent to calling
+        values_sanitized on all objects in the timestep (optionally restricted to the given object_typecode)."""
+        from . import sql_compiler
+        compiler = sql_compiler.ScalarSqlCompiler(timestep)
+        compiled_columns = self._compile_scalar_sql(compiler)
+        if compiled_columns is None:
+            return None
+        return compiler.evaluate(compiled_columns, object_typecode)
+
+    def _compile_scalar_sql(self, compiler):
+        """Return a list of compiled columns (see sql_compiler.ScalarSqlCompiler), one per output column, or None if
+        this calculation cannot be compiled"""
+        return None
+
     @staticmethod
     def _add_entries_for_duplicates(target_objs, target_ids):
         """Given a list of target_objs and their target_ids, the latter of which may contain duplicates, return the full list of objects
@@ -316,6 +354,24 @@ class MultiCalculation(Calculation):
     def n_columns(self):
         return sum(c.n_columns() for c in self.calculations)
 
+    def _column_store_arrays(self, timestep):
+        arrays = []
+        for c in self.calculations:
+            c_arrays = c._column_store_arrays(timestep)
+            if c_arrays is None:
+                return None
+            arrays+=c_arrays
+        return arrays
+
+    def _compile_scalar_sql(self, compiler):
+        columns = []
+        for c in self.calculations:
+            c_columns = c._compile_scalar_sql(compiler)
+            if c_columns is None:
+                return None
+            columns+=c_columns
+        return columns
+
 
 class FixedInput(Calculation):
     """Represents a calculation that returns a fixed value"""
@@ -353,6 +409,9 @@ class FixedNumericInput(FixedInput):
     def __str__(self):
         return str(self.value)
 
+    def _compile_scalar_sql(self, compiler):
+        return [compiler.fixed_value(self.value)]
+
 class LiveProperty(Calculation):
     """Represents a calculation that is achieved by executing the live_calculate method of a Properties instance"""
     def __new__(cls, *tokens):
@@ -418,6 +477,8 @@ class LiveProperty(Calculation):
         sim = consistent_collection.consistent_simulation_from_halos(halos)
         results = []
         calculator = properties.providing_class(self.name())(sim, *input_descriptions)
+        if calculator.has_live_calculate_batch():
+            return calculator, self._evaluate_function_batch(calculator, halos, input_values)
         for inputs in zip(halos, *input_values):
             if self._has_required_properties(inputs[0]) and all([x is not None for x in inputs]):
                 results.append(calculator.live_calculate_named(self.name(), *inputs))
@@ -425,6 +486,18 @@ class LiveProperty(Calculation):
                 results.append(None)
         return calculator, self._as_1xn_array(results)
 
+    def _evaluate_function_batch(self, calculator, halos, input_values):
+        valid = [i for i, inputs in enumerate(zip(halos, *input_values))
+                 if self._has_required_properties(inputs[0]) and all([x is not None for x in inputs])]
+        results = [None]*len(halos)
+        if len(valid)>0:
+            valid_inputs = [[values[i] for i in valid] for values in input_values]
+            batch_results = calculator.live_calculate_batch_named(self.name(), [halos[i] for i in valid],
+                                                                  *valid_inputs)
+            for i, result in zip(valid, batch_results):
+                results[i] = result
+        return self._as_1xn_array(results)
+
     @classmethod
     def _as_1xn_array(cls, results):
         results_array = np.empty((1, len(results)), dtype=object)
@@ -434,6 +507,16 @@ class LiveProperty(Calculation):
     def proxy_value(self):
         return UnknownValue(self)
 
+    def _compile_scalar_sql(self, compiler):
+        from .. import properties
+        if len(self._inputs)>0 or \
+                properties.providing_class(self.name(), silent_fail=True) is not properties.intrinsic.IntrinsicProperties:
+            return None
+        column = compiler.halo_column(self.name())
+        if column is None:
+            return None
+        return [column]
+
 class BuiltinFunction(LiveProperty):
     """Represents a calculation that is achieved by executing a python function. See the builtin_functions module."""
 
@@ -521,6 +604,18 @@ class BuiltinFunction(LiveProperty):
             inherited_description = None
         return inherited_description, self._as_1xn_array(self._func(halos, *input_values))
 
+    def _compile_scalar_sql(self, compiler):
+        inputs = []
+        for i in self._inputs:
+            i_columns = i._compile_scalar_sql(compiler)
+            if i_columns is None or len(i_columns)!=1:
+                return None
+            inputs+=i_columns
+        column = compiler.function(self._func, *inputs)
+        if column is None:
+            return None
+        return [column]
+
 
 
 class Link(Calculation):
@@ -537,7 +632,7 @@ class Link(Calculation):
             self.locator = parser.parse_property_name(self.locator)
 
         if isinstance(self.locator, StoredProperty):
-            self.locator.set_extraction_pattern(extraction_patterns.HaloLinkTargetGetter())
+            self.locator.set_extraction_pattern(extraction_patterns.HaloLinkTargetIdGetter())
             self.locator.set_multivalued() # we want to at least know if there are multiple possible links to follow
             self._expect_multivalues = True
 
@@ -584,12 +679,15 @@ class Link(Calculation):
     def values_and_description(self, halos):
         if self.locator.n_columns()!=1:
             raise ValueError("Cannot use property %r, which returns more than one column, as a halo locator"%(str(self.locator)))
-        target_halos = self._get_target_halos(halos)
-        results = np.empty((self.n_columns(),len(halos)),dtype=object)
+        return self._values_and_description_for_targets(self._get_target_halo_ids(halos),
+                                                        self._connection_for(halos))
+
+    def _values_and_description_for_targets(self, target_halo_ids, connection):
+        results = np.empty((self.n_columns(),len(target_halo_ids)),dtype=object)
 
         mask = QueryMask()
-        mask.mark_nones_as_masked(target_halos)
-        target_halo_masked = mask.mask(target_halos)
+        mask.mark_nones_as_masked(target_halo_ids)
+        target_halo_masked = mask.mask(target_halo_ids)
 
         if self._expect_multivalues:
             if self._multi_selection_basis=='first':
@@ -601,7 +699,8 @@ class Link(Calculation):
                 multivalue_folding = QueryMultivalueFolding(self._multi_selection_basis,
                                                             self._multi_selection_column, self._constraints_columns)
                 target_halo_masked = multivalue_folding.unfold(target_halo_masked)
-        values, description = self._get_values_and_description_from_halo_id_list([x.id for x in target_halo_masked])
+        values, description = self._get_values_and_description_from_halo_id_list(list(target_halo_masked),
+                                                                                  connection)
 
         if self._expect_multivalues and self._multi_selection_basis!='first':
             values = multivalue_folding.refold(values)
@@ -610,29 +709,66 @@ class Link(Calculation):
 
         return results, description
 
-    def _get_values_and_description_from_halo_id_list(self, target_halo_ids):
+    def _get_values_and_description_from_halo_id_list(self, target_halo_ids, connection):
+        if isinstance(self.property, Link) and self.property._follows_links_by_id():
+            # the halos at this level are only needed to find the next level, which can be done from their ids
+            return self.property._values_and_description_for_targets(
+                self.property._get_target_halo_ids_from_source_ids(target_halo_ids, connection), connection)
 
-        new_session = core.Session()
         # need a new session for the subqueries, because we might have cached copies of objects where
         # a different set of properties has been loaded into all_properties
+        new_session = core.Session(bind=connection)
 
-        try:
-            with thl.temporary_halolist_table(new_session, target_halo_ids) as tab:
-                target_halos_supplemented = self.property.supplement_halo_query(thl.halo_query(tab)).all()
+        with thl.temporary_halolist_table(new_session, target_halo_ids) as tab:
+            target_halos_supplemented = self.property.supplement_halo_query(thl.halo_query(tab)).all()
 
-                # sqlalchemy's deduplication means we are now missing any halos that appear more than once in
-                # target_halo_ids. But we actually want the duplication.
-                target_halos_supplemented_with_duplicates = \
-                    self._add_entries_for_duplicates(target_halos_supplemented, target_halo_ids)
+            # sqlalchemy's deduplication means we are now missing any halos that appear more than once in
+            # target_halo_ids. But we actually want the duplication.
+            target_halos_supplemented_with_duplicates = \
+                self._add_entries_for_duplicates(target_halos_supplemented, target_halo_ids)
 
-                values, description = self.property.values_and_description(target_halos_supplemented_with_duplicates)
-        finally:
-            new_session.connection().close()
+            values, description = self.property.values_and_description(target_halos_supplemented_with_duplicates)
         return values, description
 
-    def _get_target_halos(self, source_halos):
+    def _follows_links_by_id(self):
+        """Return True if the targets can be found from the ids of the source halos, without loading the halos"""
+        return self._expect_multivalues and self._multi_selection_basis=='first'
+
+    def _get_target_halo_ids(self, source_halos):
         target_halos = self.locator.values(source_halos)[0]
-        return target_halos
+        if self._expect_multivalues:
+            # the locator already returns ids (see HaloLinkTargetIdGetter)
+            return target_halos
+        target_halo_ids = np.empty(len(target_halos), dtype=object)
+        for i, t in enumerate(target_halos):
+            if t is not None:
+                target_halo_ids[i] = t.id
+        return target_halo_ids
+
+    def _get_target_halo_ids_from_source_ids(self, source_halo_ids, connection):
+        """Return, for each source halo id, the list of target ids in the order of the link ids (or None if there are
+        no links). This is equivalent to self.locator.values, but the source halos do not need to be loaded."""
+        link_class = core.halo_data.HaloLink
+        relation_id = tangos.core.dictionary.get_dict_id(self.locator.name())
+        session = core.Session(bind=connection)
+        targets = {}
+        with thl.temporary_halolist_table(session, sorted(set(source_halo_ids))) as tab:
+            query = session.query(link_class.halo_from_id, link_class.halo_to_id).select_from(tab).\
+                join(link_class, link_class.halo_from_id == tab.c.halo_id).\
+                filter(link_class.relation_id == relation_id).order_by(link_class.id)
+            for halo_from_id, halo_to_id in query.all():
+                targets.setdefault(halo_from_id, []).append(halo_to_id)
+        target_halo_ids = np.empty(len(source_halo_ids), dtype=object)
+        for i, halo_id in enumerate(source_halo_ids):
+            target_halo_ids[i] = targets.get(halo_id, None)
+        return target_halo_ids
+
+    @staticmethod
+    def _connection_for(halos):
+        session = core.Session.object_session(halos[0]) if len(halos)>0 else None
+        if session is None:
+            session = core.get_default_session()
+        return session.connection()
 
 
 
@@ -675,12 +811,12 @@ class StoredProperty(Calculation):
     def values(self, halos):
         self._name_id = tangos.core.dictionary.get_dict_id(self._name)
         ret = np.empty((1,len(halos)),dtype=object)
-        for i, h in enumerate(halos):
-            if self._extraction_pattern.cache_contains(h, self._name_id):
+        for i, h_values in enumerate(self._extraction_pattern.get_from_cache_for_many(halos, self._name_id)):
+            if h_values is not None:
                 if self._multivalued:
-                    ret[0,i]=self._extraction_pattern.get_from_cache(h, self._name_id)
+                    ret[0,i]=h_values
                 else:
-                    ret[0, i] = self._extraction_pattern.get_from_cache(h, self._name_id)[0]
+                    ret[0, i] = h_values[0]
         return ret
 
     def values_and_description(self, halos):
@@ -707,6 +843,50 @@ class StoredProperty(Calculation):
         """Return a placeholder value for this calculation"""
         return UnknownValue(self._name)
 
+    def _retrieves_plain_values(self, timestep):
+        """Return True if the values retrieved are the stored data, without reassembly or other processing"""
+        from .. import properties
+        if self._multivalued or \
+                type(self._extraction_pattern) is not extraction_patterns.HaloPropertyValueGetter:
+            return False
+
+        providing_class = properties.providing_class(self._name, timestep.simulation.output_handler_class,
+                                                     silent_fail=True)
+        return not hasattr(providing_class, 'reassemble')
+
+    def _compile_scalar_sql(self, compiler):
+        from .. import properties
+        if not self._retrieves_plain_values(compiler.timestep):
+            return None
+
+        sim = compiler.timestep.simulation
+        description_class = properties.providing_class(self._name, sim.output_handler_class, silent_fail=True)
+        if description_class is not None:
+            try:
+                description_class(sim)
+            except Exception:
+                # leave the usual engine to warn about the problem (see values_and_description)
+                return None
+
+        column = compiler.stored_property(self._name)
+        if column is None:
+            return None
+        return [column]
+
+    def _column_store_arrays(self, timestep):
+        if not self._retrieves_plain_values(timestep):
+            return None
+
+        session = core.Session.object_session(timestep)
+        name_id = tangos.core.dictionary.get_dict_id(self._name, None, session=session)
+        if name_id is None:
+            return None
+
+        arrays = core.columnar.get_column_arrays(session, timestep.id, name_id)
+        if arrays is None:
+            return None
+        return [arrays]
+
 
 
 
@@ -32,36 +32,71 @@ def _find_progenitor_or_descendant(source_halos, property_proxy, property_criter
 
     # eliminate all None values
     mask = np.asarray(values)!=None
-    sources_for_each_value = np.asarray(sources_for_each_value)[mask]
+    sources_for_each_value = np.asarray(sources_for_each_value, dtype=np.intp)[mask]
     db_objects_for_each_value = np.asarray(db_objects_for_each_value)[mask]
-    values = np.asarray(values)[mask]
-
-    # now re-organize the values so that we have one per source
-    values_per_source = {s: [] for s in range(len(source_halos))}
-    objs_per_source = {s: [] for s in range(len(source_halos))}
-    for source, value, obj in zip(sources_for_each_value, values, db_objects_for_each_value):
-        values_per_source[source].append(value)
-        objs_per_source[source].append(obj)
-
-    results = []
-    for s in range(len(source_halos)):
-        vals = values_per_source[s]
-        objs = objs_per_source[s]
-        assert len(vals) == len(objs)
-        if len(vals) == 0:
-            results.append(None)
-        else:
-            try:
-                if property_criterion == 'min':
-                    index = np.argmin(vals)
-                elif property_criterion == 'max':
-                    index = np.argmax(vals)
-                else:
-                    assert False  # should not reach this point
-                results.append(objs[index])
-            except ValueError:
-                results.append(None) # argmin/argmax of empty sequence -> no candidate results
+    values = list(np.asarray(values)[mask])
 
+    typed_values = _as_typed_array(values)
+    if typed_values is None:
+        index_for_each_source = _select_per_source(sources_for_each_value, values, property_criterion)
+    else:
+        index_for_each_source = _select_per_source_vectorised(sources_for_each_value, typed_values,
+                                                              property_criterion)
+
+    results = [None]*len(source_halos)
+    for source, index in index_for_each_source.items():
+        results[source] = db_objects_for_each_value[index]
+
+    return results
+
+def _as_typed_array(values):
+    """Return the values as a 1D numeric numpy array, or None if they are not all numeric scalars"""
+    if len(values)==0:
+        return np.zeros(0)
+    try:
+        typed = np.asarray(values)
+    except ValueError:
+        return None
+    if typed.ndim!=1 or typed.dtype.kind not in 'biuf':
+        return None
+    if typed.dtype.kind=='b':
+        typed = typed.astype(np.int8)
+    return typed
+
+def _select_per_source_vectorised(sources, values, property_criterion):
+    """Return a dictionary mapping each source to the index of its min or max value.
+
+    The values are sorted by source and then by value, and the first of each segment is selected. Ties go to the
+    earliest value and NaNs are preferred to any other value, exactly as for np.argmin and np.argmax."""
+    if property_criterion=='max':
+        values = -values.astype(np.float64) if values.dtype.kind=='u' else -values
+    not_nan = ~np.isnan(values) if values.dtype.kind=='f' else np.ones(len(values), dtype=bool)
+    order = np.lexsort((np.arange(len(values)), values, not_nan, sources))
+    sorted_sources = sources[order]
+    first_of_segment = np.ones(len(order), dtype=bool)
+    first_of_segment[1:] = sorted_sources[1:]!=sorted_sources[:-1]
+    return dict(zip(sorted_sources[first_of_segment].tolist(), order[first_of_segment].tolist()))
+
+def _select_per_source(sources, values, property_criterion):
+    """As _select_per_source_vectorised, but for values that are not numeric"""
+    values_per_source = {}
+    indices_per_source = {}
+    for index, (source, value) in enumerate(zip(sources, values)):
+        values_per_source.setdefault(source, []).append(value)
+        indices_per_source.setdefault(source, []).append(index)
+
+    results = {}
+    for source, vals in values_per_source.items():
+        try:
+            if property_criterion == 'min':
+                index = np.argmin(vals)
+            elif property_criterion == 'max':
+                index = np.argmax(vals)
+            else:
+                assert False  # should not reach this point
+            results[source] = indices_per_source[source][index]
+        except ValueError:
+            pass # argmin/argmax of empty sequence -> no candidate results
     return results
 
 @BuiltinFunction.register
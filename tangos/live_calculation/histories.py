@@ -0,0 +1,92 @@
+"""Live calculations along the major progenitor or descendant branches of many halos at once.
+
+Halo.calculate_for_progenitors finds the branch of a single halo with a multi-hop query, then fetches the
+properties of the halos on it. Looping that over thousands of halos is slow, so the functions here instead find
+all the branches together (using the materialised branches, or the in-memory link graph, as described in
+relation_finding.branches) and then fetch and evaluate the properties of every halo on every branch in one go.
+
+The results are ragged: each history may have a different length. They are returned as an array of offsets
+together with one flat array per calculation column, such that the history of the i-th starting halo is
+values[c][offsets[i]:offsets[i+1]]. Each history is identical to what calculate_for_progenitors (or
+calculate_for_descendants) would return for that halo.
+"""
+
+from __future__ import absolute_import
+import numpy as np
+
+from .. import config
+from .. import core
+from .. import temporary_halolist as thl
+from ..core import branches
+
+
+def calculate_for_progenitors(halos, *plist, **kwargs):
+    """Run the specified calculations on each of the given halos and its major progenitors
+
+    :param halos: the halos (or their database ids) to start from
+    :param nmax: the maximum number of progenitors to consider for each halo
+                 (default config.num_history_steps_max_default)
+    :returns: offsets, values; see the module docstring
+    """
+    return _calculate_along_branches(branches.MAJOR_PROGENITOR, halos, plist, kwargs)
+
+
+def calculate_for_descendants(halos, *plist, **kwargs):
+    """Run the specified calculations on each of the given halos and its major descendants
+
+    Parameters and return values are as for calculate_for_progenitors."""
+    return _calculate_along_branches(branches.MAJOR_DESCENDANT, halos, plist, kwargs)
+
+
+def _calculate_along_branches(kind, halos, plist, kwargs):
+    from . import Calculation, parser
+    from ..relation_finding import branches as branch_finding
+
+    nmax = kwargs.get('nmax', config.num_history_steps_max_default)
+    load_into_session = kwargs.get('load_into_session', None)
+
+    if isinstance(plist[0], Calculation):
+        property_description = plist[0]
+    else:
+        property_description = parser.parse_property_names(*plist)
+
+    start_ids = [h.id if isinstance(h, core.halo.Halo) else int(h) for h in halos]
+    if load_into_session is None and len(halos)>0 and isinstance(halos[0], core.halo.Halo):
+        load_into_session = core.Session.object_session(halos[0])
+
+    # must be performed in its own session as we intentionally load in a lot of
+    # objects with incomplete lazy-loaded properties
+    session = core.Session()
+    try:
+        chains = branch_finding.follow_chains(session, kind, start_ids, nmax)
+        flat_ids = []
+        source_lengths = []
+        for start_id, chain in zip(start_ids, chains):
+            flat_ids.append(start_id)
+            flat_ids.extend(halo_id for halo_id, _ in chain)
+            source_lengths.append(len(chain)+1)
+
+        # each halo is loaded and evaluated once, even if it lies on the branches of several starting halos
+        unique_ids = list(dict.fromkeys(flat_ids))
+        with thl.temporary_halolist_table(session, unique_ids) as table:
+            loaded = property_description.supplement_halo_query(thl.halo_query(table)).all()
+        halo_by_id = {h.id: h for h in loaded}
+        unique_halos = [halo_by_id[i] for i in unique_ids]
+
+        unique_values = property_description.values(unique_halos)
+        index_of_id = {halo_id: i for i, halo_id in enumerate(unique_ids)}
+        flat_values = unique_values[:, [index_of_id[i] for i in flat_ids]]
+
+        # as for values_sanitized, any halo for which a column is None is omitted
+        keep = np.all([[v is not None for v in row] for row in flat_values], axis=0)
+        if len(flat_ids)>0:
+            kept_per_source = np.add.reduceat(keep.astype(int), np.cumsum([0]+source_lengths[:-1]))
+        else:
+            kept_per_source = np.zeros(0, dtype=int)
+        offsets = np.concatenate(([0], np.cumsum(kept_per_source))).astype(int)
+
+        values = property_description._sanitize_values(flat_values, load_into_session, no_results_raises=False)
+    finally:
+        session.close()
+
+    return offsets, values
@@ -0,0 +1,240 @@
+"""Opt-in cache for the results of live calculations.
+
+The web server and interactive sessions tend to repeat the same calculate_all and calculate_for_progenitors calls.
+When the cache is enabled (see enable, or config.result_cache_max_bytes and config.result_cache_path), those
+results are stored keyed on the normalised calculation string, the target (the timestep, or the halo and the
+strategy used to find its relatives) and a revision token for the database. The token is cheap to evaluate, being
+made of the maximum ids of the halos, haloproperties, halolink and creators tables and the number of creators, so
+it changes whenever objects, properties or links are added or a run is removed with tangos rm. In-place updates of
+existing properties are not detected by the token; within a process, Halo.__setitem__ calls invalidate() for that
+reason, but other processes sharing an on-disk cache must call invalidate() themselves.
+
+There are two tiers: an in-memory least-recently-used store with a byte budget, and an optional directory of
+pickled results which can be shared between processes and persists between sessions. Results that contain
+database objects (e.g. halos reached through links) are never cached, as those are bound to a session.
+"""
+
+from __future__ import absolute_import
+import collections
+import copy
+import hashlib
+import os
+import pickle
+import threading
+
+import numpy as np
+from sqlalchemy import func
+
+from .. import config, core
+
+CacheInfo = collections.namedtuple("CacheInfo", ["hits", "disk_hits", "misses", "currsize", "maxsize"])
+
+_SIMPLE_TYPES = (int, float, str, bool, type(None))
+
+
+def _replace_file(source, destination):
+    """Atomically replace destination by source where the platform allows it"""
+    if hasattr(os, 'replace'):
+        os.replace(source, destination)
+        return
+    # python 2: rename is atomic on posix, but fails on Windows if the destination exists
+    try:
+        os.rename(source, destination)
+    except OSError:
+        if os.path.exists(destination):
+            os.remove(destination)
+        os.rename(source, destination)
+
+
+class ResultCache(object):
+    """Stores the sanitized results of calculations, keyed as described in the module docstring"""
+
+    def __init__(self, max_bytes, path=None):
+        self.max_bytes = max_bytes
+        self.path = path
+        self._entries = collections.OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.RLock()
+        self.hits = self.disk_hits = self.misses = 0
+        if path is not None and not os.path.exists(path):
+            os.makedirs(path)
+
+    def key(self, session, description, target):
+        """Return the key for the results of the given calculation applied to the target, or None if the results
+        cannot be cached
+
+        :param target: a tuple identifying the objects the calculation is applied to, containing only simple types"""
+        try:
+            expression = str(description)
+        except NotImplementedError:
+            return None
+        if not all(isinstance(t, _SIMPLE_TYPES) for t in target):
+            return None
+        return (str(session.get_bind().engine.url), expression, target, database_revision(session))
+
+    def get(self, key):
+        """Return a copy of the cached results for the key, or None if there are none"""
+        with self._lock:
+            values = self._entries.get(key, None)
+            if values is not None:
+                # mark as most recently used (OrderedDict.move_to_end is not available on python 2)
+                self._entries[key] = self._entries.pop(key)
+                self.hits += 1
+                return _copy_values(values)
+
+            values = self._load_from_disk(key)
+            if values is not None:
+                self._store_in_memory(key, values)
+                self.disk_hits += 1
+                return _copy_values(values)
+
+            self.misses += 1
+            return None
+
+    def put(self, key, values):
+        """Store the results for the key, unless they contain database objects"""
+        if not _is_cacheable(values):
+            return
+        values = _copy_values(values)
+        with self._lock:
+            self._store_in_memory(key, values)
+            self._store_on_disk(key, values)
+
+    def clear(self):
+        """Remove all entries from both tiers, leaving the hit and miss counters intact"""
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+            if self.path is not None:
+                for filename in os.listdir(self.path):
+                    if filename.endswith(".pickle"):
+                        os.remove(os.path.join(self.path, filename))
+
+    def cache_info(self):
+        return CacheInfo(self.hits, self.disk_hits, self.misses, self._nbytes, self.max_bytes)
+
+    def _store_in_memory(self, key, values):
+        nbytes = _nbytes(values)
+        if nbytes > self.max_bytes:
+            return
+        if key in self._entries:
+            self._nbytes -= _nbytes(self._entries.pop(key))
+        self._entries[key] = values
+        self._nbytes += nbytes
+        while self._nbytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._nbytes -= _nbytes(evicted)
+
+    def _filename(self, key):
+        return os.path.join(self.path, hashlib.sha1(repr(key).encode('utf-8')).hexdigest() + ".pickle")
+
+    def _store_on_disk(self, key, values):
+        if self.path is None:
+            return
+        filename = self._filename(key)
+        temporary_filename = "%s.%d.tmp" % (filename, os.getpid())
+        with open(temporary_filename, 'wb') as f:
+            pickle.dump((key, values), f, protocol=pickle.HIGHEST_PROTOCOL)
+        _replace_file(temporary_filename, filename)
+
+    def _load_from_disk(self, key):
+        if self.path is None:
+            return None
+        try:
+            with open(self._filename(key), 'rb') as f:
+                stored_key, values = pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if stored_key != key:
+            return None
+        return values
+
+
+def database_revision(session):
+    """Return a token that changes when objects, properties, links or runs are added to or removed from the
+    database"""
+    columns = [core.halo.Halo.id, core.halo_data.HaloProperty.id, core.halo_data.HaloLink.id, core.creator.Creator.id]
+    subqueries = [session.query(func.max(c)).as_scalar() for c in columns]
+    subqueries.append(session.query(func.count(core.creator.Creator.id)).as_scalar())
+    return tuple(session.query(*subqueries).one())
+
+
+def _nbytes(values):
+    total = 0
+    for array in values:
+        total += array.nbytes
+        if array.dtype == object:
+            total += sum(x.nbytes for x in array.flat if isinstance(x, np.ndarray))
+    return total
+
+
+def _is_cacheable(values):
+    for array in values:
+        if array.dtype == object:
+            for x in array.flat:
+                if isinstance(x, core.Base):
+                    return False
+                if isinstance(x, np.ndarray) and not _is_cacheable([x]):
+                    return False
+    return True
+
+
+def _copy_values(values):
+    # object arrays may hold other arrays, which must also be copied to protect the cached version
+    return [copy.deepcopy(a) if a.dtype == object else a.copy() for a in values]
+
+
+_cache = None
+
+
+def enable(max_bytes=None, path=None):
+    """Start caching results, keeping up to max_bytes in memory and, if path is given, storing them on disk in
+    that folder. Any previously cached results are discarded."""
+    global _cache
+    if max_bytes is None:
+        max_bytes = config.result_cache_max_bytes
+    _cache = ResultCache(max_bytes, path)
+
+
+def disable():
+    """Stop caching results and discard the in-memory cache"""
+    global _cache
+    _cache = None
+
+
+def get_cache():
+    """Return the active ResultCache, or None if caching is not enabled"""
+    return _cache
+
+
+def invalidate():
+    """Discard all cached results, e.g. because existing properties have been updated in place"""
+    if _cache is not None:
+        _cache.clear()
+
+
+def cache_info():
+    """Return the hit and miss counters and the memory usage of the cache, or None if caching is not enabled"""
+    if _cache is None:
+        return None
+    return _cache.cache_info()
+
+
+def cached_values(session, description, target, calculate):
+    """Return calculate(), the sanitized values of the description applied to the target, using the cache if
+    it is enabled. See ResultCache.key for the meaning of the parameters."""
+    cache = _cache
+    if cache is None:
+        return calculate()
+    key = cache.key(session, description, target)
+    if key is None:
+        return calculate()
+    values = cache.get(key)
+    if values is None:
+        values = calculate()
+        cache.put(key, values)
+    return values
+
+
+if config.result_cache_max_bytes > 0 or config.result_cache_path is not None:
+    enable(path=config.result_cache_path)
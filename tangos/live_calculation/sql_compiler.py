@@ -0,0 +1,150 @@
+"""Evaluation of live calculations involving only stored scalars, using a single SQL query.
+
+TimeStep.calculate_all normally loads every object in the timestep as an ORM instance, along with the properties
+it needs, and then evaluates the calculation tree object by object. When the calculation involves only stored
+scalar properties, the dbid(), halo_number() and finder_id() columns, fixed numbers and arithmetic or comparison
+functions, the same results can instead be obtained from one query that pivots the haloproperties table into
+a column per property name (using conditional aggregation), followed by vectorised numpy operations.
+
+Calculation subclasses that can take part implement _compile_scalar_sql, returning one compiled column per
+output column. If any part of the tree cannot be compiled, or the stored data turns out not to be simple scalars,
+the calculation falls back to the usual engine.
+"""
+
+from __future__ import absolute_import
+import numpy as np
+from sqlalchemy import func, case
+
+from .. import core
+from .builtin_functions import arithmetic
+
+_FUNCTIONS = {arithmetic.abs: np.abs, arithmetic.sqrt: np.sqrt, arithmetic.log: np.log,
+              arithmetic.log10: np.log10, arithmetic.subtract: np.subtract, arithmetic.add: np.add,
+              arithmetic.divide: np.divide, arithmetic.multiply: np.multiply, arithmetic.greater: np.greater,
+              arithmetic.less: np.less, arithmetic.equal: np.equal, arithmetic.greater_equal: np.greater_equal,
+              arithmetic.less_equal: np.less_equal, arithmetic.logical_and: np.logical_and,
+              arithmetic.logical_or: np.logical_or, arithmetic.logical_not: np.logical_not,
+              arithmetic.power: np.power}
+
+_HALO_COLUMNS = {'dbid': 'id', 'halo_number': 'halo_number', 'finder_id': 'finder_id'}
+
+
+def _array_and_validity(column):
+    valid = np.array([v is not None for v in column], dtype=bool)
+    return np.array([v if v is not None else 0 for v in column]), valid
+
+
+class ScalarQueryResults(object):
+    """The pivoted rows for every object in the timestep, as numpy arrays"""
+
+    def __init__(self, rows, name_ids):
+        self.n = len(rows)
+        columns = list(zip(*rows)) if self.n>0 else [()]*(3+3*len(name_ids))
+        self._halo_columns = {name: _array_and_validity(c) for name, c in
+                              zip(('id', 'halo_number', 'finder_id'), columns[:3])}
+        self._stored = {}
+        for i, name_id in enumerate(name_ids):
+            counts, floats, ints = columns[3+3*i:6+3*i]
+            self._stored[name_id] = self._stored_values(np.array(counts, dtype=np.int64), floats, ints)
+
+    @staticmethod
+    def _stored_values(counts, floats, ints):
+        """Return the values and validity of one stored property, or None if they are not all simple scalars of
+        a single type"""
+        floats, has_float = _array_and_validity(floats)
+        ints, has_int = _array_and_validity(ints)
+        if np.any(counts>1) or np.any((counts==1) & ~has_float & ~has_int):
+            # multiple values for one object, or non-scalar values
+            return None
+        if np.any(has_float) and np.any(has_int):
+            return None
+        if np.any(has_int):
+            return ints.astype(np.int64), has_int
+        else:
+            return floats.astype(np.float64), has_float
+
+    def is_usable(self):
+        return all(v is not None for v in self._stored.values())
+
+    def halo_column(self, name):
+        return self._halo_columns[name]
+
+    def stored(self, name_id):
+        return self._stored[name_id]
+
+
+class ScalarSqlCompiler(object):
+    """Collects the requirements of a calculation tree for the given timestep, then evaluates it.
+
+    Each compiled column is a function that takes ScalarQueryResults and returns an array of values for each
+    object, together with a boolean array that is False where the live-calculation engine would give None."""
+
+    def __init__(self, timestep):
+        self.timestep = timestep
+        self._session = core.Session.object_session(timestep)
+        self._name_ids = []
+
+    def stored_property(self, name):
+        name_id = core.dictionary.get_dict_id(name, None, session=self._session)
+        if name_id is None:
+            return None
+        if name_id not in self._name_ids:
+            self._name_ids.append(name_id)
+        return lambda results: results.stored(name_id)
+
+    def halo_column(self, name):
+        if name not in _HALO_COLUMNS:
+            return None
+        column_name = _HALO_COLUMNS[name]
+        return lambda results: results.halo_column(column_name)
+
+    def fixed_value(self, value):
+        return lambda results: (np.full(results.n, value), np.ones(results.n, dtype=bool))
+
+    def function(self, function, *inputs):
+        if function not in _FUNCTIONS or any(i is None for i in inputs):
+            return None
+        op = _FUNCTIONS[function]
+
+        def evaluate(results):
+            evaluated_inputs = [i(results) for i in inputs]
+            valid = np.logical_and.reduce([v for _, v in evaluated_inputs])
+            # as for arithmetic_binary_op, inputs are converted to float; only valid rows are computed, so that
+            # no spurious warnings arise from rows that will be discarded
+            values = op(*[np.asarray(x[valid], dtype=float) for x, _ in evaluated_inputs])
+            output = np.zeros(results.n, dtype=values.dtype)
+            output[valid] = values
+            return output, valid
+        return evaluate
+
+    def _query(self, object_typecode):
+        Halo = core.halo.Halo
+        HaloProperty = core.halo_data.HaloProperty
+        columns = [Halo.id, Halo.halo_number, Halo.finder_id]
+        for name_id in self._name_ids:
+            is_name = HaloProperty.name_id == name_id
+            columns += [func.count(case([(is_name, HaloProperty.id)])),
+                        func.max(case([(is_name, HaloProperty.data_float)])),
+                        func.max(case([(is_name, HaloProperty.data_int)]))]
+
+        query = self._session.query(*columns).select_from(Halo)
+        if len(self._name_ids)>0:
+            query = query.outerjoin(HaloProperty, (HaloProperty.halo_id == Halo.id) &
+                                    HaloProperty.name_id.in_(self._name_ids))
+        query = query.filter(Halo.timestep_id == self.timestep.id)
+        if object_typecode is not None:
+            query = query.filter(Halo.object_typecode == object_typecode)
+        return query.group_by(Halo.id).order_by(Halo.id).all()
+
+    def evaluate(self, compiled_columns, object_typecode=None):
+        """Return sanitized values for the compiled columns, or None if the stored data are not suitable"""
+        results = ScalarQueryResults(self._query(object_typecode), self._name_ids)
+        if not results.is_usable():
+            return None
+
+        values, valid = zip(*[c(results) for c in compiled_columns])
+        keep = np.logical_and.reduce(valid)
+        if not np.any(keep):
+            # as for Calculation.values_sanitized, empty results are object arrays
+            return [np.array([], dtype=object) for _ in compiled_columns]
+        return [v[keep] for v in values]
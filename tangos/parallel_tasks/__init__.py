@@ -103,6 +103,8 @@ def _server_thread():
     alive = [True for i in range(backend.size())]
     awaiting_barrier = [False for i in range(backend.size())]
 
+    from . import database
+
     while any(alive[1:]):
         obj = message.Message.receive()
         if isinstance(obj, MessageExit):
@@ -110,6 +112,14 @@ def _server_thread():
         else:
             obj.process()
 
+        # write results buffered on behalf of the workers (see database.send_properties_to_writer) a chunk at a
+        # time, so that messages from other processes are not held up by a long commit
+        while database.write_buffered_properties_chunk() and not backend.message_waiting():
+            pass
+
+    # write any results still buffered
+    database.flush_buffered_properties()
+
 
     log.logger.info("Terminating manager")
 
@@ -17,6 +17,9 @@ def receive_any(source=None):
     data = comm.recv(source=source, tag=MPI.ANY_TAG, status=status)
     return data, status.source, status.tag
 
+def message_waiting():
+    return comm.Iprobe(source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG)
+
 def receive(source=None, tag=0):
     if source is None:
         source = MPI.ANY_SOURCE
@@ -36,6 +36,10 @@ def receive_any(source=None):
     return receive(source,None,True)
 
 
+def message_waiting():
+    """Return True if a message is ready to be received, without blocking"""
+    return len(_recv_buffer)>0 or _pipe.poll()
+
 def receive(source=None, tag=0, return_tag=False):
     while True:
         try:
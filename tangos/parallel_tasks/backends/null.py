@@ -11,6 +11,9 @@ def receive(source=None, tag=0):
 def receive_any(source=None):
     raise RuntimeError("Cannot receive data from another CPU: parallelism is disabled")
 
+def message_waiting():
+    return False
+
 def rank():
     return 0
 
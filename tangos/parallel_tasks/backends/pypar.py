@@ -14,6 +14,10 @@ def receive_any(source=None):
     data, status = pypar.receive(source=source, return_status=True, tag=pypar.any_tag)
     return data, status.source, status.tag
 
+def message_waiting():
+    # no non-blocking probe is used with pypar, so conservatively assume a message may be waiting
+    return True
+
 def receive(source=None, tag=0):
     if source is None:
         source = pypar.mpiext.MPI_ANY_SOURCE
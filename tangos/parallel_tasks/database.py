@@ -1,8 +1,10 @@
 from __future__ import absolute_import
-from .. import core
+from .. import core, config
+from ..log import logger
 from . import message
 from . import remote_import
 import sys
+import time
 
 class MessageRequestCreatorId(message.Message):
     def process(self):
@@ -31,3 +33,109 @@ def synchronize_creator_object(session=None):
     MessageRequestCreatorId().send(0)
     id = MessageDeliverCreatorId.receive(0).contents
     core.creator.set_creator(session.query(core.creator.Creator).filter_by(id=id).first())
+
+
+class MessageBufferProperties(message.Message):
+    """Sent to the server process to queue (halo_id, property_name, value, value_is_link) tuples for writing"""
+    def process(self):
+        _buffered_properties.extend(self.contents)
+        _schedule_flush_if_due()
+
+_buffered_properties = []
+_num_properties_due = 0 # number of properties at the start of _buffered_properties that are due to be written
+_last_flush_time = time.time()
+_flush_start_time = None
+_num_properties_flushed = 0
+_writer_module_imported_on_server = False
+
+
+def send_properties_to_writer(property_list):
+    """Send a list of (halo, property_name, value) tuples to the server process, which writes them to the database.
+
+    Unlike cached_writer.insert_list, this does not wait for the database. The server process batches results from
+    all processes and commits them according to config.dedicated_writer_batch_size and
+    config.dedicated_writer_max_delay, in chunks of config.dedicated_writer_chunk_size between handling other
+    messages; any remaining results are written when the server shuts down."""
+    global _writer_module_imported_on_server
+    if not _writer_module_imported_on_server:
+        remote_import.ImportRequestMessage(__name__).send(0)
+        _writer_module_imported_on_server = True
+
+    rows = []
+    for halo, name, value in property_list:
+        if value is None:
+            continue
+        halo_id = halo.id if isinstance(halo, core.halo.Halo) else halo
+        if isinstance(value, core.halo.Halo):
+            rows.append((halo_id, name, value.id, True))
+        else:
+            rows.append((halo_id, name, value, False))
+    MessageBufferProperties(rows).send(0)
+
+
+def _schedule_flush_if_due():
+    """Mark all buffered properties as due to be written, once enough have accumulated or enough time has elapsed
+    since the last write"""
+    global _num_properties_due, _flush_start_time, _num_properties_flushed
+    if len(_buffered_properties)<config.dedicated_writer_batch_size and \
+            time.time()-_last_flush_time<config.dedicated_writer_max_delay:
+        return
+    if _num_properties_due==0:
+        _flush_start_time = time.time()
+        _num_properties_flushed = 0
+    _num_properties_due = len(_buffered_properties)
+
+def write_buffered_properties_chunk():
+    """Write up to config.dedicated_writer_chunk_size of the buffered properties that are due; called on the server
+    process between messages.
+
+    Writing is deferred while any process holds the insert_list lock. Returns True if further properties are due to
+    be written."""
+    from .lock import lock_in_use
+    global _buffered_properties, _num_properties_due, _last_flush_time, _num_properties_flushed
+
+    if _num_properties_due==0 or lock_in_use("insert_list"):
+        return False
+
+    chunk_size = min(config.dedicated_writer_chunk_size, _num_properties_due)
+    _write_rows(_buffered_properties[:chunk_size])
+    _buffered_properties = _buffered_properties[chunk_size:]
+    _num_properties_due-=chunk_size
+    _num_properties_flushed+=chunk_size
+
+    if _num_properties_due==0:
+        _last_flush_time = time.time()
+        logger.info("Writer committed %d properties in %.2fs", _num_properties_flushed,
+                    _last_flush_time-_flush_start_time)
+    return _num_properties_due>0
+
+def flush_buffered_properties():
+    """Write all buffered properties to the database; called on the server process once the workers have exited"""
+    global _buffered_properties, _num_properties_due, _last_flush_time
+
+    if len(_buffered_properties)==0:
+        return
+
+    to_write = _buffered_properties
+    _buffered_properties = []
+    _num_properties_due = 0
+    chunk_size = config.dedicated_writer_chunk_size
+    start = time.time()
+    for i in range(0, len(to_write), chunk_size):
+        _write_rows(to_write[i:i+chunk_size])
+    _last_flush_time = time.time()
+    logger.info("Writer committed %d properties in %.2fs", len(to_write), _last_flush_time-start)
+
+
+def _write_rows(rows):
+    from .. import cached_writer
+    session = core.get_default_session()
+    link_target_ids = set(r[2] for r in rows if r[3])
+    if len(link_target_ids)>0:
+        link_targets = {h.id: h for h in
+                        session.query(core.halo.Halo).filter(core.halo.Halo.id.in_(link_target_ids)).all()}
+    else:
+        link_targets = {}
+    property_list = [(halo_id, name, link_targets[value] if is_link else value)
+                     for halo_id, name, value, is_link in rows]
+    cached_writer._insert_list_bulk_unlocked(property_list)
@@ -0,0 +1,43 @@
+from __future__ import absolute_import
+from . import message
+from . import remote_import
+
+_gathered = {}
+_num_delivered = 0
+
+
+class MessageContributeToGather(message.Message):
+    def process(self):
+        _gathered.update(self.contents)
+
+
+class MessageRequestGathered(message.Message):
+    def process(self):
+        from . import backend
+        global _gathered, _num_delivered
+        MessageDeliverGathered(_gathered).send(self.source)
+        _num_delivered += 1
+        if _num_delivered == backend.size()-1:
+            # every process has its copy; get ready for the next gather
+            _gathered = {}
+            _num_delivered = 0
+
+
+class MessageDeliverGathered(message.Message):
+    pass
+
+
+def gather_dict(partial_results):
+    """Combine dictionaries from all processes, returning the combined dictionary to each of them.
+
+    Every process taking part in the parallel session must call this, typically after processing its share
+    of the jobs from distributed(), and the keys supplied by different processes should not overlap."""
+    from . import backend, barrier
+
+    assert backend is not None, "Parallelism is not initialised"
+    remote_import.ImportRequestMessage(__name__).send(0)
+    MessageContributeToGather(partial_results).send(0)
+    # all contributions must have reached the server before any process asks for the result
+    barrier()
+    MessageRequestGathered().send(0)
+    return MessageDeliverGathered.receive(0).contents
@@ -112,6 +112,10 @@ def _release_lock_shared(lock_id, proc):
 def _any_locks_alive():
     return any([len(v)>0 for v in six.itervalues(_lock_queues)])
 
+def lock_in_use(lock_id):
+    """Return True if any process holds, or is waiting for, the named lock. Only meaningful on the server process."""
+    return len(_get_lock_queue(lock_id))>0
+
 
 class ExclusiveLock(object):
     """Named, exclusive, re-entrant lock - only one MPI process can hold a lock of a given name at once"""
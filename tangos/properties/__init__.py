@@ -41,6 +41,10 @@ class PropertyCalculation(six.with_metaclass(PropertyCalculationMetaClass,object
     # Specifies a tuple of names of properties that will be calculated by this class.
     names = None
 
+    # Specifies the codec used to store array results ('none' or 'zlib'). If None, config.default_array_compression
+    # is used.
+    array_compression = None
+
     @classmethod
     def all_classes(cls):
         return cls._all_classes
@@ -146,6 +150,45 @@ class PropertyCalculation(six.with_metaclass(PropertyCalculationMetaClass,object
         else:
             return values[self.names.index(name)]
 
+    def live_calculate_batch(self, halo_entries, *input_arrays):
+        """Calculate the result of a function for many halos at once, using the existing data in the database alone
+
+        Implementing this method is optional. If a class implements it, the live-calculation framework calls it
+        in preference to calling live_calculate for each halo in turn, which avoids a large per-halo overhead for
+        cheap calculations. The results must be the same as those from live_calculate.
+
+        :param halo_entries: The database objects associated with the halos
+        :type halo_entries: list of tangos.core.halo.Halo
+
+        :param input_arrays: For each input to the function, a sequence of values (one per halo). Halos for which
+                             any input is None are never passed.
+        :return: For each name in self.names, a sequence of values (one per halo)
+        """
+        raise NotImplementedError
+
+    def live_calculate_batch_named(self, name, halo_entries, *input_arrays):
+        """Calculate the result of a function for many halos at once, returning only the named value.
+
+        See live_calculate_batch and live_calculate_named for more information."""
+        values = self.live_calculate_batch(halo_entries, *input_arrays)
+        names = self.names
+        if isinstance(names, six.string_types):
+            return values
+        else:
+            return values[self.names.index(name)]
+
+    def has_live_calculate_batch(self):
+        """Return True if live_calculate_batch is implemented, and is not overridden by a per-halo live_calculate
+        in a subclass (in which case the two might not agree)"""
+        return type(self).live_calculate_batch is not PropertyCalculation.live_calculate_batch and \
+               _defined_at_least_as_specifically(type(self), 'live_calculate_batch', 'live_calculate')
+
+    @classmethod
+    def has_reassemble_many(cls):
+        """Return True if reassemble_many is implemented, and is not overridden by a per-property reassemble in a
+        subclass (in which case the two might not agree)"""
+        return _defined_at_least_as_specifically(cls, 'reassemble_many', 'reassemble')
+
     def calculate_from_db(self, db):
         if self.requires_particle_data:
             region_spec =  self.region_specification(self)
@@ -199,6 +242,37 @@ class PropertyCalculation(six.with_metaclass(PropertyCalculationMetaClass,object
         else:
             return property_array[i0] * i0_weight + property_array[i1] * i1_weight
 
+    def get_interpolated_values(self, at_x_positions, property_arrays):
+        """Return the value of the property at each of the given x positions, for the corresponding array
+
+        The results are the same as calling get_interpolated_value for each pair in turn, but are obtained in a
+        vectorised manner where possible."""
+        at_x_positions = np.asarray(at_x_positions, dtype=float)
+        if not _defined_at_least_as_specifically(type(self), 'get_interpolated_values', 'get_interpolated_value') \
+                or not np.all(np.isfinite(at_x_positions)) \
+                or not all(np.ndim(a) == 1 and len(a) > 0 for a in property_arrays):
+            return [self.get_interpolated_value(x, a) for x, a in zip(at_x_positions, property_arrays)]
+
+        x0 = self.plot_x0()
+        delta_x = self.plot_xdelta()
+
+        i0 = ((at_x_positions - x0) / delta_x).astype(int)
+        i1 = i0 + 1
+        i1_weight = (at_x_positions - (i0 * delta_x + x0)) / delta_x
+        i0_weight = 1.0 - i1_weight
+
+        lengths = np.array([len(a) for a in property_arrays])
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        valid = (i1 < lengths) & (i0 >= 0)
+        all_values = np.concatenate(property_arrays)
+
+        results = [None]*len(at_x_positions)
+        interpolated = all_values[offsets[valid] + i0[valid]] * i0_weight[valid] + \
+                       all_values[offsets[valid] + i1[valid]] * i1_weight[valid]
+        for i, value in zip(np.nonzero(valid)[0], interpolated):
+            results[i] = value
+        return results
+
     def plot_xlabel(self):
         return None
 
@@ -219,6 +293,19 @@ class PropertyCalculation(six.with_metaclass(PropertyCalculationMetaClass,object
 
 HaloProperties = PropertyCalculation # old name, to be deprecated
 
+
+def _defined_at_least_as_specifically(cls, method_name, than_method_name):
+    """Return True if cls defines method_name, and does so in the same class as (or a subclass of the class)
+    defining than_method_name"""
+    def defining_class(name):
+        for c in cls.__mro__:
+            if name in vars(c):
+                return c
+
+    method_class = defining_class(method_name)
+    than_class = defining_class(than_method_name)
+    return method_class is not None and (than_class is None or issubclass(method_class, than_class))
+
 class TimeChunkedProperty(PropertyCalculation):
     """TimeChunkedProperty implements a special type of halo property where chunks of a histogram are stored
     at each time step, then appropriately reassembled when the histogram is retrieved.
@@ -279,6 +366,20 @@ class TimeChunkedProperty(PropertyCalculation):
         else:
             raise ValueError("Unknown reassembly type")
 
+    def reassemble_many(self, properties, reassembly_type='major'):
+        """Reassemble the histograms for a list of halo properties, returning a list of results.
+
+        The results are the same as calling TimeChunkedProperty.reassemble on each property in turn, but for the
+        'major' reassembly type the major progenitor branches of all the halos are found together and every stored
+        chunk is retrieved in a single query. This is called by the framework when a property is requested for
+        many halos at once (e.g. by TimeStep.calculate_all). A subclass that modifies the output of reassemble
+        should modify the output of reassemble_many in the same way."""
+
+        if reassembly_type=='major' and len(properties)>0:
+            return self._reassemble_many_along_major_branches(properties)
+        else:
+            return [TimeChunkedProperty.reassemble(self, p, reassembly_type) for p in properties]
+
     def _place_data(self, time, raw_data):
         final = np.zeros(self.bin_index(time))
         end = len(final)
@@ -291,8 +392,13 @@ class TimeChunkedProperty(PropertyCalculation):
         halo = property.halo
         t, stack = halo.calculate_for_descendants("t()", "raw(" + name + ")", strategy=strategy, strategy_kwargs=strategy_kwargs)
         final = np.zeros(self.bin_index(t[0]))
+        self._combine_chunks(final, t, stack)
+        return final
+
+    def _combine_chunks(self, final, times, chunks):
+        """Write the histogram chunks, stored at the given times (in descending order), into the array final"""
         previous_time = -1
-        for t_i, hist_i in zip(t, stack):
+        for t_i, hist_i in zip(times, chunks):
             end = self.bin_index(t_i)
             start = end - len(hist_i)
             valid = hist_i == hist_i
@@ -303,7 +409,43 @@ class TimeChunkedProperty(PropertyCalculation):
                 # same timestep, multiple halos; accumulate
                 final[start:end][valid] += hist_i[valid]
             previous_time = t_i
-        return final
+
+    def _reassemble_many_along_major_branches(self, properties):
+        from sqlalchemy.orm import undefer_group
+        from .. import config, core, temporary_halolist
+        from ..relation_finding import branches
+
+        session = core.Session.object_session(properties[0]) or core.get_default_session()
+        start_ids = [p.halo_id for p in properties]
+        chains = branches.follow_chains(session, core.branches.MAJOR_PROGENITOR, start_ids,
+                                        config.num_history_steps_max_default)
+        halo_ids_along_chains = [[start_id] + [halo_id for halo_id, _ in chain]
+                                 for start_id, chain in zip(start_ids, chains)]
+
+        chunks = {}
+        HaloProperty = core.halo_data.HaloProperty
+        all_halo_ids = set(h for ids in halo_ids_along_chains for h in ids)
+        with temporary_halolist.temporary_halolist_table(session, all_halo_ids) as table:
+            rows = session.query(HaloProperty, core.timestep.TimeStep.time_gyr).select_from(table).\
+                join(HaloProperty, HaloProperty.halo_id == table.c.halo_id).\
+                join(core.halo.Halo, HaloProperty.halo_id == core.halo.Halo.id).\
+                join(core.timestep.TimeStep, core.halo.Halo.timestep_id == core.timestep.TimeStep.id).\
+                filter(HaloProperty.name_id.in_(set(p.name_id for p in properties))).\
+                options(undefer_group("data")).order_by(HaloProperty.id).all()
+            for property, time in rows:
+                # as for the raw() live-calculation function, the first property stored for each halo is used
+                chunks.setdefault((property.halo_id, property.name_id), (time, property.data_raw))
+
+        times_and_chunks = [[chunks[(i, p.name_id)] for i in ids if (i, p.name_id) in chunks]
+                            for p, ids in zip(properties, halo_ids_along_chains)]
+
+        lengths = [self.bin_index(found[0][0]) for found in times_and_chunks]
+        final = np.zeros((len(properties), max(lengths)))
+        results = []
+        for row, length, found in zip(final, lengths, times_and_chunks):
+            self._combine_chunks(row[:length], [t for t, _ in found], [c for _, c in found])
+            results.append(row[:length])
+        return results
 
 
     def plot_xdelta(self):
@@ -421,6 +563,21 @@ def all_providing_classes(property_name):
     return candidates
 
 
+def array_compression(property_name):
+    """Return the codec with which arrays for the named property should be stored"""
+    from .. import config
+    return _class_array_compression(property_name) or config.default_array_compression
+
+@util.lru_cache()
+def _class_array_compression(property_name):
+    candidates = list(all_providing_classes(property_name))
+    _sort_by_class_hierarchy(candidates)
+    for c in candidates:
+        if c.array_compression is not None:
+            return c.array_compression
+    return None
+
+
 def _sort_by_class_hierarchy(candidates):
     def cmp(a, b):
         if a is b:
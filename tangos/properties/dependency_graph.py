@@ -0,0 +1,94 @@
+"""Ordering of property calculations according to the properties they require.
+
+Used by tangos write to decide which order to run calculations in for each halo, and to add any missing
+prerequisites when --with-prerequisites is specified."""
+
+from __future__ import absolute_import
+import six
+
+
+class CircularDependencyError(ValueError):
+    pass
+
+
+def _provided_names(calculator):
+    if isinstance(calculator.names, six.string_types):
+        return [calculator.names]
+    else:
+        return list(calculator.names)
+
+def _particle_group(calculator):
+    """Return a key which is shared by calculations that are likely to need the same particle data for a halo"""
+    for cls in type(calculator).__mro__:
+        if 'region_specification' in vars(cls):
+            return calculator.requires_particle_data, cls
+
+def _dependencies(calculators):
+    """Return, for each calculator, the set of indices of the other calculators providing properties it requires"""
+    provider = {}
+    for i, calculator in enumerate(calculators):
+        for name in _provided_names(calculator):
+            provider.setdefault(name, i)
+
+    dependencies = []
+    for i, calculator in enumerate(calculators):
+        dependencies.append(set(provider[name] for name in calculator.requires_property()
+                                if name in provider and provider[name]!=i))
+    return dependencies
+
+def _find_cycle(dependencies, among):
+    """Return a list of indices forming a dependency cycle, starting and ending with the same index"""
+    path = [min(among)]
+    while True:
+        next_index = min(d for d in dependencies[path[-1]] if d in among)
+        if next_index in path:
+            return path[path.index(next_index):]+[next_index]
+        path.append(next_index)
+
+def add_prerequisites(simulation, calculators):
+    """Return the calculators together with instances of the classes that provide any properties they require
+    which are not already provided, recursively."""
+    from . import instantiate_class
+    calculators = list(calculators)
+    provided = set(name for calculator in calculators for name in _provided_names(calculator))
+    i = 0
+    while i<len(calculators):
+        for requirement in calculators[i].requires_property():
+            if requirement not in provided:
+                new_calculator = instantiate_class(simulation, requirement)
+                calculators.append(new_calculator)
+                provided.update(_provided_names(new_calculator))
+        i+=1
+    return calculators
+
+def calculation_order(calculators):
+    """Return the calculators ordered so that each comes after any providing the properties it requires.
+
+    Subject to that, the original order is kept as far as possible, except that calculations likely to share
+    particle data (those with the same region_specification and particle requirements) are placed together where
+    possible, so that the data can be reused between them.
+
+    :raises CircularDependencyError: if the calculators require each other's properties in a loop"""
+    dependencies = _dependencies(calculators)
+    groups = [_particle_group(c) for c in calculators]
+    remaining = set(range(len(calculators)))
+    order = []
+    last_group = None
+    while len(remaining)>0:
+        ready = sorted(i for i in remaining if not (dependencies[i] & remaining))
+        if len(ready)==0:
+            cycle = _find_cycle(dependencies, remaining)
+            raise CircularDependencyError("Property calculations have circular dependencies: " +
+                                          " requires ".join(repr(calculators[i].names) for i in cycle))
+        # stay in the current group if possible; otherwise, first run anything holding up another group
+        same_group = [i for i in ready if len(order)>0 and groups[i]==last_group]
+        needed_by_other_group = [i for i in ready
+                                 if any(i in dependencies[j] and groups[j]!=groups[i] for j in remaining)]
+        if len(same_group)>0:
+            ready = same_group
+        elif len(needed_by_other_group)>0:
+            ready = needed_by_other_group
+        order.append(calculators[ready[0]])
+        remaining.remove(ready[0])
+        last_group = groups[ready[0]]
+    return order
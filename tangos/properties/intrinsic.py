@@ -4,7 +4,37 @@ from . import LivePropertyCalculation
 class IntrinsicProperties(LivePropertyCalculation):
     names = "t","z","a","dbid", "halo_number", "finder_id", "NDM", "NStar", "NGas", "type", "step_path", "path"
 
+    _timestep_values = {"t": lambda ts: ts.time_gyr,
+                        "z": lambda ts: ts.redshift,
+                        "a": lambda ts: 1./(1.+ts.redshift),
+                        "step_path": lambda ts: str(ts.path)}
+
+    _halo_values = {"dbid": lambda halo: halo.id,
+                    "halo_number": lambda halo: halo.halo_number,
+                    "finder_id": lambda halo: halo.finder_id,
+                    "NDM": lambda halo: halo.NDM,
+                    "NStar": lambda halo: halo.NStar,
+                    "NGas": lambda halo: halo.NGas,
+                    "type": lambda halo: halo.object_typecode,
+                    "path": lambda halo: str(halo.path)}
+
     def live_calculate(self, halo):
         ts = halo.timestep
         return ts.time_gyr, ts.redshift, 1./(1.+ts.redshift), halo.id, halo.halo_number, halo.finder_id, \
-               halo.NDM, halo.NStar, halo.NGas, halo.object_typecode, str(halo.timestep.path), str(halo.path)
\ No newline at end of file
+               halo.NDM, halo.NStar, halo.NGas, halo.object_typecode, str(halo.timestep.path), str(halo.path)
+
+    def live_calculate_batch(self, halos):
+        return tuple(self.live_calculate_batch_named(name, halos) for name in self.names)
+
+    def live_calculate_batch_named(self, name, halos):
+        if name in self._timestep_values:
+            # evaluate once per timestep, rather than once per halo
+            timestep_value = self._timestep_values[name]
+            values_by_timestep_id = {}
+            for halo in halos:
+                if halo.timestep_id not in values_by_timestep_id:
+                    values_by_timestep_id[halo.timestep_id] = timestep_value(halo.timestep)
+            return [values_by_timestep_id[halo.timestep_id] for halo in halos]
+        else:
+            halo_value = self._halo_values[name]
+            return [halo_value(halo) for halo in halos]
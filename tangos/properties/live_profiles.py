@@ -13,6 +13,9 @@ class AtPosition(LivePropertyCalculation):
     def live_calculate(self, halo, pos, ar):
         return self._array_info.get_interpolated_value(pos, ar)
 
+    def live_calculate_batch(self, halos, pos, ar):
+        return self._array_info.get_interpolated_values(pos, ar)
+
 
 
 class MaxMinProperty(LivePropertyCalculation):
@@ -27,3 +30,27 @@ class MaxMinProperty(LivePropertyCalculation):
         amax, amin = np.argmax(array), np.argmin(array)
         index_to_r = lambda index: index*self._array_info.plot_xdelta()+self._array_info.plot_x0()
         return float(max_), float(min_), index_to_r(amax), index_to_r(amin)
+
+    def live_calculate_batch(self, halos, arrays):
+        results = [[None]*len(arrays) for _ in self.names]
+
+        # arrays of the same length are stacked, so that each group is processed in a single operation
+        indices_by_length = {}
+        for i, array in enumerate(arrays):
+            if np.ndim(array) == 1 and len(array) > 0:
+                indices_by_length.setdefault(len(array), []).append(i)
+            else:
+                for result, value in zip(results, self.live_calculate(halos[i], array)):
+                    result[i] = value
+
+        for indices in indices_by_length.values():
+            stacked = np.array([arrays[i] for i in indices])
+            max_, min_ = np.max(stacked, axis=1), np.min(stacked, axis=1)
+            amax, amin = np.argmax(stacked, axis=1), np.argmin(stacked, axis=1)
+            index_to_r = lambda index: index*self._array_info.plot_xdelta()+self._array_info.plot_x0()
+            values = max_.astype(float), min_.astype(float), index_to_r(amax), index_to_r(amin)
+            for result, group_values in zip(results, values):
+                for i, value in zip(indices, group_values.tolist()):
+                    result[i] = value
+
+        return tuple(results)
@@ -37,6 +37,10 @@ class StarFormHistogram(TimeChunkedProperty):
         reassembled = super(StarFormHistogram, self).reassemble(*options)
         return reassembled/1e9 # Msol per Gyr -> Msol per yr
 
+    def reassemble_many(self, *options):
+        reassembled = super(StarFormHistogram, self).reassemble_many(*options)
+        return [r/1e9 for r in reassembled]
+
 class StarForm(PynbodyPropertyCalculation):
     names = "SFR_10Myr", "SFR_100Myr"
     
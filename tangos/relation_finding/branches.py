@@ -0,0 +1,151 @@
+"""Construction of the materialised branches described in core.branches.
+
+The onward hop from every halo is chosen in memory using the simulation's LinkGraph. The resulting forest is then
+split into branches: each halo continues the branch of its strongest predecessor (the halo hopping to it with the
+highest weight), and halos with no predecessor start a new branch. Only rows that have changed since the last
+build are written, so that rebuilding after new timesteps have been linked is cheap.
+"""
+
+from __future__ import absolute_import
+import numpy as np
+from sqlalchemy import and_, bindparam
+
+from .. import core, temporary_halolist
+from ..core import branches
+from ..log import logger
+from . import link_graph
+
+_HOP_RULES = {branches.MAJOR_PROGENITOR: dict(backwards=True, min_reverse_weight=0.1, nearest_in_time=True),
+              branches.MAJOR_DESCENDANT: dict(backwards=False, min_reverse_weight=None, nearest_in_time=True),
+              branches.STRONGEST_PROGENITOR: dict(backwards=True, min_reverse_weight=None, nearest_in_time=False),
+              branches.STRONGEST_DESCENDANT: dict(backwards=False, min_reverse_weight=None, nearest_in_time=False)}
+
+
+def _split_into_branches(next_index, next_weight):
+    """Return the index of the starting halo and the position along the branch for each halo"""
+    n = len(next_index)
+    has_next = np.nonzero(next_index >= 0)[0]
+    predecessors = has_next[np.lexsort((has_next, -next_weight[has_next], next_index[has_next]))]
+    targets = next_index[predecessors]
+    first_for_each_target = np.concatenate(([True], targets[1:] != targets[:-1]))[:len(targets)]
+    strongest_predecessor = np.full(n, -1, dtype=np.int64)
+    strongest_predecessor[targets[first_for_each_target]] = predecessors[first_for_each_target]
+
+    branch_start = np.full(n, -1, dtype=np.int64)
+    position = np.zeros(n, dtype=np.int64)
+    for start in np.nonzero(strongest_predecessor < 0)[0]:
+        i, p = start, 0
+        while True:
+            branch_start[i] = start
+            position[i] = p
+            following = next_index[i]
+            if following < 0 or strongest_predecessor[following] != i:
+                break
+            i, p = following, p+1
+    return branch_start, position
+
+
+def _rows_for_kind(graph, halo_times, kind):
+    next_index, next_weight = graph.best_hops(halo_times, **_HOP_RULES[kind])
+    branch_start, position = _split_into_branches(next_index, next_weight)
+    rows = {}
+    for i in range(len(graph.halo_ids)):
+        has_next = next_index[i] >= 0
+        rows[int(graph.halo_ids[i])] = (int(graph.halo_ids[branch_start[i]]), int(position[i]),
+                                        int(graph.halo_ids[next_index[i]]) if has_next else None,
+                                        float(next_weight[i]) if has_next else None)
+    return rows
+
+
+def build_branches(session, simulation):
+    """Build or update the branches of every kind for the given simulation, then commit"""
+    state = branches.database_state(session, simulation.id)
+    graph = link_graph.get_link_graph(session, simulation.id)
+    halo_times = graph.halo_times(session)
+    HaloBranch = branches.HaloBranch
+    table = HaloBranch.__table__
+
+    num_changed = 0
+    for kind in branches.ALL_KINDS:
+        new_rows = _rows_for_kind(graph, halo_times, kind)
+        existing_rows = {r[0]: tuple(r[1:]) for r in
+                         session.query(HaloBranch.halo_id, HaloBranch.branch_id, HaloBranch.position,
+                                       HaloBranch.next_id, HaloBranch.next_weight).
+                             join(core.halo.Halo, HaloBranch.halo_id == core.halo.Halo.id).
+                             join(core.timestep.TimeStep, core.halo.Halo.timestep_id == core.timestep.TimeStep.id).
+                             filter(core.timestep.TimeStep.simulation_id == simulation.id,
+                                    HaloBranch.kind == kind).all()}
+
+        inserts = []
+        updates = []
+        for halo_id, (branch_id, position, next_id, next_weight) in new_rows.items():
+            values = {'branch_id': branch_id, 'position': position, 'next_id': next_id, 'next_weight': next_weight}
+            if halo_id not in existing_rows:
+                values.update(halo_id=halo_id, kind=kind)
+                inserts.append(values)
+            elif existing_rows[halo_id] != (branch_id, position, next_id, next_weight):
+                updates.append({'b_'+k: v for k, v in values.items()})
+                updates[-1].update(b_halo_id=halo_id, b_kind=kind)
+
+        if len(inserts) > 0:
+            session.execute(table.insert(), inserts)
+        if len(updates) > 0:
+            session.execute(table.update().
+                            where(and_(table.c.halo_id == bindparam('b_halo_id'), table.c.kind == bindparam('b_kind'))).
+                            values(branch_id=bindparam('b_branch_id'), position=bindparam('b_position'),
+                                   next_id=bindparam('b_next_id'), next_weight=bindparam('b_next_weight')),
+                            updates)
+        num_changed += len(inserts)+len(updates)
+
+    build = session.query(branches.BranchBuild).filter_by(simulation_id=simulation.id).first()
+    if build is None:
+        build = branches.BranchBuild(simulation.id)
+        session.add(build)
+    build.max_link_id, build.max_halo_id = state
+    session.commit()
+
+    logger.info("Updated branches for %r (%d rows changed)", simulation, num_changed)
+
+
+def update_stale_branches(session):
+    """Rebuild the branches of any simulation that has them, if halos or links have since been added to it"""
+    for build in session.query(branches.BranchBuild).all():
+        if not branches.unchanged_since(session, build.simulation_id, (build.max_link_id, build.max_halo_id)):
+            build_branches(session, build.simulation)
+
+
+def _follow_link_graph(session, simulation_id, kind, halo_ids, nhops_max):
+    graph = link_graph.get_link_graph(session, simulation_id)
+    next_index, next_weight = graph.best_hops(graph.halo_times(session), **_HOP_RULES[kind])
+    chains = []
+    for i in graph.index_of(halo_ids):
+        chain = []
+        i = next_index[i]
+        while i >= 0 and len(chain) < nhops_max:
+            chain.append((int(graph.halo_ids[i]), float(next_weight[i])))
+            i = next_index[i]
+        chains.append(chain)
+    return chains
+
+def follow_chains(session, kind, halo_ids, nhops_max):
+    """Return the chain starting from each of the given halos, for the given kind of branch (see core.branches).
+
+    The return value is in the same format as core.branches.follow_branches. The materialised branches are used if
+    they are current; otherwise the hops are chosen in memory from the LinkGraph of each simulation. Either way, all
+    chains are found together, which is much faster than running a strategy for each halo."""
+    with temporary_halolist.temporary_halolist_table(session, set(halo_ids)) as table:
+        simulation_of_halo = dict(temporary_halolist.halo_query(table).
+                                  join(core.timestep.TimeStep,
+                                       core.halo.Halo.timestep_id == core.timestep.TimeStep.id).
+                                  with_entities(core.halo.Halo.id, core.timestep.TimeStep.simulation_id).all())
+    chains = [[] for _ in halo_ids]
+    for simulation_id in set(simulation_of_halo.values()):
+        offsets = [i for i, h in enumerate(halo_ids) if simulation_of_halo.get(h) == simulation_id]
+        ids_in_simulation = [halo_ids[i] for i in offsets]
+        if branches.branches_are_current(session, [simulation_id]):
+            found = branches.follow_branches(session, kind, ids_in_simulation, nhops_max)
+        else:
+            found = _follow_link_graph(session, simulation_id, kind, ids_in_simulation, nhops_max)
+        for i, chain in zip(offsets, found):
+            chains[i] = chain
+    return chains
@@ -0,0 +1,173 @@
+"""In-memory representation of all HaloLinks from one simulation, used to accelerate MultiHopStrategy.
+
+The links are stored in compressed sparse row (CSR) form, keyed on the index of the source halo within the
+simulation, alongside the time, halo number and timestep of every halo in the simulation. A multi-hop search can
+then be performed as a sequence of vectorised frontier expansions, without issuing SQL for each hop.
+
+The most recently used graphs are cached, and rebuilt automatically whenever halos or links are added. See
+MultiHopStrategy (engine='link_graph') for the user-facing interface.
+"""
+
+from __future__ import absolute_import
+import collections
+
+import numpy as np
+
+from .. import core
+from ..config import max_relative_time_difference as SMALL_FRACTION
+
+
+class HopCandidates(object):
+    """A set of candidate hops, stored as parallel arrays.
+
+    from_index and to_index are indices into the halo arrays of the LinkGraph; weight is the aggregated weight
+    along the route."""
+
+    def __init__(self, from_index, to_index, weight):
+        self.from_index = from_index
+        self.to_index = to_index
+        self.weight = weight
+
+    def __len__(self):
+        return len(self.to_index)
+
+    def take(self, selection):
+        return HopCandidates(self.from_index[selection], self.to_index[selection], self.weight[selection])
+
+
+class LinkGraph(object):
+    def __init__(self, session, simulation_id):
+        self.simulation_id = simulation_id
+        halo_rows = session.query(core.halo.Halo.id, core.halo.Halo.halo_number, core.halo.Halo.timestep_id).\
+            join(core.timestep.TimeStep, core.halo.Halo.timestep_id == core.timestep.TimeStep.id).\
+            filter(core.timestep.TimeStep.simulation_id == simulation_id).order_by(core.halo.Halo.id).all()
+
+        self.halo_ids = np.array([r[0] for r in halo_rows], dtype=np.int64)
+        self.halo_number = np.array([r[1] for r in halo_rows], dtype=np.int64)
+        self.timestep_id = np.array([r[2] for r in halo_rows], dtype=np.int64)
+
+        HaloLink = core.halo_data.HaloLink
+        link_rows = session.query(HaloLink.halo_from_id, HaloLink.halo_to_id, HaloLink.weight).\
+            join(core.halo.Halo, HaloLink.halo_from_id == core.halo.Halo.id).\
+            join(core.timestep.TimeStep, core.halo.Halo.timestep_id == core.timestep.TimeStep.id).\
+            filter(core.timestep.TimeStep.simulation_id == simulation_id).order_by(HaloLink.id).all()
+
+        link_from = self.index_of([r[0] for r in link_rows])
+        link_to = self.index_of([r[1] for r in link_rows])
+        link_weight = np.array([r[2] if r[2] is not None else np.nan for r in link_rows], dtype=np.float64)
+
+        # links to halos in other simulations are retained (with index -1) so that reverse-link counts are exact
+        order = np.argsort(link_from, kind='stable')
+        self.link_to = link_to[order]
+        self.link_weight = link_weight[order]
+        self.indptr = np.concatenate(([0], np.cumsum(np.bincount(link_from, minlength=len(self.halo_ids)))))
+        self._link_keys_cache = {}
+
+    def index_of(self, halo_ids):
+        """Return the indices of the given halo ids within this graph, or -1 for halos not in the simulation"""
+        halo_ids = np.asarray(halo_ids, dtype=np.int64)
+        if len(self.halo_ids)==0:
+            return np.full(len(halo_ids), -1, dtype=np.int64)
+        index = np.searchsorted(self.halo_ids, halo_ids)
+        index[index==len(self.halo_ids)] = 0
+        index[self.halo_ids[index]!=halo_ids] = -1
+        return index
+
+    def halo_times(self, session):
+        """Return the time (in Gyr) of every halo in the graph. Times are always fetched from the database since
+        they are cheap to obtain and may be edited without changing any links."""
+        time_of_timestep = dict(session.query(core.timestep.TimeStep.id, core.timestep.TimeStep.time_gyr).
+                                filter(core.timestep.TimeStep.simulation_id == self.simulation_id).all())
+        return np.array([time_of_timestep[t] for t in self.timestep_id], dtype=np.float64)
+
+    def expand(self, from_index, weight, min_onehop_weight):
+        """Return all links from the given halos to other halos in the simulation, as HopCandidates.
+
+        The returned weights are the products of the given route weights and the link weights. Links with weight
+        not exceeding min_onehop_weight are omitted. Candidates are ordered by position in from_index, then by
+        the order in which links were created."""
+        counts = self.indptr[from_index+1]-self.indptr[from_index]
+        total = counts.sum()
+        source_position = np.repeat(np.arange(len(from_index)), counts)
+        offset_within_source = np.arange(total) - np.repeat(np.cumsum(counts)-counts, counts)
+        link_index = self.indptr[from_index][source_position] + offset_within_source
+
+        keep = (self.link_weight[link_index] > min_onehop_weight) & (self.link_to[link_index]>=0)
+        source_position = source_position[keep]
+        link_index = link_index[keep]
+
+        return HopCandidates(from_index[source_position], self.link_to[link_index],
+                             weight[source_position]*self.link_weight[link_index])
+
+    def _link_keys(self, min_weight):
+        """Return sorted keys identifying the (from, to) pairs of every link with weight exceeding min_weight"""
+        if min_weight not in self._link_keys_cache:
+            n = len(self.halo_ids)
+            link_from = np.repeat(np.arange(n), np.diff(self.indptr))
+            mask = (self.link_to >= 0) & (self.link_weight > min_weight)
+            self._link_keys_cache[min_weight] = np.sort(link_from[mask]*n + self.link_to[mask])
+        return self._link_keys_cache[min_weight]
+
+    def count_reverse_links(self, hops, min_weight):
+        """For each hop, count the links pointing back from its destination to its origin with weight exceeding
+        min_weight"""
+        keys = self._link_keys(min_weight)
+        reverse_keys = hops.to_index*len(self.halo_ids) + hops.from_index
+        return np.searchsorted(keys, reverse_keys, 'right') - np.searchsorted(keys, reverse_keys, 'left')
+
+    def best_hops(self, halo_times, backwards, min_reverse_weight=None, nearest_in_time=True):
+        """Choose a single onward hop from every halo in the graph, returning the destination index (or -1) and
+        the weight of the hop for each halo.
+
+        Only hops backwards (or forwards) in time, with positive weight and, if min_reverse_weight is not None, a
+        reverse link of weight exceeding min_reverse_weight are considered. If nearest_in_time is True, the hop
+        reaching the time closest to the source halo is preferred, then the highest weight; otherwise only the
+        weight is considered. Remaining ties are broken by choosing the lowest halo number."""
+        n = len(self.halo_ids)
+        hops = self.expand(np.arange(n), np.ones(n), 0.0)
+
+        time_old = halo_times[hops.from_index]
+        time_new = halo_times[hops.to_index]
+        if backwards:
+            hops = hops.take(time_new < time_old*(1.0-SMALL_FRACTION))
+        else:
+            hops = hops.take(time_new > time_old*(1.0+SMALL_FRACTION))
+
+        if min_reverse_weight is not None:
+            hops = hops.take(self.count_reverse_links(hops, min_reverse_weight) > 0)
+
+        sort_keys = [self.halo_number[hops.to_index], -hops.weight]
+        if nearest_in_time:
+            time_new = halo_times[hops.to_index]
+            sort_keys.append(-time_new if backwards else time_new)
+        sort_keys.append(hops.from_index)
+        hops = hops.take(np.lexsort(sort_keys))
+        first_from_each = np.concatenate(([True], hops.from_index[1:] != hops.from_index[:-1]))[:len(hops)]
+        hops = hops.take(first_from_each)
+
+        next_index = np.full(n, -1, dtype=np.int64)
+        next_weight = np.full(n, np.nan)
+        next_index[hops.from_index] = hops.to_index
+        next_weight[hops.from_index] = hops.weight
+        return next_index, next_weight
+
+
+_MAX_CACHED_GRAPHS = 2
+
+_graphs = collections.OrderedDict() # (database url, simulation id) -> (database state, graph), least recent first
+
+def get_link_graph(session, simulation_id):
+    """Return the LinkGraph for the given simulation, building it if it is not cached or is out of date.
+
+    As for materialised branches (see core.branches.database_state), a graph is out of date once a halo has been
+    added to the simulation or a link added between its timesteps; links that are deleted or modified in place are
+    not detected. Only the most recently used graphs are kept."""
+    key = (str(session.get_bind().url), simulation_id)
+    state, graph = _graphs.pop(key, (None, None))
+    if state is None or not core.branches.unchanged_since(session, simulation_id, state):
+        state = core.branches.database_state(session, simulation_id)
+        graph = LinkGraph(session, simulation_id)
+    _graphs[key] = (state, graph)
+    while len(_graphs) > _MAX_CACHED_GRAPHS:
+        _graphs.popitem(last=False)
+    return graph
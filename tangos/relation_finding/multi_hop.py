@@ -4,6 +4,7 @@ import random
 import string
 import sys
 
+import numpy as np
 import sqlalchemy
 import sqlalchemy.exc
 import sqlalchemy.orm
@@ -15,11 +16,32 @@ from sqlalchemy.orm import relationship
 from .. import core
 from .. import temporary_halolist
 from .one_hop import HopStrategy
+from . import link_graph
 
 from ..config import num_multihops_max_default as NHOPS_MAX_DEFAULT
 from ..config import max_relative_time_difference as SMALL_FRACTION
+from .. import config
 from six.moves import range
 
+def _dialect_supports_recursive_cte(dialect):
+    if dialect.name == 'sqlite':
+        return dialect.dbapi.sqlite_version_info >= (3, 8, 3)
+    return dialect.name == 'postgresql'
+
+
+class _RouteCandidateColumns(object):
+    """Stands in for a table of candidate links (see _supplement_halolink_query_with_filter), so that the link filters
+    can be applied to the recursive part of a WITH RECURSIVE query"""
+    def __init__(self, halo_from_id, halo_to_id, weight):
+        self.halo_from_id = halo_from_id
+        self.halo_to_id = halo_to_id
+        self.weight = weight
+
+    @property
+    def c(self):
+        return self
+
+
 class MultiHopStrategy(HopStrategy):
     """An extension of the HopStrategy class that takes multiple hops across
     HaloLinks, up to a specified maximum, before finding the target halo."""
@@ -32,7 +54,7 @@ class MultiHopStrategy(HopStrategy):
     def __init__(self, halo_from, nhops_max=NHOPS_MAX_DEFAULT, directed=None, target=None,
                  order_by=None, combine_routes=True, min_aggregated_weight=0.0,
                  min_onehop_weight=0.0, min_onehop_reverse_weight=None,
-                 include_startpoint=False, one_simulation=None):
+                 include_startpoint=False, one_simulation=None, engine=None):
         """Construct a strategy for finding Halos via multiple "hops" along HaloLinks
 
         :param halo_from:   The halo to start hopping from
@@ -76,6 +98,19 @@ class MultiHopStrategy(HopStrategy):
                                           is no reverse link at all, the result will be dropped.
 
         :param include_startpoint:    Return the starting halo in the results (default False)
+
+        :param engine:    The method used to take hops, which can be
+              'sql'         - take all hops in a single recursive query (WITH RECURSIVE) if the database supports
+                              it and the search can be expressed that way; otherwise as for 'temp_tables'.
+                              The recursive query is only used if combine_routes is False or the search picks a
+                              single best link per hop (e.g. MultiHopMajorProgenitorsStrategy); the default
+                              combined-route search (e.g. MultiHopAllProgenitorsStrategy) is not accelerated.
+              'temp_tables' - issue SQL queries for every hop, staging the results in temporary tables
+              'link_graph'  - load all links in the simulation into memory (see link_graph module) and take hops
+                              there, writing only the final results back to the database. This is substantially
+                              faster for long searches, but is only available for searches that are directed
+                              'backwards' or 'forwards' within one simulation; other searches fall back to 'sql'.
+              None          - use config.default_multihop_engine
         """
         super(MultiHopStrategy, self).__init__(halo_from, target, order_by)
         self.nhops_max = nhops_max
@@ -89,6 +124,11 @@ class MultiHopStrategy(HopStrategy):
         self._one_simulation = one_simulation
         self._connection = self.session.connection()
         self._combine_routes = combine_routes
+        if engine is None:
+            engine = config.default_multihop_engine
+        if engine not in ('sql', 'temp_tables', 'link_graph'):
+            raise ValueError("Unknown multi-hop engine %r" % engine)
+        self._engine = engine
 
     def temp_table(self):
         """Execute the strategy and return results as a temp_table (see temporary_halolist module)"""
@@ -213,7 +253,8 @@ class MultiHopStrategy(HopStrategy):
         self._prelim_table = multi_hop_link_prelim_table
         self._table.create(checkfirst=True, bind=self._connection)
 
-        self._prelim_table.create(checkfirst=True, bind=self._connection)
+        if not self._can_use_recursive_cte():
+            self._prelim_table.create(checkfirst=True, bind=self._connection)
 
     @contextlib.contextmanager
     def _manage_temp_table(self):
@@ -228,6 +269,56 @@ class MultiHopStrategy(HopStrategy):
         self._connection.execute(insert_statement)
 
     def _make_hops(self):
+        if self._can_use_branches():
+            self._make_hops_from_branches()
+        elif self._can_use_link_graph():
+            self._make_hops_in_link_graph()
+        elif self._can_use_recursive_cte():
+            self._make_hops_with_recursive_cte()
+        else:
+            self._make_hops_with_temp_tables()
+
+    def _branch_kind(self):
+        """Return the kind of materialised branch (see core.branches) that this search walks along, or None if
+        the search does not correspond to one"""
+        return None
+
+    def _follows_branch_hop_rule(self, min_onehop_reverse_weight):
+        """Return True if the thresholds of this search are those used to build the materialised branches"""
+        return self._min_onehop_weight == 0 and self._min_aggregated_weight == 0 and \
+               self._min_onehop_reverse_weight == min_onehop_reverse_weight and self._one_simulation and \
+               type(self)._hopping_finished is MultiHopStrategy._hopping_finished
+
+    def _branch_seeds(self):
+        """Return (source_id, halo_id) for each halo from which the search starts"""
+        return [(None, self.halo_from.id)]
+
+    def _can_use_branches(self):
+        if self._branch_kind() is None:
+            return False
+        seed_halo_ids = set(halo_id for _, halo_id in self._branch_seeds())
+        simulation_ids = [s[0] for s in self.session.query(core.timestep.TimeStep.simulation_id).
+                          join(core.halo.Halo, core.halo.Halo.timestep_id == core.timestep.TimeStep.id).
+                          filter(core.halo.Halo.id.in_(seed_halo_ids)).distinct().all()]
+        return core.branches.branches_are_current(self.session, simulation_ids)
+
+    def _make_hops_from_branches(self):
+        seeds = self._branch_seeds()
+        chains = core.branches.follow_branches(self.session, self._branch_kind(),
+                                               [halo_id for _, halo_id in seeds], self.nhops_max)
+        rows = []
+        for (source_id, halo_id), chain in zip(seeds, chains):
+            halo_from_id, weight = halo_id, 1.0
+            for nhops, (halo_to_id, hop_weight) in enumerate(chain, 1):
+                weight *= hop_weight
+                rows.append({'halo_from_id': halo_from_id, 'halo_to_id': halo_to_id, 'weight': weight,
+                             'nhops': nhops, 'source_id': source_id})
+                halo_from_id = halo_to_id
+
+        if len(rows)>0:
+            self._connection.execute(self._table.insert(), rows)
+
+    def _make_hops_with_temp_tables(self):
         for i in range(0, self.nhops_max):
             generated_count = self._generate_next_level_prelim_links(i)
             if generated_count != 0:
@@ -239,6 +330,157 @@ class MultiHopStrategy(HopStrategy):
                 break
         self._nhops_taken = i
 
+    def _hop_sql_is_standard(self):
+        """Return True if subclasses customise each hop only through _supplement_halolink_query_with_filter"""
+        for method_name in ('_seed_temp_table', '_generate_next_level_prelim_links',
+                            '_filter_prelim_links_into_final', '_supplement_halolink_query_with_reverse_hop_filter'):
+            if getattr(type(self), method_name) is not getattr(MultiHopStrategy, method_name):
+                return False
+        return True
+
+    def _can_use_link_graph(self):
+        """Return True if the hops can be taken in memory with the same results as _make_hops_with_temp_tables.
+
+        This requires a directed search within one simulation, with the SQL for each hop unmodified by subclasses
+        except through _supplement_halolink_query_with_filter. Any subclass overriding that method must also
+        provide the in-memory equivalent, _select_link_graph_hops."""
+        if self._engine != 'link_graph' or self.directed is None:
+            return False
+        if self.directed.lower() not in ('backwards', 'forwards') or not self._one_simulation:
+            return False
+        if not self._hop_sql_is_standard():
+            return False
+        for cls in type(self).__mro__:
+            if '_supplement_halolink_query_with_filter' in cls.__dict__:
+                return '_select_link_graph_hops' in cls.__dict__
+
+    def _can_use_recursive_cte(self):
+        """Return True if the hops can be taken in one recursive query with the same results as
+        _make_hops_with_temp_tables.
+
+        A recursive query cannot aggregate over each hop, so this is only possible if routes are not combined or if
+        the link filter restricts each hop to a single best link (as for the major progenitor and descendant
+        strategies), in which case there is only ever one route. Combining the routes afterwards instead would mean
+        enumerating every route, which can grow exponentially where links cross between branches, so searches
+        combining routes otherwise take the per-hop loop. Searches that stop according to a custom
+        _hopping_finished, or that are directed 'across' (which refers back to the results so far), are
+        excluded.
+
+        The best link is chosen by a correlated subquery which (in SQLite) cannot refer to the route weight in its
+        ordering, so the link filter is instead applied to the weight of the individual link. This gives identical
+        results provided min_aggregated_weight is zero, since all route weights are then positive."""
+        if self._engine == 'temp_tables' or not _dialect_supports_recursive_cte(self._connection.dialect):
+            return False
+        if self.directed is not None and self.directed.lower() not in ('backwards', 'forwards'):
+            return False
+        if type(self)._hopping_finished is not MultiHopStrategy._hopping_finished or not self._hop_sql_is_standard():
+            return False
+        limit = self._link_filter_limit()
+        if limit is None:
+            return not self._combine_routes
+        else:
+            return limit==1 and self._min_aggregated_weight==0
+
+    def _link_filter_limit(self):
+        """Return the number of links per hop to which _supplement_halolink_query_with_filter restricts the
+        results, or None if there is no restriction"""
+        table = core.halo_data.HaloLink.__table__
+        return self._supplement_halolink_query_with_filter(self.session.query(table.c.id), table)._limit
+
+    def _make_hops_with_recursive_cte(self):
+        routes = self.session.query(self._table.c.halo_from_id, self._table.c.halo_to_id,
+                                    self._table.c.weight, self._table.c.nhops).cte("multihop_routes", recursive=True)
+        link = sqlalchemy.orm.aliased(core.halo_data.HaloLink)
+
+        if self._link_filter_limit() is None:
+            join_condition = link.halo_from_id == routes.c.halo_to_id
+        else:
+            # choose the single best link onwards from each route (there is only ever one route)
+            candidate_link = sqlalchemy.orm.aliased(core.halo_data.HaloLink)
+            best_link_query = self._supplement_recursive_query_with_filters(
+                self.session.query(candidate_link.id).filter(candidate_link.halo_from_id == routes.c.halo_to_id),
+                candidate_link, candidate_link.weight)
+            join_condition = link.id == best_link_query.as_scalar()
+
+        next_hop = self.session.query(link.halo_from_id, link.halo_to_id,
+                                      (routes.c.weight * link.weight).label("weight"),
+                                      (routes.c.nhops + sqlalchemy.literal(1)).label("nhops")). \
+            select_from(routes).join(link, join_condition).filter(routes.c.nhops < self.nhops_max)
+
+        if self._link_filter_limit() is None:
+            next_hop = self._supplement_recursive_query_with_filters(next_hop, link, routes.c.weight * link.weight)
+
+        routes = routes.union_all(next_hop)
+        new_routes = self.session.query(routes.c.halo_from_id, routes.c.halo_to_id,
+                                         routes.c.weight, routes.c.nhops).filter(routes.c.nhops > 0)
+        self._connection.execute(self._table.insert().from_select(['halo_from_id', 'halo_to_id', 'weight', 'nhops'],
+                                                                  new_routes))
+
+    def _supplement_recursive_query_with_filters(self, query, link, weight):
+        """Apply the filters of _generate_next_level_prelim_links and _filter_prelim_links_into_final to a query
+        extending a route by link, taking the aggregated weight of the new route to be weight"""
+        candidate = _RouteCandidateColumns(link.halo_from_id, link.halo_to_id, weight)
+        query = query.filter(link.weight > self._min_onehop_weight)
+        query = self._supplement_halolink_query_with_reverse_hop_filter(query, candidate)
+        return self._supplement_halolink_query_with_filter(query, candidate)
+
+    def _make_hops_in_link_graph(self):
+        graph = link_graph.get_link_graph(self.session, self.halo_from.timestep.simulation_id)
+        halo_times = graph.halo_times(self.session)
+
+        start = graph.index_of([self.halo_from.id])
+        frontier = link_graph.HopCandidates(start, start, np.array([1.0]))
+        rows = []
+        for i in range(0, self.nhops_max):
+            generated = graph.expand(frontier.to_index, frontier.weight, self._min_onehop_weight)
+            if len(generated) != 0:
+                frontier = self._filter_link_graph_hops(graph, halo_times, self._combine_link_graph_routes(generated))
+                rows+=[{'halo_from_id': int(graph.halo_ids[f]), 'halo_to_id': int(graph.halo_ids[t]),
+                        'weight': float(w), 'nhops': i+1, 'source_id': None}
+                       for f, t, w in zip(frontier.from_index, frontier.to_index, frontier.weight)]
+                filtered_count = len(frontier)
+            else:
+                filtered_count = 0
+
+            if self._hopping_finished(filtered_count):
+                break
+        self._nhops_taken = i
+
+        if len(rows)>0:
+            self._connection.execute(self._table.insert(), rows)
+
+    def _combine_link_graph_routes(self, hops):
+        """Keep only the strongest route to each halo, if routes are being combined (cf. the group_by in
+        _generate_next_level_prelim_links)"""
+        if not self._combine_routes or len(hops)==0:
+            return hops
+        order = np.lexsort((-hops.weight, hops.to_index))
+        hops = hops.take(order)
+        first_of_each = np.concatenate(([True], hops.to_index[1:]!=hops.to_index[:-1]))
+        return hops.take(first_of_each)
+
+    def _filter_link_graph_hops(self, graph, halo_times, hops):
+        """Apply the equivalent of _filter_prelim_links_into_final to in-memory hops"""
+        if self._min_onehop_reverse_weight is not None:
+            # the SQL join emits one row per qualifying reverse link
+            hops = hops.take(np.repeat(np.arange(len(hops)),
+                                       graph.count_reverse_links(hops, self._min_onehop_reverse_weight)))
+
+        time_old = halo_times[hops.from_index]
+        time_new = halo_times[hops.to_index]
+        if self.directed.lower()=='backwards':
+            time_ok = time_new < time_old*(1.0-SMALL_FRACTION)
+        else:
+            time_ok = time_new > time_old*(1.0+SMALL_FRACTION)
+
+        hops = hops.take((hops.weight > self._min_aggregated_weight) & time_ok)
+        return self._select_link_graph_hops(graph, halo_times, hops)
+
+    def _select_link_graph_hops(self, graph, halo_times, hops):
+        """In-memory equivalent of any restrictions applied by _supplement_halolink_query_with_filter beyond the
+        basic link filter. Subclasses overriding one must override the other."""
+        return hops
+
     def _hopping_finished(self, filtered_count):
         return filtered_count==0
 
@@ -1,11 +1,14 @@
+import numpy as np
+
 from .multi_hop import MultiHopStrategy
+from .. import core
 from ..config import num_multihops_max_default as NHOPS_MAX_DEFAULT
 
 
 class MultiHopAllProgenitorsStrategy(MultiHopStrategy):
     """Finds all progenitors for a halo at every step"""
     def __init__(self, halo_from, nhops_max=NHOPS_MAX_DEFAULT, include_startpoint=False, target='auto',
-                 combine_routes=True, order_by=None, one_simulation=None):
+                 combine_routes=True, order_by=None, one_simulation=None, engine=None):
         if order_by is None:
             order_by = ['time_desc', 'halo_number_asc']
         self.sim_id = halo_from.timestep.simulation_id
@@ -18,7 +21,8 @@ class MultiHopAllProgenitorsStrategy(MultiHopStrategy):
                                                                order_by=order_by,
                                                                combine_routes=combine_routes,
                                                              min_onehop_reverse_weight=0.1,
-                                                             one_simulation=one_simulation)
+                                                             one_simulation=one_simulation,
+                                                             engine=engine)
 
     def _supplement_halolink_query_with_filter(self, query, table):
         query = super(MultiHopAllProgenitorsStrategy, self)._supplement_halolink_query_with_filter(query, table)
@@ -27,6 +31,10 @@ class MultiHopAllProgenitorsStrategy(MultiHopStrategy):
         else:
             return query.filter(self.timestep_new.simulation_id == self.sim_id)
 
+    def _select_link_graph_hops(self, graph, halo_times, hops):
+        # the link graph only ever contains halos from this simulation
+        return hops
+
 
 class MultiHopMajorProgenitorsStrategy(MultiHopAllProgenitorsStrategy):
     """Finds the major progenitor for a halo at every step"""
@@ -36,6 +44,17 @@ class MultiHopMajorProgenitorsStrategy(MultiHopAllProgenitorsStrategy):
         return query.order_by(self.timestep_new.time_gyr.desc(), table.c.weight.desc(), self.halo_new.halo_number). \
             limit(1)
 
+    def _select_link_graph_hops(self, graph, halo_times, hops):
+        if len(hops)==0:
+            return hops
+        to_index = hops.to_index
+        best = np.lexsort((graph.halo_number[to_index], -hops.weight, -halo_times[to_index]))[0]
+        return hops.take([best])
+
+    def _branch_kind(self):
+        if self._follows_branch_hop_rule(0.1) and self._hop_sql_is_standard():
+            return core.branches.MAJOR_PROGENITOR
+
 class MultiHopMostRecentMergerStrategy(MultiHopAllProgenitorsStrategy):
     """Finds the halos involved in the most recent merger into the major progenitor branch of the halo"""
 
@@ -70,4 +89,15 @@ class MultiHopMajorDescendantsStrategy(MultiHopStrategy):
             order_by(self.timestep_new.time_gyr, table.c.weight.desc(), self.halo_new.halo_number). \
             limit(1)
 
+    def _select_link_graph_hops(self, graph, halo_times, hops):
+        if len(hops)==0:
+            return hops
+        to_index = hops.to_index
+        best = np.lexsort((graph.halo_number[to_index], -hops.weight, halo_times[to_index]))[0]
+        return hops.take([best])
+
+    def _branch_kind(self):
+        if self._follows_branch_hop_rule(None) and self._hop_sql_is_standard():
+            return core.branches.MAJOR_DESCENDANT
+
 
@@ -110,6 +110,9 @@ class MultiSourceMultiHopStrategy(MultiHopStrategy):
     def _should_halt(self):
         return self.query.count()>0
 
+    def _branch_seeds(self):
+        return [(i, halo_from.id) for i, halo_from in enumerate(self._all_halo_from)]
+
     def _order_by_clause(self, halo_alias, timestep_alias):
         return [self._link_orm_class.source_id] \
                + super(MultiSourceMultiHopStrategy, self)._order_by_clause(halo_alias, timestep_alias)
@@ -178,6 +181,10 @@ class MultiSourceAllMajorProgenitorsStrategy(MultiSourceMultiHopStrategy):
     def _should_halt(self):
         return False
 
+    def _branch_kind(self):
+        if self._follows_branch_hop_rule(None):
+            return core.branches.STRONGEST_PROGENITOR
+
 class MultiSourceAllMajorDescendantsStrategy(MultiSourceMultiHopStrategy):
 
     def __init__(self, halos_from, **kwargs):
@@ -185,4 +192,8 @@ class MultiSourceAllMajorDescendantsStrategy(MultiSourceMultiHopStrategy):
                                                                      directed='forwards', include_startpoint=True)
 
     def _should_halt(self):
-        return False
\ No newline at end of file
+        return False
+
+    def _branch_kind(self):
+        if self._follows_branch_hop_rule(None):
+            return core.branches.STRONGEST_DESCENDANT
@@ -1,6 +1,17 @@
+"""Lists of halo ids held in the database, so that they can be joined against in queries.
+
+temporary_halolist_table provides a table of ids for the duration of a with block. Short lists (up to
+config.temporary_halolist_max_inline ids) are given inline in the query instead, so no table is needed at all.
+Otherwise a TEMPORARY table is taken from a pool kept for each database connection, and emptied and returned to
+the pool afterwards, so that tables are only created the first time they are needed on a connection. The tables
+are not registered in core.Base.metadata.
+
+Temporary tables created within a transaction may disappear if it is rolled back, so after any rollback the
+tables in the pool are checked for (and if necessary recreated) before being reused."""
+
 from __future__ import absolute_import
-from . import core
-from sqlalchemy import Column, Table, String, Integer, Float, ForeignKey
+from . import core, config
+from sqlalchemy import Column, Table, MetaData, Integer, literal, select, union_all
 import sqlalchemy
 import random
 import string
@@ -9,38 +20,90 @@ from six.moves import range
 
 _temp_sessions = {}
 
+_POOL_KEY = 'tangos_temporary_halolists'
+_INSERT_BATCH_SIZE = 500
+
+
+class _HalolistPool(object):
+    """The temporary tables created on one database connection that are not currently in use"""
+    def __init__(self):
+        self.free = []
+        self.generation = 0 # incremented whenever a rollback may have removed tables from the database
+
+
+def _random_name():
+    return 'halolist_'+''.join(random.choice(string.ascii_lowercase) for _ in range(10))
+
+def _on_rollback(connection):
+    if connection.closed or connection.invalidated:
+        return
+    pool = connection.info.get(_POOL_KEY, None)
+    if pool is not None:
+        pool.generation+=1
+
+def _on_reset(dbapi_connection, connection_record):
+    pool = connection_record.info.get(_POOL_KEY, None)
+    if pool is not None:
+        pool.generation+=1
+
+def _get_pool(connection):
+    pool = connection.info.get(_POOL_KEY, None)
+    if pool is None:
+        engine = connection.engine
+        if not sqlalchemy.event.contains(engine, 'rollback', _on_rollback):
+            sqlalchemy.event.listen(engine, 'rollback', _on_rollback)
+            sqlalchemy.event.listen(engine, 'reset', _on_reset)
+        pool = connection.info[_POOL_KEY] = _HalolistPool()
+    return pool
+
 def _create_temp_halolist(session):
     global _temp_sessions
+    connection = session.connection()
+    pool = _get_pool(connection)
 
-    rstr = ''.join(random.choice(string.ascii_lowercase) for _ in range(10))
-    halolist_table = Table(
-            'halolist_'+rstr,
-            core.Base.metadata,
-            Column('id',Integer, primary_key=True),
-            Column('halo_id',Integer,ForeignKey('halos.id')),
-            prefixes = ['TEMPORARY']
-        )
+    if len(pool.free)>0:
+        halolist_table, generation = pool.free.pop()
+        if generation!=pool.generation:
+            halolist_table.create(bind=connection, checkfirst=True)
+            connection.execute(halolist_table.delete())
+    else:
+        halolist_table = Table(
+                _random_name(),
+                MetaData(),
+                Column('id',Integer, primary_key=True),
+                Column('halo_id',Integer),
+                prefixes = ['TEMPORARY']
+            )
+        halolist_table.create(bind=connection)
 
-    halolist_table.create(bind=session.connection())
     _temp_sessions[id(halolist_table)] = session
     return halolist_table
 
 def _delete_temp_halolist(table):
     global _temp_sessions
     connection = _get_connection_for(table)
-    table.drop(bind=connection)
-    core.Base.metadata.remove(table)
+    connection.execute(table.delete())
+    pool = _get_pool(connection)
+    pool.free.append((table, pool.generation))
     del _temp_sessions[id(table)]
 
+def _create_inline_halolist(session, ids):
+    rows = [select([literal(i, Integer).label('id'), literal(halo_id, Integer).label('halo_id')])
+            for i, halo_id in enumerate(ids, 1)]
+    halolist = union_all(*rows).alias(_random_name())
+    _temp_sessions[id(halolist)] = session
+    return halolist
+
 def _insert_into_temp_halolist(table, ids):
     connection = _get_connection_for(table)
     if isinstance(ids, sqlalchemy.orm.query.Query):
         connection.execute(table.insert().from_select(['halo_id'], ids))
     else:
-        connection.execute(
-            table.insert(),
-            *[{'halo_id': id} for id in ids]
-        )
+        for i in range(0, len(ids), _INSERT_BATCH_SIZE):
+            connection.execute(table.insert().values([{'halo_id': id} for id in ids[i:i+_INSERT_BATCH_SIZE]]))
+
+def _as_id_list(ids):
+    return [None if id is None else int(id) for id in ids]
 
 def _get_session_for(table):
     global _temp_sessions
@@ -57,12 +120,14 @@ def halo_query(table):
     1-1 correspondence with the rows in the temporary table. For this, you need to use
     enumerated_halo_query"""
     session = _get_session_for(table)
-    return session.query(core.halo.Halo).select_from(table).join(core.halo.Halo)
+    return session.query(core.halo.Halo).select_from(table).join(core.halo.Halo,
+                                                                 core.halo.Halo.id == table.c.halo_id)
 
 def enumerated_halo_query(table):
-    """Query that returns tuples of id, halo for each row in the temporary table"""
+    """Query that returns tuples of id, halo for each row in the temporary table, in the order of the rows"""
     session = _get_session_for(table)
-    return session.query(table.c.id, core.halo.Halo).select_from(table).outerjoin(core.halo.Halo)
+    return session.query(table.c.id, core.halo.Halo).select_from(table).\
+        outerjoin(core.halo.Halo, core.halo.Halo.id == table.c.halo_id).order_by(table.c.id)
 
 def all_halos_with_duplicates(table):
     """Return all halos in the temporary table, including duplicates"""
@@ -75,11 +140,19 @@ def halolink_query(table):
 
 @contextlib.contextmanager
 def temporary_halolist_table(session, ids=None, callback=None):
+    """Context manager providing a table containing the given ids, which may be a list or a query returning ids"""
+    if ids is not None and not isinstance(ids, sqlalchemy.orm.query.Query):
+        ids = _as_id_list(ids)
 
-    table = _create_temp_halolist(session)
-    if ids is not None:
-        _insert_into_temp_halolist(table, ids)
-    yield table
-    _delete_temp_halolist(table)
+    if isinstance(ids, list) and 0<len(ids)<=config.temporary_halolist_max_inline:
+        table = _create_inline_halolist(session, ids)
+        yield table
+        del _temp_sessions[id(table)]
+    else:
+        table = _create_temp_halolist(session)
+        if ids is not None:
+            _insert_into_temp_halolist(table, ids)
+        yield table
+        _delete_temp_halolist(table)
     if callback is not None:
         callback()
@@ -61,6 +61,8 @@ def autorevert():
     core.set_default_session(isolated_session)
     yield
     transaction.rollback()
+    # any dictionary items created in the meantime no longer exist
+    core.dictionary.invalidate_dictionary_cache()
     core.set_default_session(old_session)
 
 @contextlib.contextmanager
@@ -147,6 +149,9 @@ class SqlExecutionTracker(object):
         return (any(self.statements_contain(search_string)))
 
     def callback(self, conn, query, *_):
+        if hasattr(query, 'compile'):
+            # compile for the connection's dialect, since not all statements can be expressed in the default one
+            query = query.compile(dialect=conn.dialect)
         self._queries.append(str(query))
         self._stacks.append("".join(traceback.format_list(traceback.extract_stack()[:-2])))
 
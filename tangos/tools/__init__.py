@@ -64,4 +64,5 @@ class GenericTangosTool(object):
         for c in cls.__subclasses__():
             c.add_tools(subparse)
 
-from . import add_simulation, consistent_trees_importer, crosslink, property_importer, property_writer, ahf_merger_tree_importer
\ No newline at end of file
+from . import add_simulation, consistent_trees_importer, crosslink, property_importer, property_writer, ahf_merger_tree_importer, \
+    column_builder, array_migrator, blob_compactor, branch_builder
\ No newline at end of file
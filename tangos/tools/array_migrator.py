@@ -0,0 +1,86 @@
+from __future__ import absolute_import
+import sqlalchemy.orm
+
+from .. import core
+from ..core import blob_store, data_attribute_mapper
+from ..log import logger
+from . import GenericTangosTool
+
+
+class ArrayMigrator(GenericTangosTool):
+    tool_name = 'migrate-arrays'
+    tool_description = 'Rewrite array properties stored in the old pickled format into the numpy-native format. ' \
+                       'Compressed arrays stay compressed unless --decompress is given'
+    parallel = False
+
+    @classmethod
+    def add_parser_arguments(self, parser):
+        parser.add_argument('--sims', '--for', action='store', nargs='*',
+                            metavar='simulation_name',
+                            help='Specify a simulation (or multiple simulations) to run on')
+        parser.add_argument('--batch-size', action='store', type=int, default=1000,
+                            help='Number of rows to load and rewrite between commits')
+        parser.add_argument('--decompress', action='store_true',
+                            help='Store the migrated arrays uncompressed, so that they can be read without copying. '
+                                 'Note that this can make the database several times larger')
+
+    def process_options(self, options):
+        self.options = options
+
+    def _migrate_row(self, row):
+        """Rewrite a single row if it is stored in the pickled format and can be stored natively.
+
+        Returns True if the row was rewritten."""
+        packed = row.data_array
+        if not (packed.startswith(b"PX") or packed.startswith(b"ZX")):
+            return False
+        data = data_attribute_mapper.get_data_of_unknown_type(row)
+        if not data_attribute_mapper.ArrayAttributeMapper.can_pack_native(data):
+            return False
+        mapper = data_attribute_mapper.DataAttributeMapper(data=data)
+        if isinstance(mapper, data_attribute_mapper.ArrayAttributeMapper):
+            row.data_array = mapper.pack(data, self._compression_for_row(row), self._blob_store_name_for_row(row))
+        else:
+            mapper.set(row, data)
+        return True
+
+    def _compression_for_row(self, row):
+        if self.options.decompress:
+            return 'none'
+        elif row.data_array.startswith(b"ZX"):
+            return 'zlib'
+        else:
+            return getattr(row, 'array_compression', None)
+
+    @staticmethod
+    def _blob_store_name_for_row(row):
+        return getattr(row, 'blob_store_name', None) if blob_store.enabled() else None
+
+    def _migrate_query(self, session, query, property_class):
+        query = query.filter(property_class.data_array != None).\
+            options(sqlalchemy.orm.undefer(property_class.data_array)).order_by(property_class.id)
+        last_id = 0
+        num_migrated = 0
+        while True:
+            rows = query.filter(property_class.id > last_id).limit(self.options.batch_size).all()
+            if len(rows)==0:
+                break
+            num_migrated += sum(self._migrate_row(row) for row in rows)
+            last_id = rows[-1].id
+            session.commit()
+            session.expunge_all()
+        logger.info("Migrated %d rows of %s", num_migrated, property_class.__tablename__)
+
+    def run_calculation_loop(self):
+        session = core.get_default_session()
+        sim_ids = [x.id for x in core.sim_query_from_name_list(self.options.sims, session)]
+
+        halo_query = session.query(core.halo_data.HaloProperty).\
+            join(core.halo.Halo, core.halo_data.HaloProperty.halo_id == core.halo.Halo.id).\
+            join(core.timestep.TimeStep, core.halo.Halo.timestep_id == core.timestep.TimeStep.id).\
+            filter(core.timestep.TimeStep.simulation_id.in_(sim_ids))
+        self._migrate_query(session, halo_query, core.halo_data.HaloProperty)
+
+        sim_query = session.query(core.simulation.SimulationProperty).\
+            filter(core.simulation.SimulationProperty.simulation_id.in_(sim_ids))
+        self._migrate_query(session, sim_query, core.simulation.SimulationProperty)
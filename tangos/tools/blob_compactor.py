@@ -0,0 +1,70 @@
+from __future__ import absolute_import
+import sqlalchemy
+import sqlalchemy.orm
+
+from .. import core
+from ..core import blob_store, data_attribute_mapper
+from ..log import logger
+from . import GenericTangosTool
+
+
+class BlobCompactor(GenericTangosTool):
+    tool_name = 'compact-blobs'
+    tool_description = 'Reclaim space in the sidecar blob store left by deleted or superseded array properties. ' \
+                       'Writers block while a simulation is compacted, but payloads they appended before it started ' \
+                       'are only kept if already committed, so avoid compacting during a tangos write'
+    parallel = False
+
+    @classmethod
+    def add_parser_arguments(self, parser):
+        parser.add_argument('--sims', '--for', action='store', nargs='*',
+                            metavar='simulation_name',
+                            help='Specify a simulation (or multiple simulations) to run on')
+
+    def process_options(self, options):
+        self.options = options
+
+    def _blob_references(self, session, simulation):
+        """Return all properties of the simulation that refer to the blob store"""
+        HaloProperty = core.halo_data.HaloProperty
+        # references are short, so avoid loading any inline arrays
+        query = session.query(HaloProperty).\
+            join(core.halo.Halo, HaloProperty.halo_id == core.halo.Halo.id).\
+            join(core.timestep.TimeStep, core.halo.Halo.timestep_id == core.timestep.TimeStep.id).\
+            filter(core.timestep.TimeStep.simulation_id == simulation.id,
+                   HaloProperty.data_array != None,
+                   sqlalchemy.func.length(HaloProperty.data_array) < 1024).\
+            options(sqlalchemy.orm.undefer(HaloProperty.data_array))
+        return [p for p in query.all() if data_attribute_mapper.get_blob_reference(p.data_array) is not None]
+
+    def _compact_simulation(self, session, simulation):
+        # appending is blocked for the whole rewrite, so that no payload can be added to a file about to be removed
+        with blob_store.simulation_lock(simulation.basename):
+            old_files = blob_store.files_for_simulation(simulation.basename)
+            if len(old_files)==0:
+                return
+
+            new_file = blob_store.next_generation_filename(simulation.basename)
+            properties = self._blob_references(session, simulation)
+
+            for p in properties:
+                header, filename, offset, length = data_attribute_mapper.get_blob_reference(p.data_array)
+                new_offset = blob_store.append(new_file, blob_store.read_raw(filename, offset, length))
+                p.data_array = data_attribute_mapper.make_blob_reference(header, new_file, new_offset, length)
+
+            # only remove the old files once the database no longer refers to them
+            session.commit()
+            for filename in old_files:
+                blob_store.remove(filename)
+
+        logger.info("Compacted %d blob file(s) for %s; %d live arrays retained", len(old_files), simulation.basename,
+                    len(properties))
+
+    def run_calculation_loop(self):
+        if not blob_store.enabled():
+            logger.error("No blob store is configured (set config.blob_store_path or TANGOS_BLOB_STORE)")
+            return
+
+        session = core.get_default_session()
+        for simulation in core.sim_query_from_name_list(self.options.sims, session).all():
+            self._compact_simulation(session, simulation)
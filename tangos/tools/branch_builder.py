@@ -0,0 +1,25 @@
+from __future__ import absolute_import
+
+from .. import core
+from ..relation_finding import branches
+from . import GenericTangosTool
+
+
+class BranchBuilder(GenericTangosTool):
+    tool_name = 'build-branches'
+    tool_description = 'Build materialised progenitor and descendant branches, to accelerate merger tree queries'
+    parallel = False
+
+    @classmethod
+    def add_parser_arguments(self, parser):
+        parser.add_argument('--sims', '--for', action='store', nargs='*',
+                            metavar='simulation_name',
+                            help='Specify a simulation (or multiple simulations) to run on')
+
+    def process_options(self, options):
+        self.options = options
+
+    def run_calculation_loop(self):
+        session = core.get_default_session()
+        for simulation in core.sim_query_from_name_list(self.options.sims, session).all():
+            branches.build_branches(session, simulation)
@@ -0,0 +1,61 @@
+from __future__ import absolute_import
+
+from .. import parallel_tasks
+from ..log import logger
+from .. import core
+from . import GenericTangosTool
+
+
+class ColumnBuilder(GenericTangosTool):
+    tool_name = 'build-columns'
+    tool_description = 'Build packed per-timestep columns of scalar properties, to accelerate calculate_all'
+
+    @classmethod
+    def add_parser_arguments(self, parser):
+        parser.add_argument('--sims', '--for', action='store', nargs='*',
+                            metavar='simulation_name',
+                            help='Specify a simulation (or multiple simulations) to run on')
+
+        parser.add_argument('properties', action='store', nargs='*',
+                            help="The names of the properties to pack; if not specified, all properties stored in each timestep are packed.")
+
+    def process_options(self, options):
+        self.options = options
+
+    def _name_ids_for_timestep(self, session, ts):
+        query = session.query(core.halo_data.HaloProperty.name_id).\
+            join(core.halo.Halo, core.halo_data.HaloProperty.halo_id == core.halo.Halo.id).\
+            filter(core.halo.Halo.timestep_id == ts.id).distinct()
+        name_ids = [x[0] for x in query.all()]
+
+        if len(self.options.properties)>0:
+            requested_ids = [core.dictionary.get_dict_id(name, None, session=session)
+                             for name in self.options.properties]
+            name_ids = [n for n in name_ids if n in requested_ids]
+
+        return name_ids
+
+    def _build_columns_for_timestep(self, ts):
+        session = core.get_default_session()
+        name_ids = self._name_ids_for_timestep(session, ts)
+
+        num_built = 0
+        with parallel_tasks.ExclusiveLock("insert_list"):
+            for name_id in name_ids:
+                if core.columnar.build_column(session, ts.id, name_id) is not None:
+                    num_built+=1
+            session.commit()
+
+        logger.info("Built %d columns for %s (%d properties could not be packed)", num_built, ts,
+                    len(name_ids)-num_built)
+
+    def run_calculation_loop(self):
+        base_sim = core.sim_query_from_name_list(self.options.sims)
+
+        timesteps = []
+        for x in base_sim:
+            timesteps += core.get_default_session().query(core.timestep.TimeStep).filter_by(
+                simulation_id=x.id).order_by(core.timestep.TimeStep.time_gyr).all()
+
+        for ts in parallel_tasks.distributed(timesteps):
+            self._build_columns_for_timestep(ts)
@@ -8,6 +8,7 @@ from ..log import logger
 from ..core import get_or_create_dictionary_item
 from ..core.halo import PhantomHalo
 from ..core.halo_data import HaloLink, HaloProperty
+from ..core.columnar import refresh_existing_columns
 from .. import config
 from . import GenericTangosTool
 from six.moves import xrange
@@ -97,6 +98,7 @@ class ConsistentTreesImporter(GenericTangosTool):
                 props.append(HaloProperty(o, dict_obj, tree_id))
         session.add_all(props)
         session.commit()
+        refresh_existing_columns(session, [(ts.id, dict_obj.id)])
         logger.info("%d consistent tree IDs added to step %s", len(props), ts)
 
 
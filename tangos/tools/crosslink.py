@@ -5,6 +5,7 @@ import tangos as db
 import tangos.core, tangos.parallel_tasks.database
 from .. import config
 from tangos import parallel_tasks
+from tangos.relation_finding import branches
 from tangos import core
 import sqlalchemy, sqlalchemy.orm
 from tangos.log import logger
@@ -52,6 +53,10 @@ class GenericLinker(GenericTangosTool):
             if self.args.force or self.need_crosslink_ts(s_x, s, object_type):
                 self.crosslink_ts(s_x, s, 0, self.args.hmax, self.args.dmonly, object_typecode=object_type)
 
+        with parallel_tasks.ExclusiveLock("update_branches"):
+            # bring any materialised branches (see build-branches) up to date with the new links
+            branches.update_stale_branches(self.session)
+
     def _generate_timestep_pairs(self):
         raise NotImplementedError("No implementation found for generating the timestep pairs")
 
@@ -96,6 +96,7 @@ class PropertyImporter(GenericTangosTool):
         logger.info("Add %d properties", len(rows_to_store))
         self._session.add_all(rows_to_store)
         self._session.commit()
+        core.columnar.refresh_existing_columns(self._session, [(ts.id, db_name.id) for db_name in property_db_names])
 
     def run_calculation_loop(self):
         base_sim = core.sim_query_from_name_list(self.options.sims)
@@ -1,7 +1,9 @@
 from __future__ import absolute_import
 import argparse
 import contextlib
+import copy
 import gc
+import multiprocessing
 import pdb
 import random
 import sys
@@ -17,8 +19,12 @@ import sqlalchemy.orm
 
 from . import GenericTangosTool
 from .. import properties
+from ..properties import dependency_graph
 from ..util import terminalcontroller, timing_monitor, proxy_object
-from .. import parallel_tasks, core
+from ..util.timestep_prefetch import TimestepPrefetcher
+from ..util.fork_pool import fork_pool
+from .. import parallel_tasks, core, config
+from .. import temporary_halolist as thl
 from ..util.check_deleted import check_deleted
 from ..cached_writer import insert_list
 from ..log import logger
@@ -31,6 +37,107 @@ class AttributableDict(dict):
     pass
 
 
+class ExistingPropertyMatrix(object):
+    """Records which of the named properties already exist in the database for each of a list of halos.
+
+    A single query establishes which (halo, name) pairs exist, stored in the boolean array present[halo, name].
+    Where the existing data is a link, link_target_ids[halo, name] holds the id of the target halo (otherwise -1).
+    The values themselves are only retrieved, by existing_properties, for the halos that need calculating."""
+
+    def __init__(self, halos, names, session=None):
+        self.halos = list(halos)
+        self.names = list(names)
+        self._session = session or core.get_default_session()
+
+        shape = (len(self.halos), len(self.names))
+        self.present = np.zeros(shape, dtype=bool)
+        self.link_target_ids = np.full(shape, -1, dtype=np.int64)
+
+        name_ids = core.get_dict_ids(self.names, None)
+        self._name_ids = np.array([-1 if x is None else x for x in name_ids], dtype=np.int64)
+        self._halo_ids = np.array([h.id for h in self.halos], dtype=np.int64)
+
+        if len(self.halos)>0 and (self._name_ids>=0).any():
+            self._fill()
+
+    def _fill(self):
+        HaloProperty, HaloLink = core.HaloProperty, core.HaloLink
+        known_name_ids = [int(x) for x in self._name_ids if x>=0]
+        with thl.temporary_halolist_table(self._session, self._halo_ids) as table:
+            existing_properties = sqlalchemy.select([HaloProperty.halo_id, HaloProperty.name_id,
+                                                     sqlalchemy.literal(-1, sqlalchemy.Integer)]).\
+                select_from(table.join(HaloProperty, HaloProperty.halo_id == table.c.halo_id)).\
+                where(sqlalchemy.and_(HaloProperty.name_id.in_(known_name_ids), HaloProperty.deprecated == False))
+            existing_links = sqlalchemy.select([HaloLink.halo_from_id, HaloLink.relation_id,
+                                                sqlalchemy.func.coalesce(HaloLink.halo_to_id, -1)]).\
+                select_from(table.join(HaloLink, HaloLink.halo_from_id == table.c.halo_id)).\
+                where(HaloLink.relation_id.in_(known_name_ids))
+            rows = self._session.execute(sqlalchemy.union_all(existing_properties, existing_links)).fetchall()
+
+        rows = np.array(rows, dtype=np.int64).reshape((-1, 3))
+        halo_index = self._index_of(self._halo_ids, rows[:,0])
+        name_index = self._index_of(self._name_ids, rows[:,1])
+        self.present[halo_index, name_index] = True
+        self.link_target_ids[halo_index, name_index] = rows[:,2]
+
+    @staticmethod
+    def _index_of(reference_ids, ids):
+        order = np.argsort(reference_ids)
+        return order[np.searchsorted(reference_ids[order], ids)]
+
+    def all_present(self, names):
+        """Return a boolean array indicating, for each halo, whether all the named properties exist"""
+        columns = [self.names.index(name) for name in names]
+        return self.present[:, columns].all(axis=1)
+
+    def existing_properties(self, rows):
+        """Return, for each of the specified halo indices, an AttributableDict of the existing data for the halo
+        as seen by a PropertyCalculation. Array data and linked halos are retrieved with one query each."""
+        rows = list(rows)
+        results = [self._basic_properties(self.halos[i]) for i in rows]
+        if len(rows)==0:
+            return results
+
+        result_for_halo_id = {self.halos[i].id: r for i, r in zip(rows, results)}
+        present = self.present[rows]
+        is_link = self.link_target_ids[rows]>=0
+        property_columns = np.where((present & ~is_link).any(axis=0))[0]
+        link_columns = np.where(is_link.any(axis=0))[0]
+
+        if len(property_columns)>0:
+            name_for_id = {int(self._name_ids[j]): self.names[j] for j in property_columns}
+            with thl.temporary_halolist_table(self._session, list(result_for_halo_id.keys())) as table:
+                existing = self._session.query(core.HaloProperty).select_from(table).\
+                    join(core.HaloProperty, core.HaloProperty.halo_id == table.c.halo_id).\
+                    filter(core.HaloProperty.name_id.in_(list(name_for_id.keys())),
+                           core.HaloProperty.deprecated == False).\
+                    options(sqlalchemy.orm.undefer_group("data")).order_by(core.HaloProperty.id).all()
+            for x in existing:
+                result_for_halo_id[x.halo_id][name_for_id[x.name_id]] = x.data_raw
+
+        if len(link_columns)>0:
+            target_ids = self.link_target_ids[rows][:, link_columns]
+            with thl.temporary_halolist_table(self._session, np.unique(target_ids[target_ids>=0])) as table:
+                target_for_id = {h.id: h for h in thl.halo_query(table).all()}
+            for result, row_target_ids in zip(results, target_ids):
+                for j, target_id in zip(link_columns, row_target_ids):
+                    if target_id>=0:
+                        result[self.names[j]] = target_for_id.get(target_id)
+
+        return results
+
+    @staticmethod
+    def _basic_properties(db_halo):
+        existing_properties_data = AttributableDict()
+        existing_properties_data.halo_number = db_halo.halo_number
+        existing_properties_data.NDM = db_halo.NDM
+        existing_properties_data.NGas = db_halo.NGas
+        existing_properties_data.NStar = db_halo.NStar
+        existing_properties_data['halo_number'] = db_halo.halo_number
+        existing_properties_data['finder_id'] = db_halo.finder_id
+        return existing_properties_data
+
+
 class PropertyWriter(GenericTangosTool):
     tool_name = "write"
     tool_description = "Calculate properties and write them into the tangos database"
@@ -41,8 +148,16 @@ class PropertyWriter(GenericTangosTool):
         self._writer_minimum = 60  # don't commit at end of halo if < 1 minute past
         self._current_timestep_id = None
         self._loaded_timestep = None
+        self._loaded_timestep_extras = None
         self._loaded_halo_id = None
         self._loaded_halo = None
+        self._loaded_region_spec = None
+        self._loaded_region = None
+        self._prefetcher = None
+        self._next_timestep = None
+        self._fork_workers = None
+        self._forked_halos_and_properties = None
+        self._forked_results = None
 
     @classmethod
     def add_parser_arguments(self, parser):
@@ -65,12 +180,13 @@ class PropertyWriter(GenericTangosTool):
                             help='Process timesteps in random order')
         parser.add_argument('--with-prerequisites', action='store_true',
                             help='Automatically calculate any missing prerequisites for the properties')
-        parser.add_argument('--load-mode', action='store', choices=['all', 'partial', 'server', 'server-partial'],
+        parser.add_argument('--load-mode', action='store', choices=['all', 'partial', 'server', 'server-partial', 'fork'],
                             required=False, default=None,
                             help="Select a load-mode: " \
                                  "  --load-mode partial:        each node attempts to load only the data it needs; " \
                                  "  --load-mode server:         a server process manages the data;"
                                  "  --load-mode server-partial: a server process figures out the indices to load, which are then passed to the partial loader" \
+                                 "  --load-mode fork:           each node loads all the data once, then forks workers which share it to process the halos;" \
                                  "  --load-mode all:            each node loads all the data (default, and often fine for zoom simulations).")
         parser.add_argument('--type', action='store', type=str, dest='htype',
                             help="Secify the object type to run on by tag name (or integer). Can be halo, group, or BH.")
@@ -85,6 +201,17 @@ class PropertyWriter(GenericTangosTool):
                             help="Emulate MPI by handling slice N out of the total workload of M items. If absent, use real MPI.")
         parser.add_argument('--backend', action='store', type=str,
                             help="Specify the paralellism backend (e.g. pypar, mpi4py)")
+        parser.add_argument('--bulk-insert', action='store_true', default=None,
+                            help="Write results to the database using bulk statements rather than the ORM")
+        parser.add_argument('--dedicated-writer', action='store_true',
+                            help="Send results to the server process, which batches all database writes, rather than committing from each process")
+        parser.add_argument('--prefetch', action='store_true',
+                            help="Load the next timestep in a background thread while the current one is processed, if memory allows")
+        parser.add_argument('--prefetch-arrays', action='store', nargs='*', default=None, metavar='array_name',
+                            help="With --prefetch or --load-mode fork, also read the named arrays of the timestep from disk before they are needed "
+                                 "(default with --load-mode fork: the arrays listed in config.fork_prefetch_arrays)")
+        parser.add_argument('--fork-workers', action='store', type=int, default=None, metavar='N',
+                            help="With --load-mode fork, the number of worker processes to fork (default: one per CPU)")
         parser.add_argument('--include-only', action='append', type=str,
                             help="Specify a filter that describes which objects the calculation should be executed for. Multiple filters may be specified, in which case they must all evaluate to true for the object to be included.")
 
@@ -158,9 +285,20 @@ class PropertyWriter(GenericTangosTool):
         if self.options.load_mode=='all':
             self.options.load_mode=None
 
+        if self.options.load_mode=='fork':
+            # the data is loaded as for load-mode all, but only once for all the forked workers
+            self.options.load_mode=None
+            self._fork_workers = self.options.fork_workers or multiprocessing.cpu_count()
+
         if self.options.verbose:
             self.redirect.enabled = False
 
+        if self.options.prefetch:
+            if self.options.load_mode is not None and self.options.load_mode.startswith('server'):
+                logger.warning("--prefetch has no effect when the data is managed by a server process")
+            else:
+                self._prefetcher = TimestepPrefetcher(self.options.load_mode, self.options.prefetch_arrays or [])
+
         self.timing_monitor = timing_monitor.TimingMonitor()
 
     def _compile_inclusion_criterion(self):
@@ -184,14 +322,22 @@ class PropertyWriter(GenericTangosTool):
         if self.options.hmax is not None:
             query = sqlalchemy.and_(query, core.halo.Halo.halo_number<=self.options.hmax)
 
-        needed_properties = self._required_and_calculated_property_names()
-
         halo_query = core.get_default_session().query(core.halo.Halo).order_by(core.halo.Halo.halo_number).filter(query)
-        if self._include:
-            needed_properties.append(self._include)
 
-        logger.info('Gathering existing properties for all halos in timestep %r',db_timestep)
-        halo_query = live_calculation.MultiCalculation(*needed_properties).supplement_halo_query(halo_query)
+        complete_halo_ids = self._complete_halo_ids_query(db_timestep)
+        if complete_halo_ids is not None:
+            num_halos = halo_query.count()
+            halo_query = halo_query.filter(~core.halo.Halo.id.in_(complete_halo_ids))
+            num_complete = num_halos - halo_query.count()
+            if num_complete>0:
+                logger.info("%d of %d halos already have all the requested properties and will be skipped",
+                            num_complete, num_halos)
+                self.tracker.register_already_exists(num_complete*len(self._property_calculator_instances))
+            if num_complete==num_halos:
+                return []
+
+        if self._include:
+            halo_query = live_calculation.MultiCalculation(self._include).supplement_halo_query(halo_query)
 
         halos = halo_query.all()
 
@@ -210,34 +356,35 @@ class PropertyWriter(GenericTangosTool):
         return halos
 
 
-    def _build_existing_properties(self, db_halo):
-        existing_properties = db_halo.all_properties
-        need_data = self._required_and_calculated_property_names()
-        need_data_ids = [core.get_dict_id(x,None) for x in need_data]
+    def _complete_halo_ids_query(self, db_timestep):
+        """Return a query for the ids of halos in the timestep which already have all the properties to be
+        calculated, or None if there is no need to check (because existing values are to be overwritten, or some
+        property has never been written to the database at all).
 
-        existing_properties_data = AttributableDict()
-        for x in existing_properties:
-            if x.name_id in need_data_ids:
-                name = need_data[need_data_ids.index(x.name_id)]
-                existing_properties_data[name] = x.data_raw
+        The check is made in a single aggregate query, so that on restarting a long run, halos (or entire
+        timesteps) with no work left can be skipped without gathering their existing properties."""
+        if self.options.force:
+            return None
 
-        existing_links = db_halo.all_links
-        for x in existing_links:
-            if x.relation_id in need_data_ids:
-                name = need_data[need_data_ids.index(x.relation_id)]
-                existing_properties_data[name] = x.halo_to
+        name_ids = core.get_dict_ids(self._calculated_property_names(), None)
+        if len(name_ids)==0 or None in name_ids:
+            return None
 
-        existing_properties_data.halo_number = db_halo.halo_number
-        existing_properties_data.NDM = db_halo.NDM
-        existing_properties_data.NGas = db_halo.NGas
-        existing_properties_data.NStar = db_halo.NStar
-        existing_properties_data['halo_number'] = db_halo.halo_number
-        existing_properties_data['finder_id'] = db_halo.finder_id
-        return existing_properties_data
+        Halo, HaloProperty, HaloLink = core.Halo, core.HaloProperty, core.HaloLink
+        halos_in_timestep = sqlalchemy.select([Halo.id]).where(Halo.timestep_id == db_timestep.id)
+
+        existing = sqlalchemy.union(
+            sqlalchemy.select([HaloProperty.halo_id.label('halo_id'), HaloProperty.name_id.label('name_id')]).
+                where(sqlalchemy.and_(HaloProperty.halo_id.in_(halos_in_timestep),
+                                      HaloProperty.name_id.in_(name_ids),
+                                      HaloProperty.deprecated == False)),
+            sqlalchemy.select([HaloLink.halo_from_id.label('halo_id'), HaloLink.relation_id.label('name_id')]).
+                where(sqlalchemy.and_(HaloLink.halo_from_id.in_(halos_in_timestep),
+                                      HaloLink.relation_id.in_(name_ids)))
+        ).alias()
 
-    def _build_existing_properties_all_halos(self, halos):
-        return [self._build_existing_properties(h) for h in halos]
-        
+        return sqlalchemy.select([existing.c.halo_id]).group_by(existing.c.halo_id).\
+            having(sqlalchemy.func.count(existing.c.name_id) == len(name_ids))
 
     def _is_commit_needed(self, end_of_timestep, end_of_simulation):
         if len(self._pending_properties)==0:
@@ -255,18 +402,34 @@ class PropertyWriter(GenericTangosTool):
     def _commit_results_if_needed(self, end_of_timestep=False, end_of_simulation=False):
 
         if self._is_commit_needed(end_of_timestep, end_of_simulation):
-            logger.info("Attempting to commit %d halo properties...", len(self._pending_properties))
-            insert_list(self._pending_properties)
-            logger.info("%d properties were committed", len(self._pending_properties))
+            if self.options.dedicated_writer and parallel_tasks.parallel_backend_loaded():
+                parallel_tasks.database.send_properties_to_writer(self._pending_properties)
+                logger.info("%d properties were sent to the writer process", len(self._pending_properties))
+            else:
+                logger.info("Attempting to commit %d halo properties...", len(self._pending_properties))
+                insert_list(self._pending_properties, bulk=self.options.bulk_insert)
+                logger.info("%d properties were committed", len(self._pending_properties))
             self._pending_properties = []
             self._start_time = time.time()
             self.timing_monitor.summarise_timing(logger)
 
+    def _resolve_result(self, r):
+        if isinstance(r, proxy_object.ProxyObjectBase):
+            # TODO: possible optimization here using relative_to_timestep_cache
+            r = r.relative_to_timestep_id(self._current_timestep_id).resolve(core.get_default_session())
+        return r
+
     def _queue_results_for_later_commit(self, db_halo, names, results, existing_properties_data):
+        if self._forked_results is not None:
+            # in a forked worker, the results are passed back to the parent process to be written
+            self._forked_results.append((names, results))
+            for n, r in zip(names, results):
+                if self.options.force or (n not in list(existing_properties_data.keys())):
+                    existing_properties_data[n] = self._resolve_result(r)
+            return
+
         for n, r in zip(names, results):
-            if isinstance(r, proxy_object.ProxyObjectBase):
-                # TODO: possible optimization here using relative_to_timestep_cache
-                r = r.relative_to_timestep_id(self._current_timestep_id).resolve(core.get_default_session())
+            r = self._resolve_result(r)
             if self.options.force or (n not in list(existing_properties_data.keys())):
                 existing_properties_data[n] = r
                 if self.options.debug:
@@ -274,6 +437,15 @@ class PropertyWriter(GenericTangosTool):
                 else:
                     self._pending_properties.append((db_halo, n, r))
 
+    def _calculated_property_names(self):
+        calculated = []
+        for x in self._property_calculator_instances:
+            if isinstance(x.names, six.string_types):
+                calculated.append(x.names)
+            else:
+                calculated.extend(x.names)
+        return list(np.unique(calculated))
+
     def _required_and_calculated_property_names(self):
         needed = []
         for x in self._property_calculator_instances:
@@ -292,7 +464,10 @@ class PropertyWriter(GenericTangosTool):
 
     def _unload_timestep(self):
         self._loaded_halo = None
+        self._loaded_region_spec = None
+        self._loaded_region = None
         self._current_halo_id = None
+        self._loaded_timestep_extras = None
         with check_deleted(self._loaded_timestep):
             self._loaded_timestep=None
             self._current_timestep_id = None
@@ -304,6 +479,9 @@ class PropertyWriter(GenericTangosTool):
 
         self._unload_timestep()
 
+        if self._prefetcher is not None:
+            self._prefetcher.wait(db_timestep)
+
         if self._must_load_timestep_particles():
             self._loaded_timestep = db_timestep.load(mode=self.options.load_mode)
 
@@ -315,12 +493,19 @@ class PropertyWriter(GenericTangosTool):
             except IOError:
                 pass
 
+        if self._prefetcher is not None:
+            # the prefetched data (e.g. the halo catalogue, of which the input handler keeps only a weak reference)
+            # is now kept alive by this writer until the timestep is unloaded, rather than by the prefetcher
+            self._loaded_timestep_extras = self._prefetcher.take(db_timestep)
+            if self._next_timestep is not None and self._should_load_halo_particles():
+                self._prefetcher.start(self._next_timestep)
+
         if self.options.load_mode is None:
             self._run_preloop(self._loaded_timestep, db_timestep,
-                              self._property_calculator_instances, self._existing_properties_all_halos)
+                              self._property_calculator_instances, self._existing_property_matrix)
         else:
             self._run_preloop(None, db_timestep,
-                              self._property_calculator_instances, self._existing_properties_all_halos)
+                              self._property_calculator_instances, self._existing_property_matrix)
 
         self._current_timestep_id = db_timestep.id
 
@@ -333,17 +518,24 @@ class PropertyWriter(GenericTangosTool):
 
         self._loaded_halo_id=db_halo.id
         self._loaded_halo = None
+        self._loaded_region_spec = None
+        self._loaded_region = None
 
         if self._should_load_halo_particles():
             self._loaded_halo  = db_halo.load(mode=self.options.load_mode)
 
         if self.options.load_mode is not None:
             self._run_preloop(self._loaded_halo, db_halo.timestep,
-                              self._property_calculator_instances, self._existing_properties_all_halos)
+                              self._property_calculator_instances, self._existing_property_matrix)
 
 
     def _get_current_halo_specified_region_particles(self, db_halo, region_spec):
-        return db_halo.timestep.load_region(region_spec,self.options.load_mode)
+        # calculations sharing a region are run consecutively (see dependency_graph.calculation_order), so the
+        # region loaded for the previous calculation on this halo can often be reused
+        if self._loaded_region is None or not _regions_equal(self._loaded_region_spec, region_spec):
+            self._loaded_region = db_halo.timestep.load_region(region_spec,self.options.load_mode)
+            self._loaded_region_spec = region_spec
+        return self._loaded_region
 
     def _get_halo_snapshot_data_if_appropriate(self, db_halo, db_data, property_calculator):
 
@@ -396,7 +588,7 @@ class PropertyWriter(GenericTangosTool):
         return result
 
 
-    def _run_preloop(self, f, db_timestep, cinstances, existing_properties_all_halos):
+    def _run_preloop(self, f, db_timestep, cinstances, existing_properties):
         for x in cinstances:
             try:
                 with self.redirect:
@@ -455,26 +647,37 @@ class PropertyWriter(GenericTangosTool):
         self.tracker = CalculationSuccessTracker()
 
         logger.info("Processing %r", db_timestep)
-        self._property_calculator_instances = properties.instantiate_classes(db_timestep.simulation, self.options.properties)
-        if self.options.with_prerequisites:
-            self._add_prerequisites_to_calculator_instances(db_timestep)
+        self._property_calculator_instances = self._plan_calculator_instances(db_timestep)
 
         with parallel_tasks.lock.SharedLock("insert_list"):
             logger.debug("Start halo list query")
             db_halos = self._build_halo_list(db_timestep)
             logger.debug("End halo list query")
 
-        self._existing_properties_all_halos = self._build_existing_properties_all_halos(db_halos)
-        
+        if len(db_halos)>0:
+            logger.info('Gathering existing properties for all halos in timestep %r', db_timestep)
+        self._existing_property_matrix = ExistingPropertyMatrix(db_halos, self._required_and_calculated_property_names())
+
+        if self.options.force:
+            rows = list(range(len(db_halos)))
+        else:
+            complete = self._existing_property_matrix.all_present(self._calculated_property_names())
+            rows = [int(i) for i in np.where(~complete)[0]]
+            self.tracker.register_already_exists(int(complete.sum())*len(self._property_calculator_instances))
+
         logger.info("Successfully gathered existing properties; calculating halo properties now...")
 
         logger.info("  %d halos to consider; %d property calculations for each of them",
-                    len(db_halos), len(self._property_calculator_instances))
+                    len(rows), len(self._property_calculator_instances))
 
-        for db_halo, existing_properties in \
-                self._get_parallel_halo_iterator(list(zip(db_halos, self._existing_properties_all_halos))):
-            self._existing_properties_this_halo = existing_properties
-            self.run_halo_calculation(db_halo, existing_properties)
+        halos_and_properties = self._halos_with_existing_properties(self._existing_property_matrix,
+                                                                    self._get_parallel_halo_iterator(rows))
+        if self._fork_workers is not None:
+            self._run_halo_calculations_in_forked_workers(db_timestep, list(halos_and_properties))
+        else:
+            for db_halo, existing_properties in halos_and_properties:
+                self._existing_properties_this_halo = existing_properties
+                self.run_halo_calculation(db_halo, existing_properties)
 
         logger.info("Done with %r",db_timestep)
         self._unload_timestep()
@@ -484,24 +687,61 @@ class PropertyWriter(GenericTangosTool):
 
         self._commit_results_if_needed(True)
 
-    def _add_prerequisites_to_calculator_instances(self, db_timestep):
-        will_calculate = []
-        requirements = []
-        for inst in self._property_calculator_instances:
-            if isinstance(inst.names, six.string_types):
-                will_calculate+=[inst.names]
-            else:
-                will_calculate+=inst.names
-            requirements+=inst.requires_property()
+    def _halos_with_existing_properties(self, existing, rows):
+        """Yield each halo in rows (indices into existing.halos) together with its existing properties.
 
-        for r in requirements:
-            if r not in will_calculate:
-                new_instance = properties.instantiate_class(db_timestep.simulation, r)
+        The properties are retrieved in one batch if rows is a list, or halo by halo if the halos are being
+        distributed dynamically between processes (see _get_parallel_halo_iterator)."""
+        batches = [rows] if isinstance(rows, list) else ([row] for row in rows)
+        for batch in batches:
+            for row, existing_properties in zip(batch, existing.existing_properties(batch)):
+                yield existing.halos[row], existing_properties
+
+    def _run_halo_calculations_in_forked_workers(self, db_timestep, halos_and_properties):
+        global _forked_writer
+        if len(halos_and_properties)==0:
+            return
+
+        # load the timestep, build the halo catalogue, read the arrays and run the preloop here, so that the
+        # forked workers share the data copy-on-write rather than each loading their own copy
+        self._set_current_timestep(db_timestep)
+        timestep_data = None
+        if self._should_load_halo_particles():
+            arrays = self.options.prefetch_arrays
+            if arrays is None:
+                arrays = config.fork_prefetch_arrays
+            try:
+                timestep_data = db_timestep.simulation.get_output_handler().prefetch_timestep(
+                    db_timestep.extension, arrays=arrays)
+            except IOError:
+                pass
+
+        logger.info("Forking %d workers to process the halos", self._fork_workers)
+        self._forked_halos_and_properties = halos_and_properties
+        _forked_writer = self
+        try:
+            with fork_pool(self._fork_workers, _initialise_forked_worker) as pool:
+                for index, results, counts in pool.imap(_run_halo_calculation_in_forked_worker,
+                                                        range(len(halos_and_properties))):
+                    db_halo, existing_properties = halos_and_properties[index]
+                    for names, values in results:
+                        self._queue_results_for_later_commit(db_halo, names, values, existing_properties)
+                    self.tracker.add_counts(counts)
+                    self._commit_results_if_needed()
+        finally:
+            _forked_writer = None
+            self._forked_halos_and_properties = None
+        del timestep_data
+
+    def _plan_calculator_instances(self, db_timestep):
+        instances = properties.instantiate_classes(db_timestep.simulation, self.options.properties)
+        if self.options.with_prerequisites:
+            instances_with_prerequisites = dependency_graph.add_prerequisites(db_timestep.simulation, instances)
+            for new_instance in instances_with_prerequisites[len(instances):]:
                 logger.info("Missing prerequisites - added class %r",type(new_instance))
                 logger.info("                        providing properties %r",new_instance.names)
-                self._property_calculator_instances = [new_instance]+self._property_calculator_instances
-                self._add_prerequisites_to_calculator_instances(db_timestep) # everything has changed; start afresh
-                break
+            instances = instances_with_prerequisites
+        return dependency_graph.calculation_order(instances)
 
 
     def run_calculation_loop(self):
@@ -510,12 +750,68 @@ class PropertyWriter(GenericTangosTool):
         self._start_time = time.time()
         self._pending_properties = []
 
-        for f_obj in self._get_parallel_timestep_iterator():
-            self.run_timestep_calculation(f_obj)
+        if self._prefetcher is None:
+            for f_obj in self._get_parallel_timestep_iterator():
+                self.run_timestep_calculation(f_obj)
+        else:
+            # the next timestep must be known in advance so that it can be prefetched
+            for f_obj, self._next_timestep in _with_next(self._get_parallel_timestep_iterator()):
+                self.run_timestep_calculation(f_obj)
+            self._prefetcher.release()
 
         self._commit_results_if_needed(True,True)
 
 
+def _regions_equal(region_spec_1, region_spec_2):
+    try:
+        return bool(region_spec_1 == region_spec_2)
+    except (ValueError, TypeError):
+        # e.g. arrays, for which equality is ambiguous
+        return False
+
+_forked_writer = None
+
+def _initialise_forked_worker():
+    # connections inherited from the parent process must be left for the parent to use
+    core.use_new_session_after_fork()
+
+def _in_current_session(db_halo):
+    """Re-query a halo loaded by the parent process, without touching the parent's connection"""
+    halo_id = sqlalchemy.inspect(db_halo).identity[0]
+    return core.get_default_session().query(core.halo.Halo).get(halo_id)
+
+def _run_halo_calculation_in_forked_worker(index):
+    writer = _forked_writer
+    db_halo, existing_properties = writer._forked_halos_and_properties[index]
+    db_halo = _in_current_session(db_halo)
+    existing_properties = copy.copy(existing_properties)
+    for name, value in list(existing_properties.items()):
+        if isinstance(value, core.halo.Halo):
+            existing_properties[name] = _in_current_session(value)
+
+    counts_before = writer.tracker.counts()
+    writer._forked_results = []
+    try:
+        writer.run_halo_calculation(db_halo, existing_properties)
+        results = writer._forked_results
+    finally:
+        writer._forked_results = None
+    counts = [after-before for after, before in zip(writer.tracker.counts(), counts_before)]
+    return index, results, counts
+
+def _with_next(iterable):
+    """Yield pairs of each item with the following one (or None, for the last item)"""
+    iterator = iter(iterable)
+    try:
+        current = next(iterator)
+    except StopIteration:
+        return
+    for following in iterator:
+        yield current, following
+        current = following
+    yield current, None
+
+
 class CalculationSuccessTracker(object):
     def __init__(self):
         self._skipped_existing = 0
@@ -533,6 +829,19 @@ class CalculationSuccessTracker(object):
         else:
             return False
 
+    def counts(self):
+        return [self._succeeded, self._skipped_error, self._skipped_loading_error, self._skipped_existing,
+                self._skipped_missing_prerequisite]
+
+    def add_counts(self, counts):
+        """Add counts returned by counts() on another tracker, e.g. one in a forked worker process"""
+        succeeded, error, loading_error, existing, missing_prerequisite = counts
+        self._succeeded+=succeeded
+        self._skipped_error+=error
+        self._skipped_loading_error+=loading_error
+        self._skipped_existing+=existing
+        self._skipped_missing_prerequisite+=missing_prerequisite
+
     def report_to_log(self, logger):
         logger.info("            Succeeded: %d property calculations", self._succeeded)
         logger.info("              Errored: %d property calculations", self._skipped_error)
@@ -552,6 +861,6 @@ class CalculationSuccessTracker(object):
     def register_missing_prerequisite(self):
         self._skipped_missing_prerequisite+=1
 
-    def register_already_exists(self):
-        self._skipped_existing+=1
+    def register_already_exists(self, count=1):
+        self._skipped_existing+=count
 
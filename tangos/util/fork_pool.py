@@ -0,0 +1,24 @@
+from __future__ import absolute_import
+import contextlib
+import multiprocessing
+
+
+@contextlib.contextmanager
+def fork_pool(processes, initializer=None):
+    """Context manager providing a multiprocessing.Pool whose workers are forked from this process.
+
+    Forking means the workers start with the same configuration, loaded modules and (copy-on-write) data as this
+    process. The pool is closed and joined on exit, or terminated if an exception is raised."""
+    if hasattr(multiprocessing, 'get_context'):
+        pool = multiprocessing.get_context('fork').Pool(processes, initializer)
+    else:
+        # python 2, where pools always fork
+        pool = multiprocessing.Pool(processes, initializer)
+    try:
+        yield pool
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
@@ -0,0 +1,111 @@
+from __future__ import absolute_import
+import os
+import threading
+
+from .. import config
+from ..log import logger
+
+
+def _available_and_total_memory():
+    """Return the available and total memory of this node in bytes, or (None, None) if they cannot be determined"""
+    try:
+        with open("/proc/meminfo") as f:
+            meminfo = dict(line.split(":", 1) for line in f)
+        return int(meminfo['MemAvailable'].split()[0])*1024, int(meminfo['MemTotal'].split()[0])*1024
+    except (IOError, OSError, KeyError, ValueError):
+        pass
+    try:
+        page_size = os.sysconf('SC_PAGE_SIZE')
+        return os.sysconf('SC_AVPHYS_PAGES')*page_size, os.sysconf('SC_PHYS_PAGES')*page_size
+    except (ValueError, OSError, AttributeError):
+        return None, None
+
+def _resident_memory():
+    """Return the memory currently used by this process in bytes, or 0 if it cannot be determined"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, IndexError, ValueError):
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+    except (ImportError, AttributeError):
+        return 0
+
+def memory_allows_prefetch():
+    """Return True if loading another timestep is unlikely to exhaust the memory of this node.
+
+    The next timestep is assumed to need about as much memory as this process already uses, and at least
+    config.prefetch_min_available_memory_fraction of the total memory must remain available afterwards. If the
+    memory cannot be measured, prefetching is allowed."""
+    available, total = _available_and_total_memory()
+    if available is None:
+        return True
+    return available - _resident_memory() >= config.prefetch_min_available_memory_fraction*total
+
+
+class TimestepPrefetcher(object):
+    """Loads the data for a timestep in a background thread, so that it is ready by the time it is needed.
+
+    Usage:
+        prefetcher.start(next_db_timestep)
+        ... work on the current timestep ...
+        prefetcher.wait(next_db_timestep)
+        data = next_db_timestep.load(mode)  # returns the copy cached by the input handler
+        extras = prefetcher.take(next_db_timestep)  # keep alive for as long as the timestep is in use
+    """
+    def __init__(self, mode=None, arrays=()):
+        self.mode = mode
+        self.arrays = list(arrays)
+        self._thread = None
+        self._timestep_id = None
+        self._data = None
+
+    def start(self, db_timestep):
+        """Begin loading the data for the timestep, unless memory is short or a prefetch is already underway"""
+        if self._thread is not None:
+            return
+        if not memory_allows_prefetch():
+            logger.info("Not prefetching %r because memory is short", db_timestep)
+            return
+
+        # the database session may not be used from the background thread, so extract everything needed now
+        handler = db_timestep.simulation.get_output_handler()
+        extension = db_timestep.extension
+        self._timestep_id = db_timestep.id
+        logger.info("Prefetching %r", db_timestep)
+        self._thread = threading.Thread(target=self._load, args=(handler, extension))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _load(self, handler, extension):
+        try:
+            self._data = handler.prefetch_timestep(extension, mode=self.mode, arrays=self.arrays)
+        except Exception:
+            # the failure will be encountered again, and reported, when the timestep is loaded for real
+            logger.warning("Failed to prefetch %r; it will be loaded when needed", extension)
+
+    def wait(self, db_timestep):
+        """If the timestep is being prefetched, wait until the load is complete"""
+        if self._thread is not None and self._timestep_id == db_timestep.id:
+            self._thread.join()
+
+    def take(self, db_timestep):
+        """Wait for any prefetch to complete, then hand over the prefetched data if it is for the given timestep.
+
+        The prefetcher drops its own reference, so the caller must keep the returned object alive for as long as the
+        data should remain cached. Returns None if nothing was prefetched for the timestep."""
+        if self._thread is not None:
+            self._thread.join()
+        data = self._data if self._timestep_id == db_timestep.id else None
+        self.release()
+        return data
+
+    def release(self):
+        """Wait for any prefetch to complete, then drop the reference to the prefetched data"""
+        if self._thread is not None:
+            self._thread.join()
+        self._thread = None
+        self._timestep_id = None
+        self._data = None
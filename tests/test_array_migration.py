@@ -0,0 +1,84 @@
+from __future__ import absolute_import
+import zlib
+
+import numpy as np
+from six.moves import cPickle as pickle
+
+import tangos
+import tangos.testing as testing
+import tangos.testing.simulation_generator
+from tangos import log, properties
+from tangos.tools import array_migrator
+
+
+class CompressedArrayProperty(properties.PropertyCalculation):
+    names = "compressed_array"
+    array_compression = 'zlib'
+
+
+def setup():
+    testing.init_blank_db_for_testing()
+
+    generator = tangos.testing.simulation_generator.TestSimulationGenerator()
+    generator.add_timestep()
+    generator.add_objects_to_timestep(3)
+    generator.add_properties_to_halos(native_array=lambda i: np.arange(i, i+5.0),
+                                      compressed_array=lambda i: np.arange(i, i+2000.0),
+                                      default_array=lambda i: np.arange(i, i+2000.0))
+
+    session = tangos.get_default_session()
+    halos = tangos.get_timestep("sim/ts1").halos.all()
+    _set_raw(halos[0], "native_array", b"PX" + pickle.dumps(np.arange(0.0, 5.0)))
+    _set_raw(halos[1], "native_array", b"ZX" + zlib.compress(pickle.dumps(np.arange(1.0, 6.0))))
+    _set_raw(halos[2], "native_array", b"PX" + pickle.dumps([2.0, 3.0]))
+    _set_raw(halos[0], "compressed_array", b"PX" + pickle.dumps(np.arange(0.0, 2000.0)))
+    _set_raw(halos[0], "default_array", b"ZX" + zlib.compress(pickle.dumps(np.arange(0.0, 2000.0))))
+    session.commit()
+
+
+def _set_raw(halo, name, blob):
+    halo.properties.filter_by(name_id=tangos.core.dictionary.get_dict_id(name)).first().data_array = blob
+
+
+def _get_raw(halo, name):
+    return halo.properties.filter_by(name_id=tangos.core.dictionary.get_dict_id(name)).first().data_array
+
+
+def _run_migration(*args):
+    tool = array_migrator.ArrayMigrator()
+    tool.parse_command_line(list(args))
+    with log.LogCapturer():
+        tool.run_calculation_loop()
+
+
+def test_migration():
+    _run_migration("--batch-size", "2")
+
+    halos = tangos.get_timestep("sim/ts1").halos.all()
+    assert _get_raw(halos[0], "native_array").startswith(b"NX")
+    assert _get_raw(halos[1], "native_array").startswith(b"NX")
+    assert _get_raw(halos[2], "native_array").startswith(b"PX")
+    assert _get_raw(halos[0], "compressed_array").startswith(b"NX")
+    assert len(_get_raw(halos[0], "compressed_array")) < 2000*8
+
+    assert np.all(halos[0]["native_array"] == np.arange(0.0, 5.0))
+    assert np.all(halos[1]["native_array"] == np.arange(1.0, 6.0))
+    assert halos[2]["native_array"] == [2.0, 3.0]
+    assert np.all(halos[0]["compressed_array"] == np.arange(0.0, 2000.0))
+    assert _get_raw(halos[0], "default_array").startswith(b"NX")
+    assert len(_get_raw(halos[0], "default_array")) < 2000*8
+    assert np.all(halos[0]["default_array"] == np.arange(0.0, 2000.0))
+
+
+def test_migration_with_decompress():
+    session = tangos.get_default_session()
+    halo = tangos.get_halo("sim/ts1/2")
+    _set_raw(halo, "default_array", b"ZX" + zlib.compress(pickle.dumps(np.arange(1.0, 2001.0))))
+    session.commit()
+
+    _run_migration("--decompress")
+
+    halo = tangos.get_halo("sim/ts1/2")
+    assert _get_raw(halo, "default_array").startswith(b"NX")
+    assert len(_get_raw(halo, "default_array")) > 2000*8
+    assert np.all(halo["default_array"] == np.arange(1.0, 2001.0))
@@ -0,0 +1,105 @@
+from __future__ import absolute_import
+import mmap
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import tangos
+import tangos.config
+import tangos.testing as testing
+import tangos.testing.simulation_generator
+from tangos import log
+from tangos.core import blob_store
+from tangos.tools import blob_compactor
+
+_old_blob_store_path = None
+_old_blob_store_threshold = None
+_old_array_compression = None
+
+def setup():
+    global _old_blob_store_path, _old_blob_store_threshold, _old_array_compression
+    _old_blob_store_path = tangos.config.blob_store_path
+    _old_blob_store_threshold = tangos.config.blob_store_threshold
+    _old_array_compression = tangos.config.default_array_compression
+    tangos.config.blob_store_path = tempfile.mkdtemp()
+    tangos.config.blob_store_threshold = 800
+    tangos.config.default_array_compression = 'none' # only uncompressed arrays go to the blob store
+
+    testing.init_blank_db_for_testing()
+
+    generator = tangos.testing.simulation_generator.TestSimulationGenerator()
+    generator.add_timestep()
+    generator.add_objects_to_timestep(3)
+    generator.add_properties_to_halos(large_array=lambda i: np.arange(i, i+200.0),
+                                      small_array=lambda i: np.arange(i, i+5.0))
+
+def teardown():
+    shutil.rmtree(tangos.config.blob_store_path)
+    tangos.config.blob_store_path = _old_blob_store_path
+    tangos.config.blob_store_threshold = _old_blob_store_threshold
+    tangos.config.default_array_compression = _old_array_compression
+
+
+def _property(halo, name):
+    return halo.properties.filter_by(name_id=tangos.core.dictionary.get_dict_id(name)).first()
+
+def _raw(halo, name):
+    return _property(halo, name).data_array
+
+def _underlying_buffer(array):
+    while isinstance(array, np.ndarray):
+        array = array.base
+    if isinstance(array, memoryview):
+        array = array.obj
+    return array
+
+def test_large_arrays_in_blob_store():
+    halo = tangos.get_halo("sim/ts1/1")
+    assert _raw(halo, "large_array").startswith(b"BX")
+    assert len(_raw(halo, "large_array")) < 100
+    assert _raw(halo, "small_array").startswith(b"NX")
+    assert blob_store.files_for_simulation("sim") == ["sim.0.blobs"]
+
+def test_memory_mapped_retrieval():
+    halo = tangos.get_halo("sim/ts1/2")
+    data = halo["large_array"]
+    assert isinstance(_underlying_buffer(data), mmap.mmap)
+    assert not data.flags.writeable
+    assert np.all(data == np.arange(2, 202.0))
+    assert np.all(halo["small_array"] == np.arange(2, 7.0))
+
+def test_file_map_shared_between_arrays():
+    halo = tangos.get_halo("sim/ts1/3")
+    stored = _property(halo, "large_array")
+    # more arrays than there are usually file descriptors available to a process
+    arrays = [tangos.core.data_attribute_mapper.get_data_of_unknown_type(stored) for i in range(2000)]
+    assert all(_underlying_buffer(a) is _underlying_buffer(arrays[0]) for a in arrays)
+    assert np.all(arrays[-1] == np.arange(3, 203.0))
+
+def test_compaction():
+    session = tangos.get_default_session()
+    ts = tangos.get_timestep("sim/ts1")
+    ts.halos[0]["large_array"] = np.arange(100, 300.0) # supersedes the existing payload, leaving dead space
+    session.commit()
+    size_before = os.path.getsize(os.path.join(tangos.config.blob_store_path, "sim.0.blobs"))
+
+    compactor = blob_compactor.BlobCompactor()
+    compactor.parse_command_line([])
+    with log.LogCapturer():
+        compactor.run_calculation_loop()
+
+    assert blob_store.files_for_simulation("sim") == ["sim.1.blobs"]
+    size_after = os.path.getsize(os.path.join(tangos.config.blob_store_path, "sim.1.blobs"))
+    assert size_after < size_before
+
+    for i, halo in enumerate(ts.halos):
+        expected = np.arange(100, 300.0) if i==0 else np.arange(i+1, i+201.0)
+        assert np.all(halo["large_array"] == expected)
+
+    # new payloads go to the latest generation
+    ts.halos[1]["large_array"] = np.arange(50, 250.0)
+    session.commit()
+    assert blob_store.files_for_simulation("sim") == ["sim.1.blobs"]
+    assert np.all(ts.halos[1]["large_array"] == np.arange(50, 250.0))
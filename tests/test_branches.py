@@ -0,0 +1,161 @@
+from __future__ import absolute_import
+
+import numpy as np
+
+import tangos
+import tangos.relation_finding as halo_finding
+import tangos.testing as testing
+import tangos.testing.simulation_generator
+from tangos import log
+from tangos.relation_finding import branches
+from tangos.tools import branch_builder
+
+
+def setup():
+    testing.init_blank_db_for_testing()
+
+    generator = tangos.testing.simulation_generator.TestSimulationGenerator()
+    generator_2 = tangos.testing.simulation_generator.TestSimulationGenerator("sim2")
+
+    generator.add_timestep()
+    generator_2.add_timestep()
+    generator.add_objects_to_timestep(7)
+    generator_2.add_objects_to_timestep(3)
+
+    generator.add_timestep()
+    generator_2.add_timestep()
+    generator.add_objects_to_timestep(5)
+    generator_2.add_objects_to_timestep(3)
+    generator_2.link_last_halos()
+
+    generator.link_last_halos_using_mapping({1: 2, 2: 1, 3: 3, 4: 4, 6: 5, 7: 5}, adjust_masses=False)
+    generator.add_mass_transfer(1,1,0.1)
+    generator.add_mass_transfer(4,3,0.01)
+
+    generator.add_timestep()
+    generator.add_objects_to_timestep(5)
+    generator.link_last_halos_using_mapping({1: 1, 2: 1, 3: 2, 4: 3, 5: 4})
+    generator.add_mass_transfer(4,2,0.05)
+
+    generator.add_timestep()
+    generator.add_objects_to_timestep(3)
+    generator.link_last_halos_using_mapping({1: 1, 2: 2, 3: 2, 4: 3})
+    generator.add_mass_transfer(2,1,0.2)
+
+
+def _all_halos():
+    return tangos.get_default_session().query(tangos.core.halo.Halo).order_by(tangos.core.halo.Halo.id).all()
+
+def _strategy_results(strategy):
+    all, weights = strategy.all_and_weights()
+    return [(h.id, round(w, 10)) for h, w in zip(all, weights)]
+
+def _tree_results():
+    """Gather results from every query that can be accelerated by the branches"""
+    results = {}
+    for h in _all_halos():
+        results[h.id] = (_strategy_results(halo_finding.MultiHopMajorProgenitorsStrategy(h)),
+                         _strategy_results(halo_finding.MultiHopMajorDescendantsStrategy(h)),
+                         _strategy_results(halo_finding.MultiHopMajorProgenitorsStrategy(h, nhops_max=1)),
+                         h.earliest.id, h.latest.id,
+                         list(h.calculate_for_progenitors("halo_number()")[0]))
+
+    for ts in tangos.get_simulation("sim").timesteps:
+        halos = ts.halos.all()
+        for strategy_class in (halo_finding.multi_source.MultiSourceAllMajorProgenitorsStrategy,
+                               halo_finding.multi_source.MultiSourceAllMajorDescendantsStrategy):
+            strategy = strategy_class(halos)
+            results[(ts.id, strategy_class)] = sorted(zip(strategy.sources(), [h.id for h in strategy.all()]))
+        results[ts.id] = [list(x) for x in ts.calculate_all("halo_number()", "earliest().halo_number()",
+                                                            "latest().halo_number()")]
+    return results
+
+
+def test_branches():
+    h = tangos.get_item("sim/ts4/1")
+    assert not halo_finding.MultiHopMajorProgenitorsStrategy(h)._can_use_branches()
+    expected = _tree_results()
+
+    tool = branch_builder.BranchBuilder()
+    tool.parse_command_line([])
+    with log.LogCapturer():
+        tool.run_calculation_loop()
+
+    assert halo_finding.MultiHopMajorProgenitorsStrategy(h)._can_use_branches()
+    assert halo_finding.MultiHopMajorDescendantsStrategy(tangos.get_item("sim/ts1/1"))._can_use_branches()
+    assert halo_finding.multi_source.MultiSourceAllMajorProgenitorsStrategy([h])._can_use_branches()
+
+    # searches with other rules do not correspond to a branch
+    assert not halo_finding.MultiHopAllProgenitorsStrategy(h)._can_use_branches()
+    assert not halo_finding.MultiHopMostRecentMergerStrategy(h)._can_use_branches()
+    assert not halo_finding.MultiHopStrategy(h, directed='backwards')._can_use_branches()
+
+    assert _tree_results() == expected
+
+
+def test_branches_become_stale():
+    session = tangos.get_default_session()
+    with log.LogCapturer():
+        branches.build_branches(session, tangos.get_simulation("sim"))
+
+    halo = tangos.get_item("sim/ts4/3")
+    target = tangos.get_item("sim/ts3/5")
+
+    relation = tangos.core.dictionary.get_or_create_dictionary_item(session, "ptcls_in_common")
+    session.add(tangos.core.halo_data.HaloLink(halo, target, relation, 2.0))
+    session.add(tangos.core.halo_data.HaloLink(target, halo, relation, 1.0))
+    session.commit()
+
+    assert not halo_finding.MultiHopMajorProgenitorsStrategy(halo)._can_use_branches()
+    expected = _strategy_results(halo_finding.MultiHopMajorProgenitorsStrategy(halo))
+    assert expected == [(target.id, 2.0)]
+
+    with log.LogCapturer():
+        branches.update_stale_branches(session)
+    assert halo_finding.MultiHopMajorProgenitorsStrategy(halo)._can_use_branches()
+    assert _strategy_results(halo_finding.MultiHopMajorProgenitorsStrategy(halo)) == expected
+
+
+def test_chains_cross_branches():
+    # sim/ts2/5 has two predecessors in the major descendant forest; only one of them continues its branch
+    session = tangos.get_default_session()
+    chains = tangos.core.branches.follow_branches(session, tangos.core.branches.MAJOR_DESCENDANT,
+                                                  [tangos.get_item("sim/ts1/6").id, tangos.get_item("sim/ts1/7").id],
+                                                  100)
+    assert len(chains[0]) == len(chains[1]) == 3
+    assert chains[0][0][0] == chains[1][0][0] == tangos.get_item("sim/ts2/5").id
+    assert np.all([a==b for a, b in zip(chains[0], chains[1])])
+
+    rows = session.query(tangos.core.branches.HaloBranch).\
+        filter_by(kind=tangos.core.branches.MAJOR_DESCENDANT).\
+        filter(tangos.core.branches.HaloBranch.halo_id.in_([tangos.get_item("sim/ts1/6").id,
+                                                            tangos.get_item("sim/ts1/7").id])).all()
+    assert rows[0].branch_id != rows[1].branch_id
+
+
+def test_branches_become_stale_for_each_simulation():
+    session = tangos.get_default_session()
+    with log.LogCapturer():
+        branches.build_branches(session, tangos.get_simulation("sim"))
+        branches.build_branches(session, tangos.get_simulation("sim2"))
+    sim_id = tangos.get_simulation("sim").id
+    sim2_id = tangos.get_simulation("sim2").id
+    relation = tangos.core.dictionary.get_or_create_dictionary_item(session, "ptcls_in_common")
+
+    # a link within a timestep is never followed by a branch
+    session.add(tangos.core.halo_data.HaloLink(tangos.get_item("sim/ts1/1"), tangos.get_item("sim/ts1/2"),
+                                               relation, 1.0))
+    session.commit()
+    assert tangos.core.branches.branches_are_current(session, [sim_id, sim2_id])
+
+    session.add(tangos.core.halo_data.HaloLink(tangos.get_item("sim2/ts2/1"), tangos.get_item("sim2/ts1/2"),
+                                               relation, 0.5))
+    session.commit()
+    assert tangos.core.branches.branches_are_current(session, [sim_id])
+    assert not tangos.core.branches.branches_are_current(session, [sim2_id])
+
+    lc = log.LogCapturer()
+    with lc:
+        branches.update_stale_branches(session)
+    assert lc.get_output().count("Updated branches") == 1
+    assert tangos.core.branches.branches_are_current(session, [sim_id, sim2_id])
@@ -110,14 +110,78 @@ def test_array_pack_format():
     target = TestTarget()
     test_data=np.array([1,2,3])
     target.data=test_data
+    assert target.data_array.startswith(b"NX")
+    assert target.data_array.endswith(test_data.tobytes())
+    assert target.data.dtype==test_data.dtype
+    assert np.all(target.data==test_data)
+
+    test_data=[1,2,3]
+    target.data=test_data
     assert target.data_array.startswith(b"PX")
     assert target.data_array.endswith(pickle.dumps(test_data))
 
+def test_array_native_zero_copy():
+    target = TestTarget()
+    test_data = np.arange(24.0).reshape((2,3,4))
+    target.data = test_data
+    retrieved = target.data
+    assert retrieved.shape==(2,3,4)
+    assert np.all(retrieved==test_data)
+    assert not retrieved.flags.owndata
+    assert retrieved.flags.aligned
+
+def test_array_native_read_only():
+    target = TestTarget()
+    target.data = np.arange(10.0)
+    retrieved = target.data
+    assert not retrieved.flags.writeable
+    with assert_raises(ValueError):
+        retrieved[0] = 1.0
+
+    writable = retrieved.copy()
+    writable[0] = 1.0
+    assert writable[0]==1.0
+
+def test_array_native_noncontiguous():
+    target = TestTarget()
+    test_data = np.arange(24.0).reshape((4,6)).T[::2]
+    target.data = test_data
+    assert np.all(target.data==test_data)
+
+def test_array_pickle_fallback():
+    target = TestTarget()
+    for test_data in np.array([1, "two", None], dtype=object), np.zeros(3, dtype=[('x', 'f8'), ('y', 'i4')]):
+        target.data = test_data
+        assert target.data_array.startswith(b"PX")
+        assert np.all(target.data==test_data)
+
+def test_array_compression():
+    class TestTargetWithCompression(TestTarget):
+        array_compression = 'zlib'
+
+    target = TestTargetWithCompression()
     test_data=np.arange(2000)
     target.data=test_data
+    assert target.data_array.startswith(b"NX")
+    assert target.data_array.endswith(zlib.compress(test_data.tobytes()))
+    assert np.all(target.data==test_data)
+
+    target.data=np.arange(10)
+    assert target.data_array.endswith(np.arange(10).tobytes())
+
+    target.data=list(range(2000))
     assert target.data_array.startswith(b"ZX")
-    assert target.data_array.endswith(zlib.compress(pickle.dumps(test_data)))
-    assert np.allclose(target.data, test_data)
+    assert target.data==list(range(2000))
+
+def test_array_legacy_formats():
+    target = TestTarget()
+    test_data=np.array([1,2,3])
+    target.data_array = b"PX"+pickle.dumps(test_data)
+    assert np.all(target.data==test_data)
+
+    test_data=np.arange(2000)
+    target.data_array = b"ZX"+zlib.compress(pickle.dumps(test_data))
+    assert np.all(target.data==test_data)
 
 def test_none():
     target = TestTarget()
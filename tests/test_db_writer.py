@@ -2,12 +2,19 @@ from __future__ import absolute_import
 import tangos as db
 import tangos.config
 import os
+import shutil
+import tempfile
+
+import numpy as np
+
 from tangos.tools import add_simulation
 from tangos.tools import property_writer
 from tangos.input_handlers import output_testing
 from tangos import parallel_tasks, log, testing
 from tangos import properties
 from tangos.util import proxy_object
+from tangos.cached_writer import insert_list
+from tangos.util.fork_pool import fork_pool
 
 def setup():
     parallel_tasks.use('null')
@@ -23,6 +30,14 @@ class DummyProperty(properties.PropertyCalculation):
         return data.time*data.halo,
 
 
+class DummyArrayProperty(properties.PropertyCalculation):
+    names = "dummy_array_property",
+    requires_particle_data = True
+
+    def calculate(self, data, entry):
+        return np.arange(data.halo, data.halo+200.0),
+
+
 class DummyPropertyCausingException(properties.PropertyCalculation):
     names = "dummy_property_with_exception",
     requires_particle_data = True
@@ -74,6 +89,38 @@ def test_parallel_writing():
     _assert_properties_as_expected()
 
 
+def test_parallel_writing_dedicated_writer():
+    init_blank_simulation()
+    parallel_tasks.use('multiprocessing')
+    try:
+        parallel_tasks.launch(run_writer_with_args,3,["dummy_property", "dummy_link", "--dedicated-writer"])
+    finally:
+        parallel_tasks.use('null')
+    _assert_properties_as_expected()
+    assert db.get_default_session().query(db.core.HaloLink).count() == 15
+    db.testing.assert_halolists_equal([db.get_halo(2)['dummy_link']], [db.get_halo(1)])
+
+
+def test_parallel_writing_dedicated_writer_to_blob_store():
+    init_blank_simulation()
+    old_settings = (db.config.blob_store_path, db.config.blob_store_threshold, db.config.default_array_compression)
+    db.config.blob_store_path = tempfile.mkdtemp()
+    db.config.blob_store_threshold = 800
+    db.config.default_array_compression = 'none' # only uncompressed arrays go to the blob store
+    parallel_tasks.use('multiprocessing')
+    try:
+        parallel_tasks.launch(run_writer_with_args,3,["dummy_array_property", "--dedicated-writer"])
+        halo = db.get_halo("dummy_sim_1/step.1/2")
+        raw = halo.properties.filter_by(name_id=db.core.dictionary.get_dict_id("dummy_array_property")).first()
+        assert raw.data_array.startswith(b"BX")
+        assert np.all(halo['dummy_array_property'] == np.arange(2, 202.0))
+        assert len(db.core.blob_store.files_for_simulation("dummy_sim_1")) > 0
+    finally:
+        parallel_tasks.use('null')
+        shutil.rmtree(db.config.blob_store_path)
+        db.config.blob_store_path, db.config.blob_store_threshold, db.config.default_array_compression = old_settings
+
+
 def _assert_properties_as_expected():
     assert db.get_halo("dummy_sim_1/step.1/1")['dummy_property'] == 1.0
     assert db.get_halo("dummy_sim_1/step.1/2")['dummy_property'] == 2.0
@@ -112,6 +159,31 @@ def test_region_property():
     _assert_properties_as_expected()
     assert db.get_halo("dummy_sim_1/step.2/1")['dummy_region_property']==100.0
 
+class DummyRegionProperty2(DummyRegionProperty):
+    names = "dummy_region_property_2",
+
+    def calculate(self, data, entry):
+        return 200.0,
+
+def test_region_shared_between_properties():
+    init_blank_simulation()
+    regions_loaded = []
+    original_load_region = output_testing.TestInputHandler.load_region
+
+    def counting_load_region(self, ts_extension, region_specification, mode=None):
+        regions_loaded.append(ts_extension)
+        return original_load_region(self, ts_extension, region_specification, mode)
+
+    output_testing.TestInputHandler.load_region = counting_load_region
+    try:
+        # the region properties are run together, after the property they require, despite the order given
+        run_writer_with_args("dummy_region_property", "dummy_property", "dummy_region_property_2", "--with-prerequisites")
+    finally:
+        output_testing.TestInputHandler.load_region = original_load_region
+    assert db.get_halo("dummy_sim_1/step.2/1")['dummy_region_property']==100.0
+    assert db.get_halo("dummy_sim_1/step.2/1")['dummy_region_property_2']==200.0
+    assert len(regions_loaded)==db.get_default_session().query(db.core.Halo).count()
+
 def test_no_duplication():
     init_blank_simulation()
     run_writer_with_args("dummy_property")
@@ -141,6 +213,16 @@ def test_link_property():
     assert db.get_default_session().query(db.core.HaloLink).count() == 15
     db.testing.assert_halolists_equal([db.get_halo(2)['dummy_link']], [db.get_halo(1)])
 
+def test_bulk_insert():
+    init_blank_simulation()
+    log = run_writer_with_args("dummy_property", "dummy_link", "--bulk-insert")
+    assert "bulk path" in log
+    _assert_properties_as_expected()
+    assert db.get_default_session().query(db.core.HaloProperty).count() == 15
+    assert db.get_default_session().query(db.core.HaloLink).count() == 15
+    db.testing.assert_halolists_equal([db.get_halo(2)['dummy_link']], [db.get_halo(1)])
+    assert db.get_default_session().query(db.core.HaloProperty).first().creator_id is not None
+
 def test_link_dependency():
     init_blank_simulation()
     run_writer_with_args("dummy_property_requiring_link")
@@ -163,3 +245,150 @@ def test_writer_sees_raw_properties():
 
     DummyPropertyWithReconstruction.callback = raise_exception
     run_writer_with_args("dummy_property_with_reconstruction") # should not try to reconstruct the existing data stream
+
+def test_prefetch():
+    init_blank_simulation()
+    loaded = []
+    original_load = output_testing.TestInputHandler.load_timestep_without_caching
+
+    def counting_load(self, ts_extension, mode=None):
+        loaded.append(ts_extension)
+        return original_load(self, ts_extension, mode)
+
+    output_testing.TestInputHandler.load_timestep_without_caching = counting_load
+    try:
+        log = run_writer_with_args("dummy_property", "--prefetch")
+    finally:
+        output_testing.TestInputHandler.load_timestep_without_caching = original_load
+    assert "Prefetching" in log
+    _assert_properties_as_expected()
+    # each timestep is loaded once, whether by the prefetcher or by the writer itself
+    assert sorted(loaded)==sorted(set(loaded))
+    assert len(loaded)==len(db.get_simulation("dummy_sim_1").timesteps)
+
+def test_prefetch_memory_guard():
+    init_blank_simulation()
+    original_fraction = tangos.config.prefetch_min_available_memory_fraction
+    tangos.config.prefetch_min_available_memory_fraction = 1.0
+    try:
+        log = run_writer_with_args("dummy_property", "--prefetch")
+    finally:
+        tangos.config.prefetch_min_available_memory_fraction = original_fraction
+    assert "Not prefetching" in log
+    _assert_properties_as_expected()
+
+def test_no_prefetch_without_particle_data():
+    init_blank_simulation()
+    log = run_writer_with_args("dummy_property_with_reconstruction", "--prefetch")
+    assert "Prefetching" not in log
+
+def test_fork_load_mode():
+    init_blank_simulation()
+    log = run_writer_with_args("dummy_property", "dummy_link", "--load-mode", "fork", "--fork-workers", "2")
+    assert "Forking 2 workers" in log
+    assert "Succeeded: 20 property calculations" in log # counted in the workers and reported by the parent
+    _assert_properties_as_expected()
+    assert db.get_default_session().query(db.core.HaloProperty).count() == 15
+    assert db.get_default_session().query(db.core.HaloLink).count() == 15
+    db.testing.assert_halolists_equal([db.get_halo(2)['dummy_link']], [db.get_halo(1)])
+
+def test_fork_load_mode_prefetches_arrays():
+    prefetched_arrays = []
+    original_prefetch = output_testing.TestInputHandler.prefetch_timestep
+
+    def recording_prefetch(self, ts_extension, mode=None, arrays=()):
+        prefetched_arrays.append(list(arrays))
+        return original_prefetch(self, ts_extension, mode, arrays)
+
+    output_testing.TestInputHandler.prefetch_timestep = recording_prefetch
+    try:
+        init_blank_simulation()
+        run_writer_with_args("dummy_property", "--load-mode", "fork", "--fork-workers", "2")
+        # without --prefetch-arrays, the arrays that calculations typically need are read before forking
+        assert prefetched_arrays==[tangos.config.fork_prefetch_arrays]*2
+
+        del prefetched_arrays[:]
+        init_blank_simulation()
+        run_writer_with_args("dummy_property", "--load-mode", "fork", "--fork-workers", "2",
+                             "--prefetch-arrays", "temp")
+        assert prefetched_arrays==[["temp"]]*2
+    finally:
+        output_testing.TestInputHandler.prefetch_timestep = original_prefetch
+    _assert_properties_as_expected()
+
+def _connection_pid(_):
+    connection = db.core.get_default_session().connection().connection
+    return connection._connection_record.info['pid'], os.getpid()
+
+def test_forked_workers_use_own_connections():
+    init_blank_simulation()
+    db.get_simulation("dummy_sim_1") # the parent holds a connection, as it does while writing
+    with fork_pool(2, db.core.use_new_session_after_fork) as pool:
+        for connection_pid, worker_pid in pool.map(_connection_pid, range(4)):
+            assert connection_pid==worker_pid!=os.getpid()
+    # the parent's connection must be unaffected
+    assert db.get_default_session().connection().connection._connection_record.info['pid']==os.getpid()
+    assert len(db.get_simulation("dummy_sim_1").timesteps)==2
+
+def test_restart_skips_completed_halos():
+    init_blank_simulation()
+    run_writer_with_args("dummy_property", "--hmax", "2")
+    num_partial = db.get_default_session().query(db.core.HaloProperty).count()
+    assert 0 < num_partial < 15
+
+    log = run_writer_with_args("dummy_property")
+    assert "halos already have all the requested properties and will be skipped" in log
+    _assert_properties_as_expected()
+    assert db.get_default_session().query(db.core.HaloProperty).count() == 15
+
+    loaded = []
+    original_load = output_testing.TestInputHandler.load_timestep_without_caching
+
+    def counting_load(self, ts_extension, mode=None):
+        loaded.append(ts_extension)
+        return original_load(self, ts_extension, mode)
+
+    output_testing.TestInputHandler.load_timestep_without_caching = counting_load
+    try:
+        log = run_writer_with_args("dummy_property", "dummy_link")
+        assert len(loaded)>0 # dummy_link has not yet been calculated
+        del loaded[:]
+        log = run_writer_with_args("dummy_property", "dummy_link")
+    finally:
+        output_testing.TestInputHandler.load_timestep_without_caching = original_load
+    assert "Gathering existing properties" not in log
+    assert len(loaded)==0
+    assert db.get_default_session().query(db.core.HaloLink).count() == 15
+
+def test_existing_property_matrix():
+    init_blank_simulation()
+    run_writer_with_args("dummy_property", "dummy_link")
+    halos = db.get_timestep("dummy_sim_1/step.2").halos.order_by(db.core.Halo.halo_number).all()
+    names = ["dummy_link", "dummy_property", "never_calculated"]
+
+    with testing.SqlExecutionTracker(db.core.get_default_engine()) as track:
+        existing = property_writer.ExistingPropertyMatrix(halos, names)
+    assert track.count_statements_containing("haloproperties")==1 # one query finds both properties and links
+
+    assert existing.present[:,:2].all()
+    assert not existing.present[:,2].any()
+    assert (existing.link_target_ids[:,0]==db.get_halo("dummy_sim_1/step.2/1").id).all()
+    assert (existing.link_target_ids[:,1:]==-1).all()
+    assert existing.all_present(["dummy_property", "dummy_link"]).all()
+    assert not existing.all_present(["dummy_property", "never_calculated"]).any()
+
+    properties_1, properties_3 = existing.existing_properties([0, 2])
+    assert properties_1['dummy_property']==halos[0]['dummy_property']
+    assert properties_3['dummy_property']==halos[2]['dummy_property']
+    assert properties_3['dummy_link']==db.get_halo("dummy_sim_1/step.2/1")
+    assert properties_3.halo_number==properties_3['halo_number']==3
+    assert 'never_calculated' not in properties_3
+
+def test_bulk_insert_queries():
+    init_blank_simulation()
+    halos = db.get_timestep("dummy_sim_1/step.2").halos.all()
+    db.get_default_session().commit() # expires the halos, as happens between batches in a writer
+    with testing.SqlExecutionTracker(db.core.get_default_engine()) as track:
+        # the dictionary item is new, so is created (and committed) during the insert
+        insert_list([(h, "bulk_inserted_property", 1.0) for h in halos], bulk=True)
+    assert track.count_statements_containing("SELECT") <= 5
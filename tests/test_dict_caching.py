@@ -14,4 +14,32 @@ def test_set():
     bh_obj = tangos.core.dictionary.get_or_create_dictionary_item(db.core.get_default_session(), "BH")
     assert bh_obj is not None
     bh_obj2 = tangos.core.dictionary.get_or_create_dictionary_item(db.core.get_default_session(), "BH")
-    assert bh_obj2 is bh_obj
\ No newline at end of file
+    assert bh_obj2 is bh_obj
+
+def test_bulk_create_and_lookup():
+    session = db.core.get_default_session()
+    with testing.SqlExecutionTracker(db.core.get_default_engine()) as track:
+        objs = tangos.core.dictionary.get_or_create_dictionary_items(session, ["bulk_a", "bulk_b", "BH"])
+    assert track.count_statements_containing("select")==1 # a single query for all the existing items
+    assert [o.text for o in objs]==["bulk_a", "bulk_b", "BH"]
+
+    with testing.SqlExecutionTracker(db.core.get_default_engine()) as track:
+        ids = tangos.core.dictionary.get_dict_ids(["bulk_a", "bulk_b", "BH", "bulk_nonexistent"], None)
+    assert ids[:3]==[o.id for o in objs]
+    assert ids[3] is None
+    assert track.count<=1 # only the nonexistent item needs to be queried
+
+def test_cache_shared_between_sessions():
+    tangos.core.dictionary.get_or_create_dictionary_items(db.core.get_default_session(), ["shared_a"])
+    session = db.core.Session()
+    try:
+        with testing.SqlExecutionTracker(db.core.get_default_engine()) as track:
+            assert tangos.core.dictionary.get_dict_id("shared_a", session=session) is not None
+        assert track.count==0
+    finally:
+        session.close()
+
+def test_invalidation():
+    tangos.core.dictionary.get_dict_id("BH") # populate the cache
+    testing.init_blank_db_for_testing()
+    assert tangos.core.dictionary.get_dict_id("BH", None) is None
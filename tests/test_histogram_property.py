@@ -23,6 +23,13 @@ def setup():
 
     _setup_dummy_histogram_data(ts1, ts2)
 
+    ts3 = generator.add_timestep()
+    generator.add_objects_to_timestep(3)
+    generator.link_last_halos_using_mapping({1:2})
+    _setup_dummy_histogram_data_for_batching(ts3)
+
+    _setup_long_branch()
+
 
 
 def _setup_dummy_histogram_data(ts1, ts2):
@@ -39,6 +46,32 @@ def _setup_dummy_histogram_data(ts1, ts2):
     db.core.get_default_session().commit()
 
 
+def _setup_dummy_histogram_data_for_batching(ts3):
+    # sim/ts3/1 has no progenitor; sim/ts3/2 has a two-step major progenitor branch; sim/ts3/3 has no histogram
+    property = DummyHistogramProperty(db.get_simulation("sim"))
+    db.get_halo("sim/ts3/1")['dummy_histogram'] = test_histogram[property.store_slice(ts3.time_gyr)] * 2.0
+    db.get_halo("sim/ts3/2")['dummy_histogram'] = test_histogram[property.store_slice(ts3.time_gyr)]
+    db.core.get_default_session().commit()
+
+
+def _setup_long_branch():
+    # two halos per step along a branch of more than config.num_multihops_max_default steps
+    global long_histogram
+    generator = tangos.testing.simulation_generator.TestSimulationGenerator("long_sim")
+    long_histogram = np.arange(1.0, 2000.0)
+    for i in range(120):
+        ts = generator.add_timestep()
+        generator.add_objects_to_timestep(2)
+        if i==0:
+            generator.sim["histogram_delta_t_Gyr"] = 0.1
+            property = DummyHistogramProperty(generator.sim)
+        else:
+            generator.link_last_halos()
+        for halo in ts.halos:
+            halo['dummy_histogram'] = long_histogram[property.store_slice(ts.time_gyr)]
+    db.core.get_default_session().commit()
+
+
 class DummyHistogramProperty(properties.TimeChunkedProperty):
     minimum_store_Gyr = 1.0
     names = "dummy_histogram"
@@ -127,7 +160,48 @@ def test_summed_reconstruction_across_simulations():
 
     finally:
         ts2.simulation = db.query.get_simulation("sim")
+        session.commit()
+
+
+def test_batched_reconstruction():
+    ts3 = db.get_timestep("sim/ts3")
+    halo_numbers, batched = ts3.calculate_all("halo_number()", "dummy_histogram")
+    assert list(halo_numbers) == [1, 2]
+    assert len(batched[0]) == len(batched[1]) == int(ts3.time_gyr/DummyHistogramProperty.pixel_delta_t_Gyr)
+
+    for halo_number, reconstructed in zip(halo_numbers, batched):
+        halo = ts3.halos.filter_by(halo_number=int(halo_number)).first()
+        npt.assert_almost_equal(reconstructed, halo.get_objects("dummy_histogram")[0].
+                                get_data_with_reassembly_options('major'))
+
+    npt.assert_almost_equal(batched[1], test_histogram[:len(batched[1])])
+
+def test_batched_reconstruction_options():
+    ts3 = db.get_timestep("sim/ts3")
+    placed, = ts3.calculate_all("reassemble(dummy_histogram, 'place')")
+    raw, = ts3.calculate_all("raw(dummy_histogram)")
+    for placed_i, raw_i in zip(placed, raw):
+        npt.assert_almost_equal(placed_i[-len(raw_i):], raw_i)
+        assert not np.any(placed_i[:-len(raw_i)])
+
+def test_batched_reconstruction_optimized():
+    ts3 = db.get_timestep("sim/ts3")
+    with testing.SqlExecutionTracker(db.core.get_default_engine()) as track:
+        ts3.calculate_all("dummy_histogram")
+
+    # no merger tree probe should be made for individual halos; the branches are followed for all halos together,
+    # using one temp table to look up their simulations and another to gather all the stored chunks
+    assert track.count_statements_containing("create temporary table") <= 2
+
 
+def test_batched_reconstruction_along_long_branch():
+    ts = db.get_timestep("long_sim/ts120")
+    batched, = ts.calculate_all("dummy_histogram")
+    assert len(batched) == 2
+    # the whole branch must be followed, as it is for a single halo
+    npt.assert_almost_equal(batched[0], long_histogram[:len(batched[0])])
+    npt.assert_almost_equal(batched[0], ts.halos.first().get_objects("dummy_histogram")[0].
+                            get_data_with_reassembly_options('major'))
 
 def test_custom_delta_t():
     try:
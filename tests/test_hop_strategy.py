@@ -367,4 +367,31 @@ def test_merging():
     print(source,dest)
     assert np.all(source==[1,2,3,4,5,6,7])
     testing.assert_halolists_equal(dest, ['sim/ts3/1', 'sim/ts3/1', 'sim/ts3/2', 'sim/ts3/3', 'sim/ts1/5',
-                                          'sim/ts3/4', 'sim/ts3/4'])
\ No newline at end of file
+                                          'sim/ts3/4', 'sim/ts3/4'])
+
+def test_recursive_cte_matches_temp_tables():
+    def results(engine, strategy_class, halo, **kwargs):
+        all, weights = strategy_class(halo, engine=engine, **kwargs).all_and_weights()
+        return sorted((h.id, round(w, 10)) for h, w in zip(all, weights))
+
+    cases = [(halo_finding.MultiHopStrategy, "sim/ts3/1", dict(directed='backwards', combine_routes=False)),
+             (halo_finding.MultiHopStrategy, "sim/ts3/1", dict(directed=None, combine_routes=False, nhops_max=3)),
+             (halo_finding.MultiHopStrategy, "sim/ts1/1", dict(directed='forwards', combine_routes=False,
+                                                              min_onehop_reverse_weight=0.05)),
+             (halo_finding.MultiHopMajorProgenitorsStrategy, "sim/ts3/1", {}),
+             (halo_finding.MultiHopMajorProgenitorsStrategy, "sim/ts3/3", {}),
+             (halo_finding.MultiHopMajorDescendantsStrategy, "sim/ts1/1", {}),
+             (halo_finding.MultiHopMajorDescendantsStrategy, "sim/ts1/4", {})]
+
+    for strategy_class, halo, kwargs in cases:
+        halo = tangos.get_item(halo)
+        assert strategy_class(halo, **kwargs)._can_use_recursive_cte()
+        assert results('sql', strategy_class, halo, **kwargs) == results('temp_tables', strategy_class, halo, **kwargs)
+
+def test_recursive_cte_not_used_when_routes_combine():
+    halo = tangos.get_item("sim/ts3/1")
+    assert not halo_finding.MultiHopStrategy(halo, directed='backwards')._can_use_recursive_cte()
+    assert not halo_finding.MultiHopAllProgenitorsStrategy(halo)._can_use_recursive_cte()
+    assert not halo_finding.MultiHopMostRecentMergerStrategy(halo)._can_use_recursive_cte()
+    assert not halo_finding.MultiHopStrategy(halo, directed='across', combine_routes=False)._can_use_recursive_cte()
+    assert not halo_finding.MultiHopMajorProgenitorsStrategy(halo, engine='temp_tables')._can_use_recursive_cte()
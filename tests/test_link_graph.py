@@ -0,0 +1,145 @@
+from __future__ import absolute_import
+
+from nose.tools import assert_raises
+
+import tangos
+import tangos.relation_finding as halo_finding
+import tangos.testing as testing
+import tangos.testing.simulation_generator
+from tangos import config
+from tangos.relation_finding import link_graph
+
+
+def setup():
+    testing.init_blank_db_for_testing()
+
+    generator = tangos.testing.simulation_generator.TestSimulationGenerator()
+    generator_2 = tangos.testing.simulation_generator.TestSimulationGenerator("sim2")
+
+    generator.add_timestep()
+    generator_2.add_timestep()
+    generator.add_objects_to_timestep(7)
+
+    generator.add_timestep()
+    generator_2.add_timestep()
+    generator.add_objects_to_timestep(5)
+    generator_2.add_objects_to_timestep(2)
+
+    generator_2.link_last_halos_across_using_mapping(generator, {1:2, 2:1})
+
+    generator.link_last_halos_using_mapping({1: 2, 2: 1, 3: 3, 4: 4, 6: 5, 7: 5}, adjust_masses=False)
+    generator.add_mass_transfer(1,1,0.1)
+    generator.add_mass_transfer(4,3,0.01)
+
+    generator.add_timestep()
+    generator.add_objects_to_timestep(5)
+    generator.link_last_halos_using_mapping({1: 1, 2: 1, 3: 2, 4: 3, 5: 4})
+    generator.add_mass_transfer(4,2,0.05)
+
+    generator.add_timestep()
+    generator.add_objects_to_timestep(3)
+    generator.link_last_halos_using_mapping({1: 1, 2: 2, 3: 2, 4: 3})
+    generator.add_mass_transfer(2,1,0.2)
+
+
+def _results(strategy_class, halo, **kwargs):
+    all, weights = strategy_class(halo, **kwargs).all_and_weights()
+    return [(h.id, round(w, 10)) for h, w in zip(all, weights)]
+
+def _assert_engines_agree(strategy_class, halo, **kwargs):
+    sql_results = _results(strategy_class, halo, engine='sql', **kwargs)
+    graph_results = _results(strategy_class, halo, engine='link_graph', **kwargs)
+    assert sorted(sql_results)==sorted(graph_results), (sql_results, graph_results)
+    return graph_results
+
+def _all_halos(ts):
+    return tangos.get_timestep(ts).halos.order_by(tangos.core.halo.Halo.halo_number).all()
+
+def test_backwards_and_forwards():
+    for halo in _all_halos("sim/ts4"):
+        _assert_engines_agree(halo_finding.MultiHopStrategy, halo, directed='backwards')
+        _assert_engines_agree(halo_finding.MultiHopStrategy, halo, directed='backwards', nhops_max=2)
+        _assert_engines_agree(halo_finding.MultiHopStrategy, halo, directed='backwards', combine_routes=False)
+        _assert_engines_agree(halo_finding.MultiHopStrategy, halo, directed='backwards', min_aggregated_weight=0.5)
+        _assert_engines_agree(halo_finding.MultiHopStrategy, halo, directed='backwards', min_onehop_weight=0.15,
+                              min_onehop_reverse_weight=0.05)
+
+    for halo in _all_halos("sim/ts1"):
+        _assert_engines_agree(halo_finding.MultiHopStrategy, halo, directed='forwards')
+        _assert_engines_agree(halo_finding.MultiHopStrategy, halo, directed='forwards', combine_routes=False,
+                              include_startpoint=True)
+
+def test_variants():
+    for halo in _all_halos("sim/ts4"):
+        _assert_engines_agree(halo_finding.MultiHopAllProgenitorsStrategy, halo)
+        _assert_engines_agree(halo_finding.MultiHopMajorProgenitorsStrategy, halo)
+        _assert_engines_agree(halo_finding.MultiHopMostRecentMergerStrategy, halo)
+
+    for halo in _all_halos("sim/ts1"):
+        _assert_engines_agree(halo_finding.MultiHopMajorDescendantsStrategy, halo)
+
+def test_major_progenitors_result():
+    results = _assert_engines_agree(halo_finding.MultiHopMajorProgenitorsStrategy, tangos.get_item("sim/ts4/1"))
+    assert [r[0] for r in results] == [tangos.get_item(x).id for x in ("sim/ts3/1", "sim/ts2/1", "sim/ts1/2")]
+
+def test_falls_back_to_sql():
+    halo = tangos.get_item("sim/ts2/1")
+    _assert_engines_agree(halo_finding.MultiHopStrategy, halo, directed='across')
+    _assert_engines_agree(halo_finding.MultiHopStrategy, halo, directed=None, nhops_max=2)
+    _assert_engines_agree(halo_finding.MultiHopStrategy, halo, directed='backwards', one_simulation=False)
+    assert not halo_finding.MultiHopStrategy(halo, directed='across', engine='link_graph')._can_use_link_graph()
+    assert halo_finding.MultiHopStrategy(halo, directed='backwards', engine='link_graph')._can_use_link_graph()
+    assert not halo_finding.MultiSourceMultiHopStrategy(tangos.get_timestep("sim/ts2").halos.all(),
+                                                       tangos.get_timestep("sim/ts1"),
+                                                       engine='link_graph')._can_use_link_graph()
+
+def test_default_engine():
+    halo = tangos.get_item("sim/ts4/2")
+    old_default = config.default_multihop_engine
+    try:
+        config.default_multihop_engine = 'link_graph'
+        assert halo_finding.MultiHopStrategy(halo, directed='backwards')._engine == 'link_graph'
+    finally:
+        config.default_multihop_engine = old_default
+    assert halo_finding.MultiHopStrategy(halo, directed='backwards')._engine == 'sql'
+
+    with assert_raises(ValueError):
+        halo_finding.MultiHopStrategy(halo, directed='backwards', engine='nonexistent')
+
+def test_graph_cache_tracks_new_links():
+    session = tangos.get_default_session()
+    sim_id = tangos.get_simulation("sim").id
+    graph = link_graph.get_link_graph(session, sim_id)
+    assert link_graph.get_link_graph(session, sim_id) is graph
+
+    halo = tangos.get_item("sim/ts4/3")
+    before = _results(halo_finding.MultiHopStrategy, halo, directed='backwards', engine='link_graph')
+
+    target = tangos.get_item("sim/ts3/5")
+    relation = tangos.core.dictionary.get_or_create_dictionary_item(session, "ptcls_in_common")
+    session.add(tangos.core.halo_data.HaloLink(halo, target, relation, 0.3))
+    session.commit()
+
+    assert link_graph.get_link_graph(session, sim_id) is not graph
+    after = _assert_engines_agree(halo_finding.MultiHopStrategy, halo, directed='backwards')
+    assert (target.id, 0.3) in after
+    assert len(after)==len(before)+1
+
+def test_graph_cache_is_bounded_and_cheap_to_validate():
+    session = tangos.get_default_session()
+    sim_id = tangos.get_simulation("sim").id
+    sim2_id = tangos.get_simulation("sim2").id
+    graph = link_graph.get_link_graph(session, sim_id)
+
+    with testing.SqlExecutionTracker(tangos.core.get_default_engine()) as track:
+        assert link_graph.get_link_graph(session, sim_id) is graph
+    assert track.count_statements_containing("count(")==0
+
+    original_max = link_graph._MAX_CACHED_GRAPHS
+    link_graph._MAX_CACHED_GRAPHS = 1
+    try:
+        link_graph.get_link_graph(session, sim2_id)
+        assert len(link_graph._graphs)==1
+        assert link_graph.get_link_graph(session, sim_id) is not graph
+    finally:
+        link_graph._MAX_CACHED_GRAPHS = original_max
@@ -277,4 +277,60 @@ def test_non_existent_redirection_multihalo():
     # See issue #46
     vals1, vals2 = tangos.get_timestep("sim/ts3").calculate_all("BH_mass","later(1).BH_mass")
     assert len(vals1)==0
-    assert len(vals2)==0
\ No newline at end of file
+    assert len(vals2)==0
+
+def test_batch_live_calculation():
+    ts = tangos.get_timestep("sim/ts1")
+    for_all = ts.calculate_all("dbid()", "t()", "step_path()", "path()", sanitize=False)
+    for dbid, t, step_path, path in zip(*for_all):
+        h = tangos.get_halo(dbid)
+        assert (t, step_path, path) == (h.calculate("t()"), h.calculate("step_path()"), h.calculate("path()"))
+
+    # only sim/ts1/1 has dummy_property_1, so sim/ts1/2 must be omitted
+    for expression in ("at(3.05,dummy_property_1)", "at(9.85,dummy_property_1)", "max(dummy_property_1)",
+                       "posmax(dummy_property_1)", "posmin(dummy_property_1*(-1))", "abs(at(3.0,dummy_property_2))"):
+        dbids, values = ts.calculate_all("dbid()", expression, object_type='halo')
+        assert list(dbids) == [1]
+        assert np.allclose(values[0], tangos.get_halo(1).calculate(expression))
+
+    # out of range
+    assert len(ts.calculate_all("at(30.0,dummy_property_1)")[0]) == 0
+
+    values, = ts.calculate_all("at(3.0,property_with_custom_interpolator())", object_type='halo')
+    assert np.allclose(values, 3.0)
+
+def test_batch_live_calculation_overridden():
+    class IntrinsicPropertiesWithCustomCalculation(properties.intrinsic.IntrinsicProperties):
+        def live_calculate(self, halo):
+            return super(IntrinsicPropertiesWithCustomCalculation, self).live_calculate(halo)
+
+    assert properties.intrinsic.IntrinsicProperties(None).has_live_calculate_batch()
+    assert not IntrinsicPropertiesWithCustomCalculation(None).has_live_calculate_batch()
+    assert not DummyPropertyArray(None).has_live_calculate_batch()
+
+def test_extraction_pattern_index():
+    from sqlalchemy.orm import joinedload
+    new_name = tangos.core.get_or_create_dictionary_item(db.core.get_default_session(), "dummy_property_for_index")
+    session = db.core.Session()
+    try:
+        halo = session.query(tangos.core.halo.Halo).options(joinedload(tangos.core.halo.Halo.all_properties)).\
+            filter_by(id=tangos.get_halo("sim/ts1/1").id).first()
+        getter = extraction_patterns.HaloPropertyGetter()
+        assert getter.use_fixed_cache(halo)
+        property_id = tangos.core.get_dict_id("dummy_property_1")
+        assert getter.cache_contains(halo, property_id)
+        assert [x.name_id for x in getter.get_from_cache(halo, property_id)] == [property_id]
+        assert not getter.cache_contains(halo, new_name.id)
+
+        # the index is built once...
+        index = getter._cache_index(halo)
+        assert getter._cache_index(halo) is index
+
+        # ...but rebuilt if the cached properties change
+        tangos.core.halo_data.HaloProperty(halo, session.merge(new_name), 1.0)
+        session.flush()
+        assert getter.cache_contains(halo, new_name.id)
+        assert getter._cache_index(halo) is not index
+    finally:
+        session.rollback()
+        session.close()
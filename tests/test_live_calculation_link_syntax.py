@@ -131,6 +131,18 @@ def test_historical_value_finding():
     assert_halolists_equal(db.get_timestep("sim/ts1").calculate_all("find_descendant(testval, 'min')")[0],
                            ["sim/ts3/1", "sim/ts1/3", "sim/ts1/4", "sim/ts1/5"])
 
+def test_historical_value_selection_matches_argmin_argmax():
+    from tangos.live_calculation.builtin_functions import search
+    np.random.seed(1)
+    sources = np.random.randint(0, 20, 500)
+    for values in (np.random.randint(0, 5, 500), np.random.uniform(size=500), np.random.uniform(size=500) > 0.5):
+        if values.dtype.kind=='f':
+            values[::37] = np.nan
+        for criterion in ('min', 'max'):
+            vectorised = search._select_per_source_vectorised(sources, search._as_typed_array(list(values)), criterion)
+            looped = search._select_per_source(sources, list(values), criterion)
+            assert vectorised==looped
+
 def test_historical_value_finding_missing_data():
     sources, targets = db.get_timestep("sim/ts3").calculate_all("path()", "find_progenitor(testvalpartial, 'max')")
     assert_halolists_equal(sources, ["sim/ts3/1", "sim/ts3/2"])
@@ -4,7 +4,9 @@ import tangos.testing.simulation_generator
 from tangos import parallel_tasks as pt
 from tangos import testing
 import tangos
+import os
 import sys
+import tempfile
 import time
 from six.moves import range
 
@@ -15,6 +17,8 @@ def setup():
     generator = tangos.testing.simulation_generator.TestSimulationGenerator()
     generator.add_timestep()
     generator.add_objects_to_timestep(9)
+    generator.add_timestep()
+    generator.add_objects_to_timestep(3)
 
     tangos.core.get_default_session().commit()
 
@@ -145,4 +149,57 @@ def _test_shared_locks_in_queue():
 
 def test_shared_locks():
     pt.launch(_test_shared_locks,4)
-    pt.launch(_test_shared_locks_in_queue, 6)
\ No newline at end of file
+    pt.launch(_test_shared_locks_in_queue, 6)
+
+
+def _test_calculate_all_timesteps():
+    results = tangos.get_simulation("sim").calculate_all_timesteps("halo_number()")
+    # every process receives all the results, including those calculated elsewhere
+    assert [list(halo_numbers) for halo_numbers, in results.values()]==[list(range(1,10)), [1,2,3]]
+
+def test_calculate_all_timesteps():
+    pt.launch(_test_calculate_all_timesteps, 3)
+
+
+def _test_dedicated_writer_chunks():
+    for halo in tangos.get_timestep("sim/ts1").halos.all():
+        pt.database.send_properties_to_writer([(halo, "writer_test_%d"%pt.backend.rank(), halo.halo_number)])
+        time.sleep(0.01)
+
+def test_dedicated_writer_handles_messages_between_chunks():
+    from tangos.parallel_tasks import database
+    events_file = tempfile.NamedTemporaryFile(mode='r', suffix='.txt', delete=False).name
+    original_write_rows = database._write_rows
+    original_process = database.MessageBufferProperties.process
+    original_sizes = tangos.config.dedicated_writer_batch_size, tangos.config.dedicated_writer_chunk_size
+
+    # the patches are inherited by the forked server process, which records whether a flush was underway
+    # whenever properties arrive from a client
+    def slow_write_rows(rows):
+        time.sleep(0.02)
+        original_write_rows(rows)
+
+    def recording_process(self):
+        with open(events_file, 'a') as f:
+            f.write("%d %d\n"%(self.source, database._num_properties_due>0))
+        original_process(self)
+
+    database._write_rows = slow_write_rows
+    database.MessageBufferProperties.process = recording_process
+    tangos.config.dedicated_writer_batch_size, tangos.config.dedicated_writer_chunk_size = 4, 1
+    try:
+        pt.launch(_test_dedicated_writer_chunks, 3)
+    finally:
+        database._write_rows = original_write_rows
+        database.MessageBufferProperties.process = original_process
+        tangos.config.dedicated_writer_batch_size, tangos.config.dedicated_writer_chunk_size = original_sizes
+
+    with open(events_file) as f:
+        events = [line.split() for line in f]
+    os.remove(events_file)
+    sources_sending_during_flush = set(source for source, flushing in events if flushing=="1")
+    assert sources_sending_during_flush=={"1", "2"}
+
+    for rank in 1, 2:
+        for i in range(1,10):
+            assert tangos.get_halo(i)['writer_test_%d'%rank]==i
@@ -0,0 +1,157 @@
+from __future__ import absolute_import
+import numpy as np
+import numpy.testing as npt
+
+import tangos
+import tangos.core.columnar
+import tangos.testing as testing
+import tangos.testing.simulation_generator
+from tangos import parallel_tasks, log
+from tangos.cached_writer import insert_list
+from tangos.tools import column_builder
+
+
+def setup():
+    parallel_tasks.use('null')
+    testing.init_blank_db_for_testing()
+
+    generator = tangos.testing.simulation_generator.TestSimulationGenerator()
+    generator.add_timestep()
+    generator.add_objects_to_timestep(5)
+    generator.add_properties_to_halos(Mvir=lambda i: 100.*(10-i), number=lambda i: i*2,
+                                      profile=lambda i: np.arange(i, i+3.0))
+    generator.add_bhs_to_timestep(2)
+    generator.add_properties_to_bhs(Mvir=lambda i: 5.0*i)
+
+    generator.add_timestep()
+    generator.add_objects_to_timestep(3)
+    generator.add_properties_to_halos(Mvir=lambda i: 10.*i)
+
+
+def _build_columns(*properties):
+    builder = column_builder.ColumnBuilder()
+    builder.parse_command_line(properties)
+    with log.LogCapturer():
+        builder.run_calculation_loop()
+
+
+def _num_columns(name=None):
+    query = tangos.get_default_session().query(tangos.core.columnar.PropertyColumn)
+    if name is not None:
+        query = query.filter_by(name_id=tangos.core.dictionary.get_dict_id(name))
+    return query.count()
+
+
+def _uses_column_store(ts, *plist):
+    description = tangos.live_calculation.parser.parse_property_names(*plist)
+    return description.values_sanitized_from_column_store(ts) is not None
+
+
+def test_columns_match_row_store():
+    ts = tangos.get_timestep("sim/ts1")
+    Mvir_rows, number_rows = ts.calculate_all("Mvir", "number")
+    _build_columns()
+    assert _uses_column_store(ts, "Mvir", "number")
+    Mvir_cols, number_cols = ts.calculate_all("Mvir", "number")
+    npt.assert_equal(Mvir_cols, Mvir_rows)
+    npt.assert_equal(number_cols, number_rows)
+    assert number_cols.dtype.kind == 'i'
+
+
+def test_array_property_not_packed():
+    _build_columns()
+    assert _num_columns("profile") == 0
+    ts = tangos.get_timestep("sim/ts1")
+    assert not _uses_column_store(ts, "profile")
+    assert not _uses_column_store(ts, "Mvir", "profile")
+    npt.assert_equal(ts.calculate_all("profile")[0][2], [3.0, 4.0, 5.0])
+
+
+def test_live_calculation_not_packed():
+    _build_columns()
+    ts = tangos.get_timestep("sim/ts1")
+    assert not _uses_column_store(ts, "Mvir*2")
+    npt.assert_equal(ts.calculate_all("Mvir*2")[0], [1800., 1600., 1400., 1200., 1000., 10., 20.])
+
+
+def test_object_typecode():
+    _build_columns()
+    ts = tangos.get_timestep("sim/ts1")
+    npt.assert_equal(ts.calculate_all("Mvir", object_type="halo")[0], [900., 800., 700., 600., 500.])
+    npt.assert_equal(ts.calculate_all("Mvir", object_type="BH")[0], [5., 10.])
+
+
+def test_in_place_update_invalidates_column():
+    _build_columns("Mvir")
+    ts = tangos.get_timestep("sim/ts2")
+    assert _uses_column_store(ts, "Mvir")
+    ts.halos[0]["Mvir"] = 123.0
+    tangos.get_default_session().commit()
+    assert not _uses_column_store(ts, "Mvir")
+    npt.assert_equal(ts.calculate_all("Mvir")[0], [123.0, 20.0, 30.0])
+
+
+def test_new_rows_make_column_stale():
+    ts = tangos.get_timestep("sim/ts2")
+    ts.halos[0]["unrefreshed"] = 1
+    tangos.get_default_session().commit()
+    _build_columns("unrefreshed")
+    assert _uses_column_store(ts, "unrefreshed")
+
+    session = tangos.get_default_session()
+    session.add(tangos.core.halo_data.HaloProperty(ts.halos[1],
+                                                   tangos.core.get_or_create_dictionary_item(session, "unrefreshed"),
+                                                   2))
+    session.commit()
+    assert not _uses_column_store(ts, "unrefreshed")
+    npt.assert_equal(ts.calculate_all("unrefreshed")[0], [1, 2])
+
+
+def test_insert_list_refreshes_column():
+    ts = tangos.get_timestep("sim/ts1")
+    insert_list([(ts.halos[0], "refreshed", 3)])
+    _build_columns("refreshed")
+    assert _num_columns("refreshed") == 1
+
+    insert_list([(ts.bhs[0], "refreshed", 7)])
+    assert _uses_column_store(ts, "refreshed")
+    npt.assert_equal(ts.calculate_all("refreshed")[0], [3, 7])
+
+
+def test_columns_only_refreshed_where_requested():
+    ts = tangos.get_timestep("sim/ts2")
+    insert_list([(ts.halos[0], "never_packed", 7)])
+    assert _num_columns("never_packed") == 0
+
+
+def test_insert_list_extends_column_without_rebuilding():
+    ts = tangos.get_timestep("sim/ts1")
+    halos = ts.halos.all()
+    bhs = ts.bhs.all()
+    insert_list([(halos[0], "extended", 1)])
+    _build_columns("extended")
+
+    original_build_column = tangos.core.columnar.build_column
+    def build_column_not_allowed(*args):
+        raise AssertionError("Column should have been extended, not rebuilt")
+    tangos.core.columnar.build_column = build_column_not_allowed
+    try:
+        insert_list([(halos[1], "extended", 2.5), (halos[2], "extended", 3)], bulk=False)
+        insert_list([(halos[3], "extended", 4)], bulk=False)
+        insert_list([(halos[4], "extended", 5), (bhs[0], "extended", 6)], bulk=True)
+        insert_list([(bhs[1], "extended", 7)], bulk=True)
+    finally:
+        tangos.core.columnar.build_column = original_build_column
+
+    assert _uses_column_store(ts, "extended")
+    npt.assert_equal(ts.calculate_all("extended")[0], [1, 2.5, 3, 4, 5, 6, 7])
+
+
+def test_insert_list_queries():
+    ts = tangos.get_timestep("sim/ts1")
+    halos = ts.halos.all()
+    tangos.get_default_session().commit() # expires the halos, as happens between batches in a writer
+    with testing.SqlExecutionTracker(tangos.core.get_default_engine()) as track:
+        insert_list([(h, "counted", 1.0) for h in halos], bulk=False)
+    # the halos need reloading in order to attach the new properties to them, but nothing more
+    assert track.count_statements_containing("SELECT") <= len(halos)+5
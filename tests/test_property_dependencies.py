@@ -0,0 +1,86 @@
+from __future__ import absolute_import
+from nose.tools import assert_raises
+
+import tangos.input_handlers as soh
+import tangos.properties as prop
+from tangos.properties import dependency_graph
+
+
+class DependencyTestHandler(soh.HandlerBase):
+    pass
+
+class DummySimulation(object):
+    def get_output_handler(self):
+        return DependencyTestHandler("dummy")
+
+class DependencyTestBase(prop.PropertyCalculation):
+    works_with_handler = DependencyTestHandler
+    requires_particle_data = True
+    requirements = []
+
+    def requires_property(self):
+        return self.requirements
+
+class DependencyTestRegion(DependencyTestBase):
+    def region_specification(self, db_data):
+        return slice(0, 10)
+
+class DepA(DependencyTestBase):
+    names = "dep_a"
+    requirements = ["dep_b"]
+
+class DepB(DependencyTestBase):
+    names = "dep_b", "dep_b2"
+    requirements = ["dep_c"]
+
+class DepC(DependencyTestBase):
+    names = "dep_c"
+
+class DepRegion1(DependencyTestRegion):
+    names = "dep_region_1"
+
+class DepRegion2(DependencyTestRegion):
+    names = "dep_region_2"
+    requirements = ["dep_c", "Mvir"] # Mvir is not calculated here, so does not affect the order
+
+class DepCycle1(DependencyTestBase):
+    names = "dep_cycle_1"
+    requirements = ["dep_cycle_2"]
+
+class DepCycle2(DependencyTestBase):
+    names = "dep_cycle_2"
+    requirements = ["dep_cycle_1"]
+
+
+def _instances(*names):
+    return prop.instantiate_classes(DummySimulation(), names)
+
+def _names(calculators):
+    return [c.names for c in calculators]
+
+def test_topological_order():
+    order = dependency_graph.calculation_order(_instances("dep_a", "dep_b", "dep_c"))
+    assert _names(order)==["dep_c", ("dep_b", "dep_b2"), "dep_a"]
+
+def test_independent_calculations_keep_order():
+    order = dependency_graph.calculation_order(_instances("dep_region_1", "dep_c"))
+    assert _names(order)==["dep_region_1", "dep_c"]
+
+def test_shared_regions_are_grouped():
+    order = dependency_graph.calculation_order(_instances("dep_region_1", "dep_c", "dep_region_2"))
+    assert _names(order)==["dep_c", "dep_region_1", "dep_region_2"] or \
+           _names(order)==["dep_region_1", "dep_c", "dep_region_2"]
+
+    order = dependency_graph.calculation_order(_instances("dep_region_1", "dep_b", "dep_c", "dep_region_2"))
+    region_positions = [i for i, c in enumerate(order) if isinstance(c, DependencyTestRegion)]
+    assert region_positions[1]==region_positions[0]+1
+
+def test_cycle_detected():
+    with assert_raises(dependency_graph.CircularDependencyError) as e:
+        dependency_graph.calculation_order(_instances("dep_a", "dep_cycle_1", "dep_cycle_2"))
+    assert "'dep_cycle_1' requires 'dep_cycle_2' requires 'dep_cycle_1'" in str(e.exception)
+
+def test_add_prerequisites():
+    calculators = dependency_graph.add_prerequisites(DummySimulation(), _instances("dep_a"))
+    assert [type(c) for c in calculators]==[DepA, DepB, DepC]
+    assert [type(c) for c in dependency_graph.calculation_order(calculators)]==[DepC, DepB, DepA]
@@ -149,6 +149,35 @@ def test_gather_linked_property_with_fn():
     npt.assert_allclose(BH_mass, [100.,200.,300.])
     npt.assert_allclose(Mv, [1.,2.,3.])
 
+def test_multi_level_links_share_temporary_table():
+    # start a new connection, on which no temporary tables have yet been created
+    tangos.core.get_default_session().commit()
+    ts = tangos.get_timestep("sim/ts1")
+    max_inline = tangos.config.temporary_halolist_max_inline
+    tangos.config.temporary_halolist_max_inline = 0 # otherwise these short lists of ids need no table at all
+    try:
+        with warnings.catch_warnings(), \
+             testing.SqlExecutionTracker(tangos.core.get_default_engine()) as track, \
+             testing.assert_connections_all_closed():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            BH_mass, Mv = ts.calculate_all("BH.host.BH.hole_mass", "BH.host.Mvir")
+    finally:
+        tangos.config.temporary_halolist_max_inline = max_inline
+    npt.assert_allclose(BH_mass, [100., 200., 300.])
+    npt.assert_allclose(Mv, [1., 2., 3.])
+    assert track.count_statements_containing("CREATE TEMPORARY TABLE")==1
+
+def test_multi_level_links_load_only_first_and_last_halos():
+    ts = tangos.get_timestep("sim/ts1")
+    with warnings.catch_warnings(), \
+         testing.SqlExecutionTracker(tangos.core.get_default_engine()) as track:
+        warnings.simplefilter("ignore", RuntimeWarning)
+        BH_mass, = ts.calculate_all("BH.host.BH.hole_mass")
+    npt.assert_allclose(BH_mass, [100., 200., 300.])
+    # the intermediate levels are followed from the halo ids, one query per level
+    assert track.count_statements_containing("SELECT halos.halo_type")==2
+    assert track.count_statements_containing("SELECT halolink.halo_from_id")==2
+
 def test_path_factorisation():
 
     TestPathChoice.num_calls = 0
@@ -249,4 +278,92 @@ def test_missing_or_broken_class():
     with warnings.catch_warnings(record=True) as w:
         brokenclass, = ts.calculate_all("brokenproperty")
     npt.assert_allclose(noclass, [0., 10., 20., 30.])
-    assert len(w)>0
\ No newline at end of file
+    assert len(w)>0
+
+def test_calculate_all_iter():
+    ts = tangos.get_timestep("sim/ts1")
+    chunks = list(ts.calculate_all_iter("Mvir", "dbid()", chunk_size=3))
+    assert len(chunks)==3 # 8 objects in total, of which 4 have Mvir
+    assert [len(c[0]) for c in chunks]==[3, 1, 0]
+    npt.assert_allclose(np.concatenate([c[0] for c in chunks[:2]]), [1, 2, 3, 4])
+
+    chunks = list(ts.calculate_all_iter("hole_mass", chunk_size=3, object_typetag='BH', limit=3))
+    assert [len(c[0]) for c in chunks]==[3]
+    npt.assert_allclose(chunks[0][0], [100., 200., 300.])
+
+def test_chunked_calculate_all():
+    ts = tangos.get_timestep("sim/ts1")
+    for calculation in ("RvirPlusMvir()", "BH.hole_mass", "hole_mass", "dbid()", "my_BH().hole_mass"):
+        unchunked = ts.calculate_all(calculation, "dbid()")
+        for chunk_size in (1, 3, 100):
+            chunked = ts.calculate_all(calculation, "dbid()", chunked=True, chunk_size=chunk_size)
+            for c, u in zip(chunked, unchunked):
+                npt.assert_equal(c, u)
+                assert c.dtype==u.dtype
+
+    no_results, = ts.calculate_all("hole_mass", object_typetag='halo', chunked=True, chunk_size=2)
+    assert len(no_results)==0
+
+def test_chunked_calculate_all_closes_connections():
+    ts = tangos.get_timestep("sim/ts1")
+    with db.testing.assert_connections_all_closed():
+        ts.calculate_all('RvirPlusMvir()', chunked=True, chunk_size=3)
+
+def test_calculate_all_timesteps():
+    sim = tangos.get_simulation("sim")
+    expected = [ts.calculate_all("Mvir", "RvirPlusMvir()") for ts in sim.timesteps]
+    for processes in (None, 2):
+        results = sim.calculate_all_timesteps("Mvir", "RvirPlusMvir()", processes=processes)
+        assert list(results.keys())==sim.timesteps
+        for ts_results, ts_expected in zip(results.values(), expected):
+            for r, e in zip(ts_results, ts_expected):
+                npt.assert_equal(r, e)
+
+    results = sim.calculate_all_timesteps("hole_mass", object_typetag='BH', processes=2)
+    npt.assert_allclose(results[sim.timesteps[0]][0], [100., 200., 300., 400.])
+
+def _assert_histories_match_individual_calculations(ts, calculations, progenitors=True):
+    offsets, values = (ts.calculate_all_for_progenitors if progenitors else ts.calculate_all_for_descendants)(
+        *calculations)
+    halos = sorted(ts.objects.all(), key=lambda h: h.id)
+    assert len(offsets)==len(halos)+1
+    for i, halo in enumerate(halos):
+        if progenitors:
+            expected = halo.calculate_for_progenitors(*calculations)
+        else:
+            expected = halo.calculate_for_descendants(*calculations)
+        for v, e in zip(values, expected):
+            npt.assert_equal(v[offsets[i]:offsets[i+1]], e)
+
+def test_calculate_all_for_progenitors():
+    for ts_name in ("sim/ts3", "sim/ts2", "sim/ts5"):
+        ts = tangos.get_timestep(ts_name)
+        _assert_histories_match_individual_calculations(ts, ("Mvir", "Rvir"))
+        _assert_histories_match_individual_calculations(ts, ("dbid()", "BH.hole_mass"))
+
+    offsets, (Mvir, ) = tangos.get_timestep("sim/ts3").calculate_all_for_progenitors("Mvir", nmax=1,
+                                                                                   object_typetag='halo')
+    npt.assert_equal(offsets, [0, 2, 4, 6])
+    npt.assert_allclose(Mvir, [9, 5, 10, 6, 11, 7])
+
+def test_calculate_all_for_descendants():
+    for ts_name in ("sim/ts1", "sim/ts4"):
+        _assert_histories_match_individual_calculations(tangos.get_timestep(ts_name), ("Mvir", "dbid()"),
+                                                        progenitors=False)
+
+def test_calculate_for_progenitors_of_many_halos():
+    from tangos.live_calculation import histories
+    from tangos.relation_finding import branches
+    halos = [tangos.get_halo("sim/ts3/2"), tangos.get_halo("sim/ts3/1"), tangos.get_halo("sim/ts2/1")]
+    offsets, (Mvir, ) = histories.calculate_for_progenitors(halos, "Mvir")
+    branches.build_branches(tangos.core.get_default_session(), tangos.get_simulation("sim"))
+    try:
+        offsets_from_branches, (Mvir_from_branches, ) = histories.calculate_for_progenitors([h.id for h in halos], "Mvir")
+    finally:
+        tangos.core.get_default_session().query(tangos.core.HaloBranch).delete()
+        tangos.core.get_default_session().query(tangos.core.BranchBuild).delete()
+        tangos.core.get_default_session().commit()
+
+    for o, M in ((offsets, Mvir), (offsets_from_branches, Mvir_from_branches)):
+        npt.assert_equal(o, [0, 3, 6, 8])
+        npt.assert_allclose(M, [10, 6, 2, 9, 5, 1, 5, 1])
@@ -0,0 +1,132 @@
+from __future__ import absolute_import
+import shutil
+import tempfile
+
+import numpy as np
+import numpy.testing as npt
+
+import tangos
+import tangos.testing as testing
+import tangos.testing.simulation_generator
+from tangos.live_calculation import result_cache
+
+_cache_path = None
+
+def setup():
+    global _cache_path
+    _cache_path = tempfile.mkdtemp()
+    testing.init_blank_db_for_testing()
+
+    generator = tangos.testing.simulation_generator.TestSimulationGenerator()
+    for i in range(3):
+        generator.add_timestep()
+        generator.add_objects_to_timestep(3)
+        generator.add_properties_to_halos(Mvir=lambda i: 10.*i, profile=lambda i: np.arange(i, i+3.0))
+        generator.add_bhs_to_timestep(1)
+        if i>0:
+            generator.link_last_halos()
+
+def teardown():
+    result_cache.disable()
+    shutil.rmtree(_cache_path)
+
+def _queries(function):
+    """Return the result of the function and the number of SQL statements it issued"""
+    with testing.SqlExecutionTracker(tangos.core.get_default_engine()) as track:
+        result = function()
+    return result, track.count
+
+def test_disabled_by_default():
+    assert result_cache.get_cache() is None
+    assert result_cache.cache_info() is None
+    _, nqueries = _queries(lambda: tangos.get_timestep("sim/ts1").calculate_all("Mvir", "profile"))
+    assert nqueries>1
+
+def test_calculate_all():
+    result_cache.enable(max_bytes=10**6)
+    ts = tangos.get_timestep("sim/ts1")
+    (Mvir, profile_value), nqueries = _queries(lambda: ts.calculate_all("Mvir", "profile"))
+    assert nqueries>1
+    assert result_cache.cache_info().misses==1
+
+    (Mvir2, profile_value2), nqueries = _queries(lambda: ts.calculate_all("Mvir", "profile"))
+    assert nqueries==1 # only the revision token is queried
+    assert result_cache.cache_info().hits==1
+    npt.assert_equal(Mvir, Mvir2)
+    npt.assert_equal(profile_value, profile_value2)
+
+    # results are copies, so that the cached version cannot be modified
+    Mvir2[:] = 0
+    npt.assert_equal(ts.calculate_all("Mvir")[0], Mvir)
+
+    # the expression is normalised, so that equivalent formulations share an entry
+    ts.calculate_all("Mvir*2")
+    _, nqueries = _queries(lambda: ts.calculate_all("Mvir * 2"))
+    assert nqueries==1
+
+    # different targets are cached separately
+    assert len(ts.calculate_all("Mvir", object_typetag='BH')[0])==0
+
+def test_calculate_for_progenitors():
+    result_cache.enable(max_bytes=10**6)
+    halo = tangos.get_halo("sim/ts3/1")
+    Mvir, = halo.calculate_for_progenitors("Mvir")
+    assert len(Mvir)==3
+    _, nqueries = _queries(lambda: halo.calculate_for_progenitors("Mvir"))
+    assert nqueries==1 # only the revision token is queried
+    assert len(halo.calculate_for_progenitors("Mvir", nmax=1)[0])==2
+
+def test_database_changes_invalidate():
+    result_cache.enable(max_bytes=10**6)
+    tangos.get_halo("sim/ts1/1")["new_property"] = 0.0
+    tangos.get_default_session().commit()
+    ts = tangos.get_timestep("sim/ts2")
+    assert len(ts.calculate_all("Mvir", "new_property")[0])==0
+
+    halo = tangos.get_halo("sim/ts2/1")
+    halo["new_property"] = 1.0
+    tangos.get_default_session().commit()
+    npt.assert_equal(ts.calculate_all("Mvir", "new_property")[1], [1.0])
+
+    # in-place updates are not detected by the revision token, so the cache is explicitly invalidated
+    halo["new_property"] = 2.0
+    tangos.get_default_session().commit()
+    npt.assert_equal(ts.calculate_all("Mvir", "new_property")[1], [2.0])
+
+def test_halos_not_cached():
+    result_cache.enable(max_bytes=10**6)
+    ts = tangos.get_timestep("sim/ts1")
+    ts.calculate_all("later(1)")
+    _, nqueries = _queries(lambda: ts.calculate_all("later(1)"))
+    assert nqueries>1
+
+def test_byte_budget():
+    result_cache.enable(max_bytes=100)
+    ts = tangos.get_timestep("sim/ts1")
+    ts.calculate_all("Mvir", "dbid()")  # 3 floats and 3 ints: 48 bytes
+    ts.calculate_all("Mvir*2", "dbid()")
+    assert result_cache.cache_info().currsize==96
+    ts.calculate_all("Mvir*3", "dbid()")
+    assert result_cache.cache_info().currsize==96
+
+    # the least recently used result has been evicted
+    _, nqueries = _queries(lambda: ts.calculate_all("Mvir", "dbid()"))
+    assert nqueries>1
+    _, nqueries = _queries(lambda: ts.calculate_all("Mvir*3", "dbid()"))
+    assert nqueries==1 # only the revision token is queried
+
+def test_disk_cache():
+    result_cache.enable(max_bytes=0, path=_cache_path)
+    ts = tangos.get_timestep("sim/ts1")
+    Mvir, = ts.calculate_all("Mvir")
+
+    # a new cache with the same folder, e.g. in another process
+    result_cache.enable(max_bytes=10**6, path=_cache_path)
+    (Mvir2, ), nqueries = _queries(lambda: ts.calculate_all("Mvir"))
+    assert nqueries==1 # only the revision token is queried
+    assert result_cache.cache_info().disk_hits==1
+    npt.assert_equal(Mvir, Mvir2)
+
+    result_cache.invalidate()
+    _, nqueries = _queries(lambda: ts.calculate_all("Mvir"))
+    assert nqueries>1
@@ -0,0 +1,114 @@
+from __future__ import absolute_import
+import numpy as np
+import numpy.testing as npt
+
+import tangos
+import tangos.live_calculation.parser
+import tangos.testing as testing
+import tangos.testing.simulation_generator
+from tangos.core.halo import Halo
+
+
+def setup():
+    testing.init_blank_db_for_testing()
+
+    generator = tangos.testing.simulation_generator.TestSimulationGenerator()
+    generator.add_timestep()
+    generator.add_objects_to_timestep(5)
+    generator.add_properties_to_halos(Mvir=lambda i: 100.*(10-i), number=lambda i: i*2,
+                                      profile=lambda i: np.arange(i, i+3.0))
+    generator.add_bhs_to_timestep(2)
+    generator.add_properties_to_bhs(BH_mass=lambda i: 5.0*i)
+
+    session = tangos.get_default_session()
+    ts = tangos.get_timestep("sim/ts1")
+    for h in ts.halos.all()[:4]:
+        h['Mgas'] = 0.1*h.calculate("Mvir")
+    session.commit()
+
+    generator.add_timestep()
+    generator.add_objects_to_timestep(3)
+    generator.add_properties_to_halos(Mvir=lambda i: 10.*i)
+    ts2 = tangos.get_timestep("sim/ts2")
+    Mvir = tangos.core.dictionary.get_or_create_dictionary_item(session, "Mvir")
+    session.add(tangos.core.halo_data.HaloProperty(ts2.halos.all()[0], Mvir, 20.0)) # a second value for sim/ts2/1
+    session.commit()
+
+
+def _description(*plist):
+    return tangos.live_calculation.parser.parse_property_names(*plist)
+
+def _compiled(ts, *plist, **kwargs):
+    return _description(*plist).values_sanitized_from_scalar_sql(ts, **kwargs)
+
+def _uncompiled(ts, *plist, **kwargs):
+    """Evaluate the calculation by hydrating ORM objects, as the usual live-calculation engine does"""
+    description = _description(*plist)
+    session = tangos.core.Session()
+    try:
+        query = session.query(Halo).filter_by(timestep_id=ts.id)
+        if kwargs.get('object_typecode', None) is not None:
+            query = query.filter_by(object_typecode=kwargs['object_typecode'])
+        halos = description.supplement_halo_query(query).order_by(Halo.id).all()
+        return description.values_sanitized(halos)
+    finally:
+        session.close()
+
+def _assert_compiled_matches(ts, *plist, **kwargs):
+    compiled = _compiled(ts, *plist, **kwargs)
+    assert compiled is not None
+    uncompiled = _uncompiled(ts, *plist, **kwargs)
+    assert len(compiled)==len(uncompiled)
+    for c, u in zip(compiled, uncompiled):
+        npt.assert_equal(c, u)
+        assert c.dtype==u.dtype, (c.dtype, u.dtype)
+    return compiled
+
+
+def test_stored_scalars():
+    ts = tangos.get_timestep("sim/ts1")
+    Mvir, number, dbid = _assert_compiled_matches(ts, "Mvir", "number", "dbid()")
+    assert len(Mvir)==5
+    assert number.dtype.kind=='i'
+
+def test_arithmetic():
+    ts = tangos.get_timestep("sim/ts1")
+    for expression in ("Mgas/Mvir", "Mvir*2", "Mvir-number", "number/2", "Mvir>500", "(Mvir>500) & (number<6)",
+                       "abs(0-Mvir)", "log10(Mvir)", "sqrt(number)", "Mvir**0.5", "halo_number()+finder_id()"):
+        _assert_compiled_matches(ts, expression, "dbid()")
+
+def test_missing_values_are_omitted():
+    ts = tangos.get_timestep("sim/ts1")
+    ratio, Mvir = _assert_compiled_matches(ts, "Mgas/Mvir", "Mvir")
+    assert len(ratio)==4
+    npt.assert_allclose(ratio, 0.1)
+
+def test_object_type():
+    ts = tangos.get_timestep("sim/ts1")
+    _assert_compiled_matches(ts, "BH_mass", "halo_number()", object_typecode=1)
+    assert len(_compiled(ts, "dbid()", object_typecode=0)[0])==5
+    assert len(_compiled(ts, "Mvir", object_typecode=1)[0])==0
+
+def test_calculate_all_uses_compiler():
+    ts = tangos.get_timestep("sim/ts1")
+    with testing.SqlExecutionTracker(tangos.core.get_default_engine()) as track:
+        Mvir, ratio = ts.calculate_all("Mvir", "Mgas/Mvir")
+    assert "select halos.halo_type" not in track
+    npt.assert_allclose(ratio, 0.1)
+    assert len(Mvir)==4
+
+def test_falls_back():
+    ts = tangos.get_timestep("sim/ts1")
+    # arrays, non-scalar functions, links and unknown names cannot be compiled
+    assert _compiled(ts, "profile") is None
+    assert _compiled(ts, "at(1.0,profile)") is None
+    assert _compiled(ts, "t()") is None
+    assert _compiled(ts, "BH.BH_mass") is None
+    assert _compiled(ts, "raw(Mvir)") is None
+    assert _compiled(ts, "nonexistent_property") is None
+
+    # multiple values for one halo must be resolved by the usual engine
+    ts2 = tangos.get_timestep("sim/ts2")
+    assert _compiled(ts2, "Mvir") is None
+    npt.assert_allclose(ts2.calculate_all("Mvir")[0], [10., 20., 30.])
+    npt.assert_equal(ts2.calculate_all("Mvir")[0], _uncompiled(ts2, "Mvir")[0])
@@ -0,0 +1,71 @@
+from __future__ import absolute_import
+
+import tangos
+import tangos.testing as testing
+import tangos.testing.simulation_generator
+from tangos import temporary_halolist as thl
+
+
+def setup():
+    testing.init_blank_db_for_testing()
+
+    generator = tangos.testing.simulation_generator.TestSimulationGenerator()
+    generator.add_timestep()
+    generator.add_objects_to_timestep(30)
+
+def _halo_ids(n):
+    return [h.id for h in tangos.get_timestep("sim/ts1").halos.order_by(tangos.core.halo.Halo.halo_number).all()[:n]]
+
+def _track():
+    return testing.SqlExecutionTracker(tangos.core.get_default_engine())
+
+def test_short_list_is_inline():
+    ids = _halo_ids(3)
+    ids_with_duplicates = [ids[2], None, ids[0], ids[2]]
+    session = tangos.core.Session()
+    try:
+        with _track() as track:
+            with thl.temporary_halolist_table(session, ids_with_duplicates) as table:
+                halos = thl.all_halos_with_duplicates(table)
+                distinct_halos = thl.halo_query(table).all()
+        assert "CREATE TEMPORARY TABLE" not in track
+        assert [h.id if h is not None else None for h in halos]==ids_with_duplicates
+        assert sorted(h.id for h in distinct_halos)==sorted(ids[::2])
+    finally:
+        session.close()
+
+def test_long_list_uses_pooled_table():
+    ids = _halo_ids(30)[::-1]
+    tables_registered = set(tangos.core.Base.metadata.tables.keys())
+    session = tangos.core.Session()
+    try:
+        with _track() as track:
+            for i in range(3):
+                with thl.temporary_halolist_table(session, ids) as table:
+                    assert [h.id for h in thl.all_halos_with_duplicates(table)]==ids
+        assert track.count_statements_containing("CREATE TEMPORARY TABLE")<=1
+        assert track.count_statements_containing("DROP TABLE")==0
+    finally:
+        session.close()
+    assert set(tangos.core.Base.metadata.tables.keys())==tables_registered
+
+def test_pooled_table_survives_rollback():
+    ids = _halo_ids(30)
+    connection = tangos.core.get_default_engine().connect()
+    try:
+        for i in range(2):
+            transaction = connection.begin()
+            session = tangos.core.Session(bind=connection)
+            with thl.temporary_halolist_table(session, ids) as table:
+                assert len(thl.halo_query(table).all())==30
+            transaction.rollback()
+    finally:
+        connection.close()
+
+def test_empty_list():
+    session = tangos.core.Session()
+    try:
+        with thl.temporary_halolist_table(session, []) as table:
+            assert thl.all_halos_with_duplicates(table)==[]
+    finally:
+        session.close()